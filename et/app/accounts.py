@@ -0,0 +1,66 @@
+"""Authenticated user lookup through the cache framework.
+
+``django.contrib.auth`` fetches the ``User`` row on every request.
+``CachedAuthenticationMiddleware`` keeps it in the default cache for
+``AUTH_USER_CACHE_TIMEOUT`` seconds instead. The session hash is still
+checked on every request, so a password change logs other sessions out as
+soon as the cached copy is dropped. The copy is dropped whenever the user is
+saved or deleted, and on logout (see ``app.signals``). That only reaches
+every worker process through a shared cache, so ``app.checks`` refuses a
+timeout on a per-process one.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+
+def timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 0)
+
+
+def _key(user_id):
+    return f'app:user:{user_id}'
+
+
+def forget(user_id):
+    cache.delete(_key(user_id))
+
+
+def _verified(request, user):
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not session_hash:
+        return False
+    if constant_time_compare(session_hash, user.get_session_auth_hash()):
+        return True
+    # Sessions signed with a retired SECRET_KEY stay valid, as in Django.
+    for fallback in settings.SECRET_KEY_FALLBACKS:
+        if constant_time_compare(session_hash, user._get_session_auth_hash(secret=fallback)):
+            request.session.cycle_key()
+            request.session[auth.HASH_SESSION_KEY] = user.get_session_auth_hash()
+            return True
+    return False
+
+
+def get_user(request):
+    """Return the request's user, reading the ``User`` row from the cache."""
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    user = cache.get(_key(user_id))
+    if user is None:
+        user = auth.load_backend(backend_path).get_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        cache.set(_key(user_id), user, timeout())
+
+    if not _verified(request, user):
+        request.session.flush()
+        return AnonymousUser()
+    return user
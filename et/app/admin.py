@@ -1,5 +1,86 @@
 from django.contrib import admin
-from .models import Expense, Category
+from django.db import transaction
+from django.http import QueryDict
 
-admin.site.register(Expense)
+from . import sharding, summaries
+from .models import Expense, Category, RecurringTransaction
+
+SHARD_PARAM = 'shard'
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Picks the shard a changelist reads; ``ShardedAdmin`` does the routing."""
+
+    title = 'shard'
+    parameter_name = SHARD_PARAM
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.aliases()]
+
+    def value(self):
+        return super().value() or sharding.aliases()[0]
+
+    def choices(self, changelist):
+        # No "All" entry: a changelist pages and sorts within one database.
+        for choice in list(super().choices(changelist))[1:]:
+            yield choice
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    """Admin of a per-user model, reading the shard picked in the changelist.
+
+    Ids repeat across shards, so the change and delete views take the shard
+    from the changelist filters the admin carries over to them. Rows are
+    written to their user's shard, so the user of a row cannot be changed.
+    """
+
+    def shard(self, request):
+        alias = request.GET.get(SHARD_PARAM)
+        if alias is None:
+            alias = QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_PARAM)
+        return alias if alias in sharding.aliases() else sharding.aliases()[0]
+
+    def get_list_filter(self, request):
+        filters = list(super().get_list_filter(request))
+        return [ShardFilter] + filters if sharding.enabled() else filters
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(self.shard(request))
+
+    def get_readonly_fields(self, request, obj=None):
+        fields = list(super().get_readonly_fields(request, obj))
+        return fields + ['user'] if obj is not None and sharding.enabled() else fields
+
+
+class ExpenseAdmin(ShardedAdmin):
+    # Admin edits go through the same rollup bookkeeping as the app views.
+
+    def save_model(self, request, obj, form, change):
+        alias = sharding.for_user(obj.user_id)
+        with sharding.use(alias), transaction.atomic(using=alias):
+            if change:
+                summaries.record(Expense.objects.get(pk=obj.pk), -1)
+                if 'date' in form.changed_data:
+                    # See ExpenseForm.clean.
+                    obj.recurring = None
+            super().save_model(request, obj, form, change)
+            summaries.record(obj)
+
+    def delete_model(self, request, obj):
+        alias = sharding.for_user(obj.user_id)
+        with sharding.use(alias), transaction.atomic(using=alias):
+            summaries.record(obj, -1)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with sharding.use(queryset.db), transaction.atomic(using=queryset.db):
+            summaries.record_many(queryset, -1)
+            super().delete_queryset(request, queryset)
+
+
+admin.site.register(Expense, ExpenseAdmin)
 admin.site.register(Category)
+admin.site.register(RecurringTransaction, ShardedAdmin)
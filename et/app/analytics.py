@@ -0,0 +1,173 @@
+"""Vectorized spending analytics over a user's whole history.
+
+A user's ``(date, amount, type, category_id)`` columns are loaded once into
+compact NumPy arrays and every series (daily/weekly/monthly totals, rolling
+averages, year-over-year) is computed from them with ``bincount`` and
+cumulative sums instead of one aggregate query per period.
+
+Arrays are cached per process and keyed on the user's ``DataVersion``, so
+any write to their expenses makes the next call reload them.
+
+NumPy is optional: without it ``available()`` is false and the analytics
+endpoint reports that the feature is disabled.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+from . import versions
+from .models import ArchivedExpense, Expense
+
+CACHE_SIZE = 64
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def available():
+    return np is not None
+
+
+class History:
+    """Column arrays of one user's transactions, sorted by date."""
+
+    def __init__(self, rows):
+        dates, cents, types, category = zip(*rows) if rows else ((), (), (), ())
+        self.dates = np.array(dates, dtype='datetime64[D]')
+        self.cents = np.array(cents, dtype=np.int64)
+        self.is_income = np.array(types, dtype=object) == 'income'
+        self.category = np.array(
+            [-1 if pk is None else pk for pk in category], dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.dates)
+
+
+def history(user, version=None):
+    """Return the cached ``History`` for ``user``, reloading it after writes.
+
+    ``version`` is the user's current ``DataVersion`` number, if the caller
+    has already looked it up.
+    """
+    if version is None:
+        version, _ = versions.current(user)
+    with _lock:
+        entry = _cache.get(user.pk)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(user.pk)
+            return entry[1]
+
+    # Amounts come back as integer cents so no Decimal is built per row;
+    # archived years are read in the same query.
+    hot, archived = (
+        model.objects
+        .filter(user=user)
+        .annotate(cents=Cast(Round(F('amount') * 100), BigIntegerField()))
+        .values_list('date', 'cents', 'type', 'category_id', 'id')
+        .order_by()
+        for model in (Expense, ArchivedExpense)
+    )
+    rows = [row[:4] for row in hot.union(archived, all=True).order_by('date', 'id')]
+    loaded = History(rows)
+
+    with _lock:
+        _cache[user.pk] = (version, loaded)
+        _cache.move_to_end(user.pk)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return loaded
+
+
+def _period_starts(start, end, granularity):
+    """``datetime64`` start of every period covering ``[start, end]``."""
+    if granularity == 'month':
+        first = np.datetime64(start, 'M')
+        return np.arange(first, np.datetime64(end, 'M') + 1).astype('datetime64[D]')
+    if granularity == 'week':
+        monday = start - timedelta(days=start.weekday())
+        return np.arange(np.datetime64(monday), np.datetime64(end) + 1, 7)
+    return np.arange(np.datetime64(start), np.datetime64(end) + 1)
+
+
+def _bin(data, starts, granularity):
+    """Index of the period each transaction falls into."""
+    if granularity == 'month':
+        return (data.dates.astype('datetime64[M]') - starts[0].astype('datetime64[M]')).astype(np.int64)
+    step = 7 if granularity == 'week' else 1
+    return (data.dates - starts[0]).astype(np.int64) // step
+
+
+def totals(data, start, end, granularity='month'):
+    """Income and expense totals per period between ``start`` and ``end``."""
+    starts = _period_starts(start, end, granularity)
+
+    in_range = (data.dates >= np.datetime64(start)) & (data.dates <= np.datetime64(end))
+    bins = _bin(data, starts, granularity)[in_range]
+    cents = data.cents[in_range]
+    is_income = data.is_income[in_range]
+
+    income = np.bincount(bins[is_income], weights=cents[is_income], minlength=len(starts))
+    expense = np.bincount(bins[~is_income], weights=cents[~is_income], minlength=len(starts))
+
+    return {
+        'labels': [str(day) for day in starts],
+        'income': (income / 100).round(2).tolist(),
+        'expense': (expense / 100).round(2).tolist(),
+    }
+
+
+def rolling_average(data, start, end, windows=(30, 90)):
+    """Daily expense spend and its trailing moving averages."""
+    widest = max(windows)
+    first = np.datetime64(start) - (widest - 1)
+    days = (np.datetime64(end) - first).astype(np.int64) + 1
+
+    mask = (~data.is_income) & (data.dates >= first) & (data.dates <= np.datetime64(end))
+    offsets = (data.dates[mask] - first).astype(np.int64)
+    daily = np.bincount(offsets, weights=data.cents[mask], minlength=days) / 100
+
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+    visible = slice(widest - 1, days)
+    series = {
+        'labels': [str(day) for day in np.arange(np.datetime64(start), np.datetime64(end) + 1)],
+        'daily': daily[visible].round(2).tolist(),
+    }
+    for window in windows:
+        averages = (cumulative[window:] - cumulative[:-window]) / window
+        series[f'avg_{window}'] = averages[widest - window:].round(2).tolist()
+    return series
+
+
+def year_over_year(data, year):
+    """Monthly expense totals for ``year`` next to the year before."""
+    previous = totals(data, date(year - 1, 1, 1), date(year - 1, 12, 31), 'month')
+    current = totals(data, date(year, 1, 1), date(year, 12, 31), 'month')
+    return {
+        'labels': [date(year, month, 1).strftime('%b') for month in range(1, 13)],
+        'current': current['expense'],
+        'previous': previous['expense'],
+    }
+
+
+def category_totals(data, start, end):
+    """Expense totals per category id (``None`` for uncategorised)."""
+    mask = (
+        (~data.is_income)
+        & (data.dates >= np.datetime64(start))
+        & (data.dates <= np.datetime64(end))
+    )
+    ids, inverse = np.unique(data.category[mask], return_inverse=True)
+    sums = np.bincount(inverse, weights=data.cents[mask], minlength=len(ids)) / 100
+    return {
+        (None if category_id == -1 else int(category_id)): round(float(total), 2)
+        for category_id, total in zip(ids, sums)
+    }
@@ -0,0 +1,308 @@
+"""Spending-anomaly detection from running per-category statistics.
+
+``SpendingStats`` holds, per user and category, the count, mean and sum of
+squared deviations (``m2``) of the user's expense amounts. Every write that
+goes through ``app.summaries`` feeds them: ``collect`` adds each expense to
+a ``Batch`` with Welford's online update, and ``apply`` merges the batch
+into the stored rows with the parallel (Chan) formula, or its inverse for
+removed rows. A write touches a row per category, never the history.
+``rebuild`` recomputes everything from the raw rows, with NumPy if it is
+installed.
+
+A transaction is unusual when it lies more than ``THRESHOLD`` standard
+deviations above the mean of the user's other expenses in its category. A
+month's spend in a category is unusual when it lies that far above what its
+number of transactions costs on average. Both need ``MIN_COUNT`` other
+transactions first.
+"""
+import math
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+from django.db import transaction
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Coalesce, Round
+
+from . import sharding
+from .models import ArchivedExpense, Expense, SpendingStats
+
+MIN_COUNT = 5
+THRESHOLD = 3.0
+
+CHUNK_SIZE = 500
+
+
+class Running:
+    """Count, mean and sum of squared deviations of a series of amounts."""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Add the values summarized by ``other``."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def remove(self, other):
+        """Take out the values summarized by ``other``; the inverse of ``merge``."""
+        if not other.count:
+            return
+        count = self.count - other.count
+        if count <= 0:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.count * self.mean - other.count * other.mean) / count
+        delta = other.mean - mean
+        self.m2 = max(self.m2 - other.m2 - delta * delta * count * other.count / self.count, 0.0)
+        self.mean = mean
+        self.count = count
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def score(self, amount, count=1):
+        """How many standard deviations ``amount`` lies above average.
+
+        ``amount`` is the sum of ``count`` transactions. ``None`` without
+        enough history, or without any spread in it, to tell.
+        """
+        std = self.std * math.sqrt(count)
+        if self.count < MIN_COUNT or std < 0.01:
+            return None
+        return (float(amount) - count * self.mean) / std
+
+    def is_unusual(self, amount, count=1):
+        """Whether ``amount``, already counted here, stands out from the rest.
+
+        It is scored against the statistics without it, so a single large
+        outlier cannot hide itself by inflating the spread. For a month
+        (``count > 1``) its transactions' own spread is unknown and taken as
+        zero, which overstates the rest's spread and errs towards silence.
+        """
+        rest = Running(self.count, self.mean, self.m2)
+        rest.remove(Running(count, float(amount) / count, 0.0))
+        score = rest.score(amount, count)
+        return score is not None and score > THRESHOLD
+
+
+class Batch:
+    """Expense amounts added and removed by one write, per ``(user_id, category_id)``."""
+
+    def __init__(self):
+        self.added = defaultdict(Running)
+        self.removed = defaultdict(Running)
+
+    def add(self, expense, sign=1):
+        if expense.type != 'expense':
+            return
+        side = self.added if sign > 0 else self.removed
+        side[(expense.user_id, expense.category_id)].add(float(expense.amount))
+
+    def keys(self):
+        return self.added.keys() | self.removed.keys()
+
+
+def apply(batch):
+    """Merge ``batch`` into the stored statistics of the selected shard.
+
+    Called by ``summaries.apply`` inside the transaction of the rollup.
+    """
+    keys = batch.keys()
+    if not keys:
+        return
+
+    user_ids = sorted({user_id for user_id, _ in keys})
+    existing = {}
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        rows = (
+            SpendingStats.objects
+            .select_for_update()
+            .filter(user_id__in=user_ids[start:start + CHUNK_SIZE])
+            .order_by('pk')
+        )
+        for stats in rows:
+            existing[(stats.user_id, stats.category_id)] = stats
+
+    created = []
+    for key in keys:
+        stats = existing.get(key)
+        running = Running(stats.count, stats.mean, stats.m2) if stats else Running()
+        if key in batch.removed:
+            running.remove(batch.removed[key])
+        if key in batch.added:
+            running.merge(batch.added[key])
+
+        if stats is None:
+            if running.count:
+                created.append(SpendingStats(
+                    user_id=key[0], category_id=key[1],
+                    count=running.count, mean=running.mean, m2=running.m2,
+                ))
+        elif not running.count:
+            SpendingStats.objects.filter(pk=stats.pk).delete()
+        else:
+            SpendingStats.objects.filter(pk=stats.pk).update(
+                count=running.count, mean=running.mean, m2=running.m2,
+            )
+    SpendingStats.objects.bulk_create(created, batch_size=CHUNK_SIZE)
+
+
+def detach(category):
+    """Fold each user's statistics for ``category`` into their uncategorized ones.
+
+    For the selected shard, before the category's expenses lose it.
+    """
+    rows = list(SpendingStats.objects.select_for_update().filter(category=category))
+    if not rows:
+        return
+    uncategorized = {
+        stats.user_id: stats
+        for stats in SpendingStats.objects.select_for_update().filter(
+            user_id__in=[row.user_id for row in rows], category=None,
+        )
+    }
+    for row in rows:
+        target = uncategorized.get(row.user_id)
+        if target is None:
+            SpendingStats.objects.filter(pk=row.pk).update(category=None)
+            continue
+        running = Running(target.count, target.mean, target.m2)
+        running.merge(Running(row.count, row.mean, row.m2))
+        SpendingStats.objects.filter(pk=target.pk).update(
+            count=running.count, mean=running.mean, m2=running.m2,
+        )
+        SpendingStats.objects.filter(pk=row.pk).delete()
+
+
+def _amounts(user):
+    """``(user_id, category_id, cents)`` of every expense, archived ones included.
+
+    A missing category reads as ``-1``, so the rows load straight into NumPy.
+    """
+    querysets = []
+    for model in (Expense, ArchivedExpense):
+        rows = model.objects.filter(type='expense')
+        if user is not None:
+            rows = rows.filter(user=user)
+        querysets.append(
+            rows
+            .annotate(
+                category_ref=Coalesce('category_id', -1),
+                cents=Cast(Round(F('amount') * 100), BigIntegerField()),
+            )
+            .values_list('user_id', 'category_ref', 'cents')
+            .order_by()
+        )
+    hot, archived = querysets
+    return list(hot.union(archived, all=True))
+
+
+def _summarize(rows):
+    """``[(user_id, category_id, Running), ...]`` for the given amount rows."""
+    if np is None:
+        groups = defaultdict(Running)
+        for user_id, category_id, cents in rows:
+            groups[(user_id, category_id)].add(cents / 100)
+        summary = [(user_id, category_id, running) for (user_id, category_id), running in groups.items()]
+    elif rows:
+        columns = np.array(rows, dtype=np.int64)
+        # One integer key per (user, category) pair sorts far faster than rows.
+        width = int(columns[:, 1].max()) + 2
+        keys, group = np.unique(columns[:, 0] * width + columns[:, 1] + 1, return_inverse=True)
+        amounts = columns[:, 2] / 100
+        counts = np.bincount(group)
+        means = np.bincount(group, weights=amounts) / counts
+        # Two passes: deviations from the group mean, not raw sums of squares.
+        m2 = np.bincount(group, weights=(amounts - means[group]) ** 2)
+        summary = [
+            (int(key // width), int(key % width) - 1, Running(int(n), float(mean), float(dev)))
+            for key, n, mean, dev in zip(keys, counts, means, m2)
+        ]
+    else:
+        summary = []
+    return [
+        (user_id, None if category_id == -1 else category_id, running)
+        for user_id, category_id, running in summary
+    ]
+
+
+def rebuild(user=None):
+    """Recompute the statistics from ``Expense`` and its archive, for one user or everyone."""
+    stats = SpendingStats.objects.all()
+    if user is not None:
+        stats = stats.filter(user=user)
+
+    count = 0
+    for alias in [sharding.for_user(user)] if user is not None else sharding.aliases():
+        with sharding.use(alias), transaction.atomic(using=alias):
+            stats.delete()
+            count += len(SpendingStats.objects.bulk_create(
+                (
+                    SpendingStats(
+                        user_id=user_id, category_id=category_id,
+                        count=running.count, mean=running.mean, m2=running.m2,
+                    )
+                    for user_id, category_id, running in _summarize(_amounts(user))
+                ),
+                batch_size=1000,
+            ))
+    return count
+
+
+def for_user(user):
+    """``{category_id: Running}`` of ``user``'s statistics."""
+    return {
+        category_id: Running(count, mean, m2)
+        for category_id, count, mean, m2 in (
+            SpendingStats.objects.filter(user=user)
+            .values_list('category_id', 'count', 'mean', 'm2')
+        )
+    }
+
+
+def unusual_expenses(stats, expenses):
+    """Ids of the ``expenses`` unusually large for their category."""
+    unusual = set()
+    for expense in expenses:
+        running = stats.get(expense.category_id)
+        if expense.type == 'expense' and running and running.is_unusual(expense.amount):
+            unusual.add(expense.pk)
+    return unusual
+
+
+def unusual_months(stats, category_months):
+    """``(month, category_id, total, expected)`` for unusual months of spend.
+
+    ``category_months`` maps ``(month, category_id)`` to the month's
+    ``(total, count)`` of expenses in that category.
+    """
+    unusual = []
+    for (month, category_id), (total, count) in category_months.items():
+        running = stats.get(category_id)
+        if running and running.is_unusual(total, count):
+            unusual.append((month, category_id, total, round(running.mean * count, 2)))
+    return unusual
@@ -0,0 +1,152 @@
+"""Archival of closed years out of the hot ``Expense`` table.
+
+``archive`` moves every expense dated before a cutoff year into
+``ArchivedExpense`` in primary-key batches, one transaction per batch, and
+records each archived year's totals in ``ArchivedYear``. ``restore`` moves
+rows back the same way.
+
+``MonthlySummary`` rows are left untouched, so dashboard totals and budgets
+for archived years read exactly as before. Readers that list individual
+rows (the dashboard's transaction list, exports, analytics) combine both
+tables. Archiving is not a deletion: it leaves no tombstones for sync
+clients, and restored rows get a new version so the change feed resends
+them.
+"""
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractYear
+
+from . import sharding, versions
+from .models import ArchivedExpense, ArchivedYear, Expense, RecurringTransaction
+
+BATCH_SIZE = 2000
+
+FIELDS = [
+    'id', 'user_id', 'title', 'amount', 'date', 'category_id',
+    'description', 'type', 'import_hash', 'recurring_id', 'version',
+]
+
+
+class ArchiveResult:
+    def __init__(self):
+        self.rows = 0
+        self.years = set()
+
+    @property
+    def users(self):
+        return {user_id for user_id, _ in self.years}
+
+    def add(self, other):
+        self.rows += other.rows
+        self.years |= other.years
+
+
+def _shards(user):
+    return [sharding.for_user(user)] if user is not None else sharding.aliases()
+
+
+def _batches(queryset, batch_size, move):
+    """Call ``move(rows)`` per batch of ``queryset`` rows, each in a transaction.
+
+    Runs against the selected shard.
+    """
+    result = ArchiveResult()
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=sharding.db()), versions.untracked():
+            rows = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values(*FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1]['id']
+            move(rows)
+        result.rows += len(rows)
+        result.years.update((row['user_id'], row['date'].year) for row in rows)
+    return result
+
+
+def _record_years(years):
+    """Rewrite the ``ArchivedYear`` totals of the given ``(user_id, year)`` pairs."""
+    users = {user_id for user_id, _ in years}
+    totals = (
+        ArchivedExpense.objects
+        .filter(user_id__in=users)
+        .annotate(year=ExtractYear('date'))
+        .values('user_id', 'year')
+        .annotate(
+            transactions=Count('id'),
+            income_total=Sum('amount', filter=Q(type='income'), default=0),
+            expense_total=Sum('amount', filter=Q(type='expense'), default=0),
+        )
+        .order_by()
+    )
+    with transaction.atomic(using=sharding.db()):
+        for user_id, year in years:
+            ArchivedYear.objects.filter(user_id=user_id, year=year).delete()
+        ArchivedYear.objects.bulk_create(
+            ArchivedYear(**row) for row in totals
+            if (row['user_id'], row['year']) in years
+        )
+
+
+def archive(before_year, user=None, batch_size=BATCH_SIZE):
+    """Move expenses dated before ``before_year`` into the archive."""
+    expenses = Expense.objects.filter(date__lt=date(before_year, 1, 1))
+    if user is not None:
+        expenses = expenses.filter(user=user)
+
+    def move(rows):
+        ArchivedExpense.objects.bulk_create(ArchivedExpense(**row) for row in rows)
+        Expense.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+
+    result = ArchiveResult()
+    for alias in _shards(user):
+        with sharding.use(alias):
+            moved = _batches(expenses, batch_size, move)
+            if moved.rows:
+                _record_years(moved.years)
+                # The dashboard lists these rows as read-only now.
+                versions.bump(moved.users)
+        result.add(moved)
+    return result
+
+
+def restore(year=None, user=None, batch_size=BATCH_SIZE):
+    """Move archived expenses (of one ``year``, or all) back into ``Expense``."""
+    archived = ArchivedExpense.objects.all()
+    if year is not None:
+        archived = archived.filter(date__gte=date(year, 1, 1), date__lt=date(year + 1, 1, 1))
+    if user is not None:
+        archived = archived.filter(user=user)
+
+    def move(rows):
+        stamps = versions.bump({row['user_id'] for row in rows})
+        schedules = set(
+            RecurringTransaction.objects
+            .filter(pk__in={row['recurring_id'] for row in rows if row['recurring_id']})
+            .values_list('pk', flat=True)
+        )
+        for row in rows:
+            row['version'] = stamps[row['user_id']]
+            if row['recurring_id'] not in schedules:
+                row['recurring_id'] = None
+        Expense.objects.bulk_create(Expense(**row) for row in rows)
+        ArchivedExpense.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+
+    result = ArchiveResult()
+    for alias in _shards(user):
+        with sharding.use(alias):
+            moved = _batches(archived, batch_size, move)
+            for user_id, restored_year in moved.years:
+                ArchivedYear.objects.filter(user_id=user_id, year=restored_year).delete()
+        result.add(moved)
+    return result
+
+
+def is_archived(user, year):
+    return ArchivedYear.objects.filter(user=user, year=year).exists()
@@ -0,0 +1,112 @@
+"""Budget-vs-actual history for overall and per-category budgets.
+
+Every ``MonthlyBudget`` and ``CategoryBudget`` row of a user is read in a
+single ``UNION ALL`` query, each row carrying its actual spend from a
+correlated ``SUM`` over the ``MonthlySummary`` rollup (which mirrors the
+user's expenses per month and category). Five years of budgets are one
+query, however many months and categories they cover.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import categories
+from .models import CategoryBudget, MonthlyBudget, MonthlySummary
+
+WARNING_PERCENTAGE = 75
+
+ZERO = Decimal('0.00')
+
+
+class BudgetLine:
+    """A budget next to what was actually spent against it."""
+
+    def __init__(self, amount, spent, category=None):
+        self.amount = amount
+        self.spent = spent
+        self.category = category
+
+    @property
+    def variance(self):
+        return self.amount - self.spent
+
+    @property
+    def percentage(self):
+        if not self.amount or self.amount <= 0:
+            return 0
+        return round(self.spent / self.amount * 100, 2)
+
+    @property
+    def status(self):
+        if self.spent > self.amount:
+            return 'over'
+        if self.percentage > WARNING_PERCENTAGE:
+            return 'warning'
+        return 'ok'
+
+
+class BudgetMonth:
+    def __init__(self, year, month):
+        self.year = year
+        self.month = month
+        self.overall = None
+        self.categories = []
+
+
+def _spent(by_category=False):
+    spent = MonthlySummary.objects.filter(
+        user=OuterRef('user'),
+        year=OuterRef('year'),
+        month=OuterRef('month'),
+        type='expense',
+    )
+    if by_category:
+        spent = spent.filter(category=OuterRef('category'))
+    total = spent.order_by().values('user').annotate(total=Sum('total')).values('total')
+    return Coalesce(
+        Subquery(total, output_field=DecimalField(max_digits=14, decimal_places=2)),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def history(user, since_year=None):
+    """Return ``BudgetMonth`` objects for ``user``, newest month first."""
+    overall = MonthlyBudget.objects.filter(user=user).annotate(
+        category_ref=Value(None, output_field=IntegerField()),
+        budget=F('amount'),
+        spent=_spent(),
+    )
+    per_category = CategoryBudget.objects.filter(user=user).annotate(
+        category_ref=F('category_id'),
+        budget=F('amount'),
+        spent=_spent(by_category=True),
+    )
+    if since_year is not None:
+        overall = overall.filter(year__gte=since_year)
+        per_category = per_category.filter(year__gte=since_year)
+
+    columns = ('year', 'month', 'category_ref', 'budget', 'spent')
+    rows = (
+        overall.values_list(*columns)
+        .union(per_category.values_list(*columns), all=True)
+        .order_by('-year', '-month')
+    )
+
+    months = OrderedDict()
+    for year, month, category_id, amount, spent in rows:
+        entry = months.get((year, month))
+        if entry is None:
+            entry = months[(year, month)] = BudgetMonth(year, month)
+        if category_id is None:
+            entry.overall = BudgetLine(amount, spent)
+        else:
+            entry.categories.append(
+                BudgetLine(amount, spent, category=categories.get(category_id))
+            )
+
+    for entry in months.values():
+        entry.categories.sort(key=lambda line: line.category.name if line.category else '')
+    return list(months.values())
@@ -0,0 +1,114 @@
+"""Process-local cache of the ``Category`` table.
+
+Categories are few and rarely change, so forms and views read them from
+here instead of querying or joining for them on every request. The cache is
+dropped whenever a category is saved or deleted (see ``app.signals``); the
+timeout bounds how long another worker process can serve a stale copy.
+
+Dropping it also bumps a version number in the default cache. Reads that
+validate a write (``fresh=True``) compare it with the version the copy was
+loaded at, so with a shared cache no worker accepts a category deleted
+elsewhere, and they reload on an unknown id in case it was added elsewhere.
+"""
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+
+from .models import Category
+
+CACHE_TIMEOUT = 300
+# At most one reload per interval for ids missing from the catalogue.
+MISS_RELOAD_INTERVAL = 1
+VERSION_KEY = 'app:categories:version'
+
+_lock = threading.Lock()
+_catalogue = None
+
+
+class Catalogue:
+    def __init__(self, categories, version):
+        self.categories = categories
+        self.by_id = {category.pk: category for category in categories}
+        self.by_name = {category.name.lower(): category for category in categories}
+        self.stamp = hashlib.sha1(
+            "|".join(f"{c.pk}:{c.name}" for c in categories).encode()
+        ).hexdigest()
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+def _version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def catalogue(fresh=False):
+    """Return the catalogue, reloading it once expired.
+
+    With ``fresh`` it is also reloaded when a category changed in another
+    process since it was loaded.
+    """
+    current = _catalogue
+    if (
+        current is not None
+        and time.monotonic() - current.loaded_at < CACHE_TIMEOUT
+        and not (fresh and current.version != _version())
+    ):
+        return current
+    return _reload(current)
+
+
+def _reload(current):
+    global _catalogue
+    with _lock:
+        if _catalogue is current:
+            # Read the version first: a change committed after it reloads again.
+            version = _version()
+            _catalogue = Catalogue(list(Category.objects.order_by('pk')), version)
+        return _catalogue
+
+
+def invalidate():
+    global _catalogue
+    with _lock:
+        _catalogue = None
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def ordered():
+    """Every category, in primary key order."""
+    return catalogue().categories
+
+
+def get(pk, fresh=False):
+    """Return the cached ``Category`` with this primary key, or ``None``.
+
+    Pass ``fresh`` when validating a write, see ``catalogue``.
+    """
+    return _find(lambda current: current.by_id.get(pk), fresh)
+
+
+def get_by_name(name, fresh=False):
+    return _find(lambda current: current.by_name.get(name.lower()), fresh)
+
+
+def _find(lookup, fresh):
+    current = catalogue(fresh)
+    category = lookup(current)
+    if category is None and fresh and time.monotonic() - current.loaded_at >= MISS_RELOAD_INTERVAL:
+        category = lookup(_reload(current))
+    return category
+
+
+def name(pk, default="General"):
+    category = get(pk)
+    return category.name if category else default
+
+
+def stamp():
+    """Fingerprint of the catalogue, for cache validators that show names."""
+    return catalogue().stamp
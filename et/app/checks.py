@@ -0,0 +1,42 @@
+"""System checks for settings that only work with a shared cache."""
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Backends whose contents each worker process keeps to itself.
+PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared(alias):
+    return settings.CACHES[alias]['BACKEND'] not in PER_PROCESS_CACHES
+
+
+@register()
+def check_user_cache(app_configs, **kwargs):
+    if not getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 0) or is_shared('default'):
+        return []
+    return [Error(
+        "AUTH_USER_CACHE_TIMEOUT is set but the default cache is local to each process.",
+        hint=(
+            "A worker would keep serving a user it did not see change, e.g. after a "
+            "password change. Use a shared cache (ET_CACHE_PROFILE=redis or memcached) "
+            "or set AUTH_USER_CACHE_TIMEOUT = 0."
+        ),
+        id='app.E001',
+    )]
+
+
+@register()
+def check_rate_limit_cache(app_configs, **kwargs):
+    if not getattr(settings, 'RATE_LIMITS', None) or is_shared(settings.RATE_LIMIT_CACHE):
+        return []
+    return [Error(
+        "RATE_LIMITS is set but RATE_LIMIT_CACHE is local to each process.",
+        hint=(
+            "Every worker would grant the full allowance. Use a shared cache "
+            "(ET_CACHE_PROFILE=redis or memcached) or set RATE_LIMITS = {}."
+        ),
+        id='app.E002',
+    )]
@@ -0,0 +1,41 @@
+"""CSV export of transactions, shared by the streaming view and export jobs."""
+import csv
+
+from . import categories
+
+HEADER = ['Title', 'Type', 'Category', 'Amount', 'Date', 'Description']
+
+
+class Echo:
+    """File-like object whose ``write`` just hands the line back."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_rows(*querysets):
+    """Yield CSV lines for the rows of ``querysets``, newest first.
+
+    Several querysets (expenses and their archive) are read as one
+    ``UNION ALL`` query.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+
+    parts = [
+        queryset.values_list(
+            'title', 'type', 'category_id', 'amount', 'date', 'description', 'id'
+        ).order_by()
+        for queryset in querysets
+    ]
+    rows = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+    for title, type_, category_id, amount, day, description, _ in rows.order_by('-date', '-id').iterator(chunk_size=2000):
+        yield writer.writerow([
+            title,
+            type_,
+            categories.name(category_id),
+            amount,
+            day,
+            description
+        ])
@@ -1,7 +1,9 @@
 from django import forms
-from .models import Expense, Category
+from django.contrib.auth.models import User
+from . import categories
+from .models import Expense, Category, RecurringTransaction
 from django.core.exceptions import ValidationError
-from datetime import date
+from datetime import date, timedelta
 
 def apply_style(form):
     for field_name, field in form.fields.items():
@@ -11,7 +13,49 @@ def apply_style(form):
         # Add the classes to the existing widget attributes
         field.widget.attrs.update({'class': css_classes})
 
+def validate_not_future(value):
+    if value and value > date.today():
+        raise ValidationError("You cannot log a future expense.")
+
+
+class CategoryChoiceField(forms.ChoiceField):
+    """Category picker backed by the cached catalogue instead of a queryset."""
+
+    def __init__(self, **kwargs):
+        super().__init__(choices=self._choices_from_cache, **kwargs)
+
+    @staticmethod
+    def _choices_from_cache():
+        return [('', '---------')] + [
+            (category.pk, category.name) for category in categories.ordered()
+        ]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            category = categories.get(int(value), fresh=True)
+        except (TypeError, ValueError):
+            category = None
+        if category is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return category
+
+    def validate(self, value):
+        if value is None and self.required:
+            raise ValidationError(self.error_messages['required'], code='required')
+
+    def prepare_value(self, value):
+        return value.pk if isinstance(value, Category) else value
+
+
 class ExpenseForm(forms.ModelForm):
+    category = CategoryChoiceField()
+
     class Meta:
         model = Expense
         fields = ['title', 'amount', 'date', 'category', 'description', 'type']
@@ -30,14 +74,72 @@ class ExpenseForm(forms.ModelForm):
 
     def clean_date(self):
         selected_date = self.cleaned_data.get('date')
-        if selected_date > date.today():
-            raise ValidationError("You cannot log a future expense.")
+        validate_not_future(selected_date)
         return selected_date
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance.recurring_id and 'date' in self.changed_data:
+            # A moved occurrence is no longer its schedule's row for a date;
+            # unlinking it keeps (recurring, date) unique.
+            self.instance.recurring = None
+        return cleaned_data
+
+    def _get_validation_exclusions(self):
+        # The category was already checked against the cached catalogue;
+        # skip the model's foreign-key existence query.
+        exclude = super()._get_validation_exclusions()
+        exclude.add('category')
+        return exclude
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         apply_style(self) # This applies the CSS to all fields, including the date picker
 
+# Batch entry: up to a hundred ExpenseForm rows posted and validated together.
+ExpenseFormSet = forms.formset_factory(
+    ExpenseForm,
+    extra=10,
+    min_num=1,
+    validate_min=True,
+    max_num=100,
+    validate_max=True,
+    absolute_max=100,
+)
+
+
+class RecurringTransactionForm(forms.ModelForm):
+    category = CategoryChoiceField(required=False)
+
+    class Meta:
+        model = RecurringTransaction
+        fields = ['title', 'amount', 'category', 'type', 'frequency', 'interval',
+                  'start_date', 'end_date', 'description']
+
+        widgets = {
+            'start_date': forms.DateInput(attrs={'type': 'date'}),
+            'end_date': forms.DateInput(attrs={'type': 'date'}),
+            'description': forms.Textarea(attrs={'rows': 2}),
+            'amount': forms.NumberInput(attrs={'placeholder': '0.00'}),
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start_date')
+        end = cleaned_data.get('end_date')
+        if start and end and end < start:
+            raise ValidationError("The end date must be after the start date.")
+        return cleaned_data
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        exclude.add('category')
+        return exclude
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        apply_style(self)
+
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
@@ -47,8 +149,126 @@ class CategoryForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         apply_style(self)
         
+class ExpenseRowForm(forms.Form):
+    """Validates one imported CSV row with the same rules as ``ExpenseForm``.
+
+    Categories are looked up by name by the importer, so they are plain text
+    here and no query runs per row.
+    """
+    title = forms.CharField(max_length=200)
+    amount = forms.DecimalField(max_digits=10, decimal_places=2)
+    date = forms.DateField(validators=[validate_not_future])
+    category = forms.CharField(max_length=100, required=False)
+    description = forms.CharField(required=False)
+    type = forms.ChoiceField(choices=Expense.TRANSACTION_TYPES)
+
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label="CSV file")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        apply_style(self)
+
+
+class ExportForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    type = forms.ChoiceField(
+        choices=[('', 'All')] + Expense.TRANSACTION_TYPES,
+        required=False,
+    )
+    category = CategoryChoiceField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end and start > end:
+            raise ValidationError("The start date must be before the end date.")
+        return cleaned_data
+
+    def filter(self, queryset):
+        if self.cleaned_data.get('start'):
+            queryset = queryset.filter(date__gte=self.cleaned_data['start'])
+        if self.cleaned_data.get('end'):
+            queryset = queryset.filter(date__lte=self.cleaned_data['end'])
+        if self.cleaned_data.get('type'):
+            queryset = queryset.filter(type=self.cleaned_data['type'])
+        if self.cleaned_data.get('category'):
+            queryset = queryset.filter(category=self.cleaned_data['category'])
+        return queryset
+
+class AnalyticsForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    granularity = forms.ChoiceField(
+        choices=[('day', 'Daily'), ('week', 'Weekly'), ('month', 'Monthly')],
+        required=False,
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        end = cleaned_data.get('end') or date.today()
+        start = cleaned_data.get('start')
+        if start is None:
+            try:
+                year_ago = end.replace(year=end.year - 1)
+            except ValueError:  # 29 February
+                year_ago = end.replace(year=end.year - 1, day=28)
+            start = year_ago + timedelta(days=1)
+        if start > end:
+            raise ValidationError("The start date must be before the end date.")
+        if (end - start).days > 366 * 20:
+            raise ValidationError("The range cannot exceed twenty years.")
+        cleaned_data['start'] = start
+        cleaned_data['end'] = end
+        cleaned_data['granularity'] = cleaned_data.get('granularity') or 'week'
+        return cleaned_data
+
+
+class SearchForm(ExportForm):
+    q = forms.CharField(required=False, max_length=200, label="Search")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        apply_style(self)
+
+
+class AdminFilterForm(ExportForm):
+    user = forms.CharField(required=False, label="Username")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_ids = None
+        apply_style(self)
+
+    def clean_user(self):
+        # Expenses may live in a shard, so filter on ids instead of a join.
+        username = self.cleaned_data['user']
+        self.user_ids = (
+            list(User.objects.filter(username=username).values_list('pk', flat=True))
+            if username else None
+        )
+        return username
+
+    def filter(self, queryset):
+        queryset = super().filter(queryset)
+        if self.user_ids is not None:
+            queryset = queryset.filter(user_id__in=self.user_ids)
+        return queryset
+
+class BudgetForm(forms.Form):
+    year = forms.IntegerField(min_value=1900, max_value=9999)
+    month = forms.IntegerField(min_value=1, max_value=12)
+    category = CategoryChoiceField(required=False, help_text="Leave empty for the overall monthly budget.")
+    amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        apply_style(self)
+
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth.models import User
 
 class RegisterForm(UserCreationForm):
     class Meta:
@@ -0,0 +1,166 @@
+"""Bulk import of transactions from CSV bank statements.
+
+The file is read as a stream and validated row by row with the fields of
+``ExpenseRowForm``; valid rows are written with batched ``bulk_create`` in a
+single transaction.  Each row carries a content hash, so importing the same
+statement again only adds rows that were not there before.
+
+The expected columns match ``export_expenses``: Title, Type, Category,
+Amount, Date, Description (header names are case-insensitive, Type,
+Category and Description are optional).
+"""
+import csv
+import hashlib
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import categories, sharding, summaries, versions
+from .forms import ExpenseRowForm
+from .models import ArchivedExpense, Expense
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 50
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {line}: {message}")
+
+
+def _row_hash(data, category_id, occurrence):
+    raw = "|".join([
+        data['date'].isoformat(),
+        str(data['amount']),
+        data['type'],
+        str(category_id or ''),
+        data['title'],
+        data['description'],
+        str(occurrence),
+    ])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _clean(fields, row):
+    """Run ``ExpenseRowForm``'s field validation on one row.
+
+    The form's fields are built once per import and reused, which avoids
+    constructing (and deep-copying) a bound form for every line.
+    """
+    data = {}
+    errors = []
+    for name, field in fields.items():
+        try:
+            data[name] = field.clean(row.get(name, ''))
+        except ValidationError as exc:
+            errors.append(f"{name}: {' '.join(exc.messages)}")
+    return data, errors
+
+
+def _insert(user, batch, deltas, result):
+    hashes = [expense.import_hash for expense in batch]
+    existing = set(
+        Expense.objects
+        .filter(user=user, import_hash__in=hashes)
+        .values_list('import_hash', flat=True)
+        .order_by()
+        .union(
+            ArchivedExpense.objects
+            .filter(user=user, import_hash__in=hashes)
+            .values_list('import_hash', flat=True)
+            .order_by()
+        )
+    )
+    new = [expense for expense in batch if expense.import_hash not in existing]
+
+    if new:
+        version = versions.bump([user.pk])[user.pk]
+        for expense in new:
+            expense.version = version
+    Expense.objects.bulk_create(new, batch_size=BATCH_SIZE)
+    summaries.collect(new, deltas=deltas)
+
+    result.created += len(new)
+    result.duplicates += len(batch) - len(new)
+
+
+def _rows(reader, result):
+    """Yield the rows of ``reader``, ending with an error where it cannot be read.
+
+    The rows read before it are still imported; importing the repaired file
+    again only adds the rest.
+    """
+    # line_num counts the lines read before the failing one.
+    try:
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        yield from reader
+    except UnicodeDecodeError:
+        result.add_error(reader.line_num + 1, "The file is not UTF-8 text; reading stopped here.")
+    except csv.Error as exc:
+        result.add_error(reader.line_num + 1, f"Malformed CSV ({exc}); reading stopped here.")
+
+
+def import_csv(user, lines, batch_size=BATCH_SIZE):
+    """Import the CSV text ``lines`` (any iterable of str) for ``user``."""
+    result = ImportResult()
+    fields = ExpenseRowForm().fields
+    deltas = summaries.collect([])
+    seen = Counter()
+
+    reader = csv.DictReader(lines)
+
+    with transaction.atomic(using=sharding.db()):
+        batch = []
+        for row in _rows(reader, result):
+            row = {key: (value or '').strip() for key, value in row.items() if key}
+            row.setdefault('type', '')
+            row['type'] = row['type'].lower() or 'expense'
+
+            data, errors = _clean(fields, row)
+            if errors:
+                result.add_error(reader.line_num, "; ".join(errors))
+                continue
+
+            category = categories.get_by_name(data['category'], fresh=True)
+            if category is None and data['category'].lower() not in ('', 'general'):
+                result.add_error(reader.line_num, f"Unknown category '{data['category']}'.")
+                continue
+            category_id = category.pk if category else None
+
+            # Identical rows in one statement are legitimate (two coffees on
+            # the same day), so the occurrence number is part of the hash.
+            content = (data['date'], data['amount'], data['type'], category_id,
+                       data['title'], data['description'])
+            seen[content] += 1
+
+            batch.append(Expense(
+                user=user,
+                title=data['title'],
+                amount=data['amount'],
+                date=data['date'],
+                category_id=category_id,
+                description=data['description'],
+                type=data['type'],
+                import_hash=_row_hash(data, category_id, seen[content]),
+            ))
+
+            if len(batch) >= batch_size:
+                _insert(user, batch, deltas, result)
+                batch = []
+
+        if batch:
+            _insert(user, batch, deltas, result)
+
+        summaries.apply(deltas)
+
+    return result
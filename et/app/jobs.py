@@ -0,0 +1,201 @@
+"""A small background job queue stored in the application database.
+
+Views ``enqueue`` a ``Job`` and return at once; the ``run_jobs`` command
+runs a pool of workers that ``claim`` queued jobs and execute the handler
+registered for their ``kind``. A claim is a conditional ``UPDATE`` on the
+job's status, so any number of workers (threads or processes, on any
+backend) can poll the same table without running a job twice.
+
+Failed jobs are retried with exponential backoff up to ``max_attempts``;
+jobs whose worker died are picked up again after ``JOB_TIMEOUT`` seconds,
+or marked failed if that was their last attempt.
+"""
+import io
+import logging
+import os
+import tempfile
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import sharding, summaries
+from .exports import iter_csv_rows
+from .forms import ExportForm
+from .importer import import_csv
+from .models import ArchivedExpense, Expense, Job
+
+logger = logging.getLogger('app.jobs')
+
+HANDLERS = {}
+
+OUTCOME_FIELDS = ['status', 'result', 'error', 'run_after', 'finished_at', 'locked_by', 'locked_at', 'output_file']
+
+
+def handler(kind):
+    """Register the decorated function as the runner of ``kind`` jobs.
+
+    It receives the ``Job`` and returns a JSON-serializable result; it may
+    also save a file to ``job.output_file``.
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(user, kind, params=None, input_file=None):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    job = Job(
+        user=user,
+        kind=kind,
+        params=params or {},
+        max_attempts=getattr(settings, 'JOB_MAX_ATTEMPTS', 3),
+    )
+    if input_file is not None:
+        job.input_file.save(os.path.basename(input_file.name), input_file, save=False)
+    job.save()
+    return job
+
+
+def _stale(now):
+    stale = now - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT', 3600))
+    return Q(status=Job.RUNNING, locked_at__lt=stale)
+
+
+def _claimable(now):
+    return (
+        Q(status=Job.QUEUED, run_after__lte=now)
+        | _stale(now) & Q(attempts__lt=F('max_attempts'))
+    )
+
+
+def claim(worker):
+    """Take the next runnable job for ``worker``, or return ``None``.
+
+    Jobs whose worker died on their last attempt are marked failed instead.
+    """
+    now = timezone.now()
+    Job.objects.filter(_stale(now), attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        error="The worker running the last attempt stopped responding.",
+        locked_by='',
+        locked_at=None,
+        finished_at=now,
+    )
+    candidates = list(
+        Job.objects.filter(_claimable(now))
+        .order_by('run_after', 'pk')
+        .values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        claimed = Job.objects.filter(_claimable(now), pk=pk).update(
+            status=Job.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    """Execute a claimed ``job`` and record the outcome.
+
+    The outcome is dropped if the job was claimed again meanwhile (its
+    worker was taken for dead), so a late worker never overwrites the run
+    that replaced it.
+    """
+    worker = job.locked_by
+    try:
+        with sharding.use(sharding.for_user(job.user_id)):
+            result = HANDLERS[job.kind](job)
+    except Exception:
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.kind, job.attempts)
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (job.attempts - 1)
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result or {}
+        job.error = ''
+        job.finished_at = timezone.now()
+
+    job.locked_by = ''
+    job.locked_at = None
+    recorded = Job.objects.filter(pk=job.pk, locked_by=worker, attempts=job.attempts).update(
+        **{name: getattr(job, name) for name in OUTCOME_FIELDS}
+    )
+    if not recorded:
+        logger.warning("Job %s was claimed again during attempt %s; its outcome is dropped", job.pk, job.attempts)
+    return job
+
+
+def work(worker, once=False, poll_interval=1.0, stop=None):
+    """Claim and run jobs until ``stop`` is set (or the queue is empty, if ``once``)."""
+    try:
+        while stop is None or not stop.is_set():
+            close_old_connections()
+            job = claim(worker)
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+            run(job)
+    finally:
+        connections.close_all()
+
+
+# --------------------------------
+# HANDLERS
+# --------------------------------
+
+@handler('export')
+def export_job(job):
+    form = ExportForm(job.params)
+    if not form.is_valid():
+        raise ValueError(form.errors.as_text())
+
+    expenses = form.filter(Expense.objects.filter(user=job.user))
+    archived = form.filter(ArchivedExpense.objects.filter(user=job.user))
+    rows = 0
+    with tempfile.TemporaryFile('w+b') as output:
+        for line in iter_csv_rows(expenses, archived):
+            output.write(line.encode())
+            rows += 1
+        output.seek(0)
+        job.output_file.save(f"expenses-{job.pk}.csv", File(output), save=False)
+
+    return {'rows': rows - 1}
+
+
+@handler('import')
+def import_job(job):
+    with job.input_file.open('rb') as upload:
+        lines = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+        result = import_csv(job.user, lines)
+
+    return {
+        'created': result.created,
+        'duplicates': result.duplicates,
+        'invalid': result.invalid,
+        'errors': result.errors,
+    }
+
+
+@handler('rebuild_summaries')
+def rebuild_summaries_job(job):
+    return {'rows': summaries.rebuild()}
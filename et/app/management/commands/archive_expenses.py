@@ -0,0 +1,47 @@
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move transactions from closed years out of the expense table into the "
+        "archive. Dashboard totals, the year selector and exports still include them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            type=int,
+            help="Archive every year before this one; defaults to last year, "
+                 "so the current and previous years stay hot.",
+        )
+        parser.add_argument('--user', help="Only archive the transactions of this username.")
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        before = options['before'] or date.today().year - 1
+        if before > date.today().year:
+            raise CommandError("Only closed years can be archived.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        start = time.perf_counter()
+        result = archive.archive(before, user=user, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result.rows} transactions from {len(result.years)} user-years "
+            f"before {before} in {elapsed:.1f}s."
+        ))
@@ -0,0 +1,105 @@
+import json
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app import sharding
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[round(q * (len(ordered) - 1))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the main views through the test client and print p50/p95 "
+        "latency and query counts as JSON. All writes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='bench0',
+                            help="Username whose data the user views are run against.")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--host', default='localhost',
+                            help="Host header to send; must be in ALLOWED_HOSTS.")
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(
+                f"User '{options['user']}' does not exist; run generate_data first."
+            )
+
+        alias = sharding.for_user(user)
+        category = user.expense_set.using(alias).exclude(category=None).values_list('category', flat=True).first()
+        today = date.today().isoformat()
+
+        scenarios = [
+            ('dashboard', False, 'get', reverse('index'), None),
+            ('admin_dashboard', True, 'get', reverse('admin-dashboard'), None),
+            ('export_expenses', False, 'get', reverse('export-expenses'), None),
+            ('add_expense', False, 'post', reverse('add-expense'), {
+                'title': 'Benchmark',
+                'amount': '12.34',
+                'date': today,
+                'category': category or '',
+                'type': 'expense',
+                'description': '',
+            }),
+        ]
+
+        results = {}
+        # Writes to the user's shard are rolled back as well.
+        with transaction.atomic(), transaction.atomic(using=alias):
+            admin = User.objects.create(username='__benchmark_admin__', is_staff=True)
+
+            for name, as_admin, method, url, data in scenarios:
+                client = Client(HTTP_HOST=options['host'])
+                client.force_login(admin if as_admin else user)
+
+                timings = []
+                queries = []
+                status = None
+                for _ in range(options['iterations']):
+                    with CaptureQueriesContext(connections['default']) as captured, \
+                            CaptureQueriesContext(connections[alias]) as shard_captured:
+                        start = time.perf_counter()
+                        response = getattr(client, method)(url, data)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries.append(len(captured.captured_queries) + (
+                        len(shard_captured.captured_queries) if alias != 'default' else 0
+                    ))
+                    status = response.status_code
+
+                results[name] = {
+                    'status': status,
+                    'iterations': options['iterations'],
+                    'p50_ms': round(percentile(timings, 0.50), 2),
+                    'p95_ms': round(percentile(timings, 0.95), 2),
+                    'queries': max(queries),
+                }
+
+            transaction.set_rollback(True)
+            transaction.set_rollback(True, using=alias)
+
+        report = json.dumps({
+            'user': user.username,
+            'transactions': user.expense_set.using(alias).count(),
+            'views': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app import sharding, summaries
+from app.models import Expense
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure add-expense write throughput with concurrent writer processes "
+        "for each shard count, on throwaway SQLite databases (sqlite profile), "
+        "and print the results as JSON. Shards remove waits on the write lock; "
+        "they add no CPU, so writers that are CPU-bound (fewer cores than "
+        "writers, fast storage) show no gain until --hold-ms makes commits "
+        "hold the lock longer than they use the processor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4],
+                            help="Shard counts to compare.")
+        parser.add_argument('--writers', type=int, default=8,
+                            help="Concurrent writer processes, each writing as its own user.")
+        parser.add_argument('--seconds', type=float, default=5.0,
+                            help="How long each writer keeps writing.")
+        parser.add_argument(
+            '--hold-ms', type=float, default=0,
+            help="Extra milliseconds each write transaction holds the write lock, "
+                 "standing in for slower storage or work done inside the transaction.",
+        )
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        # Internal: run as one writer process.
+        parser.add_argument('--writer', type=int, help="==SUPPRESS==")
+
+    def handle(self, *args, **options):
+        if options['writer'] is not None:
+            return self.write(options['writer'], options['seconds'], options['hold_ms'])
+
+        if options['writers'] < 1 or min(options['shards']) < 1:
+            raise CommandError("--writers and --shards must be positive.")
+
+        results = []
+        for shards in options['shards']:
+            with tempfile.TemporaryDirectory() as workdir:
+                results.append(self.run(shards, options, workdir))
+            self.stderr.write(f"{shards} shard(s): {results[-1]['writes_per_second']} writes/s")
+
+        report = json.dumps({
+            'writers': options['writers'],
+            'hold_ms': options['hold_ms'],
+            'runs': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
+
+    def run(self, shards, options, workdir):
+        env = {
+            **os.environ,
+            'ET_DB_PROFILE': 'sqlite',
+            'ET_DB_NAME': str(Path(workdir) / 'db.sqlite3'),
+            'ET_SHARDS': str(shards),
+        }
+        manage = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py')]
+
+        for alias in ['default'] + [f'shard{i}' for i in range(shards)]:
+            subprocess.run(manage + ['migrate', '--database', alias, '-v', '0'], env=env, check=True)
+
+        processes = [
+            subprocess.Popen(
+                manage + [
+                    'benchmark_shards', '--writer', str(i),
+                    '--seconds', str(options['seconds']), '--hold-ms', str(options['hold_ms']),
+                ],
+                env=env, stdout=subprocess.PIPE, text=True,
+            )
+            for i in range(options['writers'])
+        ]
+        reports = [json.loads(process.communicate()[0]) for process in processes]
+        if any(process.returncode for process in processes):
+            raise CommandError("A writer process failed.")
+
+        writes = sum(report['writes'] for report in reports)
+        elapsed = max(report['seconds'] for report in reports)
+        per_shard = {}
+        for report in reports:
+            per_shard[report['shard']] = per_shard.get(report['shard'], 0) + report['writes']
+        return {
+            'shards': shards,
+            'writes': writes,
+            'writes_per_second': round(writes / elapsed, 1),
+            'writes_per_shard': per_shard,
+        }
+
+    def write(self, index, seconds, hold_ms):
+        """Add expenses as one user the way ``add_expense`` does until time is up."""
+        user = User.objects.create(username=f'writer{index}')
+        alias = sharding.for_user(user)
+        today = date.today()
+
+        writes = 0
+        start = time.perf_counter()
+        with sharding.use(alias):
+            while time.perf_counter() - start < seconds:
+                expense = Expense(user=user, title='Benchmark', amount=Decimal('12.34'), date=today)
+                with transaction.atomic(using=alias):
+                    expense.save()
+                    summaries.record(expense)
+                    if hold_ms:
+                        time.sleep(hold_ms / 1000)
+                writes += 1
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(json.dumps({'shard': alias, 'writes': writes, 'seconds': elapsed}))
@@ -0,0 +1,87 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app import sharding, summaries, versions
+from app.models import Category, Expense, MonthlyBudget
+
+DEFAULT_CATEGORIES = ['Food', 'Rent', 'Transport', 'Utilities', 'Entertainment', 'Health']
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, transactions and budgets for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=1000,
+                            help="Transactions per user.")
+        parser.add_argument('--years', type=int, default=3,
+                            help="Spread transactions over this many past years.")
+        parser.add_argument('--prefix', default='bench',
+                            help="Username prefix of the generated users.")
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        today = date.today()
+        first_day = today - timedelta(days=365 * options['years'])
+        span = (today - first_day).days
+
+        categories = list(Category.objects.all())
+        if not categories:
+            categories = Category.objects.bulk_create(
+                [Category(name=name) for name in DEFAULT_CATEGORIES]
+            )
+
+        password = make_password(options['password'])
+
+        users = User.objects.bulk_create([
+            User(username=f"{options['prefix']}{i}", password=password)
+            for i in range(options['users'])
+        ])
+        # bulk_create only returns primary keys on some backends.
+        users = list(User.objects.filter(username__in=[u.username for u in users]))
+
+        for user in users:
+            alias = sharding.for_user(user)
+            with sharding.use(alias), transaction.atomic(using=alias):
+                version = versions.bump([user.pk])[user.pk]
+                expenses = []
+                for _ in range(options['expenses']):
+                    is_income = rng.random() < 0.15
+                    expenses.append(Expense(
+                        user=user,
+                        title=rng.choice(['Salary', 'Bonus']) if is_income else rng.choice(
+                            ['Groceries', 'Coffee', 'Bus ticket', 'Electricity', 'Cinema', 'Pharmacy']
+                        ),
+                        amount=Decimal(rng.randint(100, 500000 if is_income else 20000)) / 100,
+                        date=first_day + timedelta(days=rng.randrange(span + 1)),
+                        category=rng.choice(categories),
+                        type='income' if is_income else 'expense',
+                        version=version,
+                    ))
+                Expense.objects.bulk_create(expenses, batch_size=1000)
+
+                budgets = []
+                month = date(first_day.year, first_day.month, 1)
+                while month <= today:
+                    budgets.append(MonthlyBudget(
+                        user=user,
+                        year=month.year,
+                        month=month.month,
+                        amount=Decimal(rng.randint(1000, 5000)),
+                    ))
+                    month = (month + timedelta(days=32)).replace(day=1)
+                MonthlyBudget.objects.bulk_create(budgets)
+
+                summaries.rebuild(user)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users with {options['expenses']} transactions each."
+        ))
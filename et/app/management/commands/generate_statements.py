@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app import statements
+
+
+def _last_month():
+    first = date.today().replace(day=1)
+    return (first.year, first.month - 1) if first.month > 1 else (first.year - 1, 12)
+
+
+def _parse_month(value):
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        date(year, month, 1)
+    except ValueError:
+        raise CommandError(f"Invalid month '{value}', expected YYYY-MM.")
+    return year, month
+
+
+class Command(BaseCommand):
+    help = (
+        "Render a monthly statement (HTML and CSV) for every user. Users are "
+        "processed in chunks across a pool of processes; statements already "
+        "written are skipped, so an interrupted run can simply be restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Month to report as YYYY-MM; defaults to last month.")
+        parser.add_argument(
+            '--output-dir',
+            default=str(settings.STATEMENTS_ROOT),
+            help="Statements are written to <output-dir>/<YYYY-MM>/<user id>.html|csv.",
+        )
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes; 0 renders in this process.")
+        parser.add_argument('--chunk-size', type=int, default=statements.CHUNK_SIZE,
+                            help="Users per chunk, read with one summary query.")
+        parser.add_argument('--force', action='store_true',
+                            help="Rewrite statements that already exist.")
+
+    def handle(self, *args, **options):
+        year, month = _parse_month(options['month']) if options['month'] else _last_month()
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        if options['processes'] < 0:
+            raise CommandError("--processes cannot be negative.")
+
+        output_dir = options['output_dir']
+        chunks = list(statements.chunks(
+            year, month, output_dir, options['chunk_size'], force=options['force'],
+        ))
+        self.stdout.write(
+            f"Rendering statements for {year}-{month:02d}: "
+            f"{sum(len(users) for _, users in chunks)} users in {len(chunks)} chunks."
+        )
+
+        start = time.perf_counter()
+        written = 0
+        if options['processes'] and chunks:
+            # Children must not share the parent's database connections.
+            connections.close_all()
+            with ProcessPoolExecutor(options['processes'], initializer=django.setup) as pool:
+                futures = [
+                    pool.submit(statements.write_chunk, alias, users, year, month, output_dir)
+                    for alias, users in chunks
+                ]
+                for future in as_completed(futures):
+                    written += future.result()
+        else:
+            for alias, users in chunks:
+                written += statements.write_chunk(alias, users, year, month, output_dir)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} statements to {statements.directory(output_dir, year, month)} "
+            f"in {elapsed:.1f}s."
+        ))
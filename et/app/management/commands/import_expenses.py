@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import sharding
+from app.importer import import_csv
+
+
+class Command(BaseCommand):
+    help = "Import transactions for a user from a CSV bank statement."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="Username to import the transactions for.")
+        parser.add_argument('path', help="Path to the CSV file.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as lines, \
+                    sharding.use(sharding.for_user(user)):
+                result = import_csv(user, lines)
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for error in result.errors:
+            self.stderr.write(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} transactions "
+            f"({result.duplicates} already present, {result.invalid} invalid)."
+        ))
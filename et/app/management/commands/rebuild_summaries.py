@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly summary table from the raw expense rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Only rebuild the summaries of this username.",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        count = summaries.rebuild(user)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} summary rows."))
@@ -0,0 +1,35 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import archive
+
+
+class Command(BaseCommand):
+    help = "Move archived transactions back into the expense table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help="Only restore this year.")
+        parser.add_argument('--user', help="Only restore the transactions of this username.")
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        start = time.perf_counter()
+        result = archive.restore(options['year'], user=user, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {result.rows} transactions from {len(result.years)} user-years "
+            f"in {elapsed:.1f}s."
+        ))
@@ -0,0 +1,59 @@
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (exports, imports, summary rebuilds) from the job table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help="Number of jobs run in parallel.")
+        parser.add_argument('--processes', action='store_true',
+                            help="Use a process pool instead of threads (for CPU-heavy jobs).")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no job is left to run instead of polling.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be positive.")
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        names = [f"{prefix}:{i}" for i in range(options['workers'])]
+        mode = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f"Starting {len(names)} job workers ({mode}).")
+
+        if options['processes']:
+            # Children must not share the parent's database connections.
+            connections.close_all()
+            with ProcessPoolExecutor(len(names), initializer=django.setup) as pool:
+                futures = [
+                    pool.submit(jobs.work, name, options['once'], options['poll_interval'])
+                    for name in names
+                ]
+                # Re-raise a worker's crash instead of exiting as if it had stopped.
+                for future in futures:
+                    future.result()
+        else:
+            stop = threading.Event()
+            with ThreadPoolExecutor(len(names)) as pool:
+                futures = [
+                    pool.submit(jobs.work, name, options['once'], options['poll_interval'], stop)
+                    for name in names
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except KeyboardInterrupt:
+                    stop.set()
+
+        self.stdout.write(self.style.SUCCESS("Job workers stopped."))
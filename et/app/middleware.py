@@ -0,0 +1,182 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import SimpleLazyObject
+from django.db import connections
+from django.template.base import Template
+
+from . import accounts, ratelimit, sharding
+
+logger = logging.getLogger('app.performance')
+
+_current = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+def _instrumented_render(original):
+    # Only the outermost render is timed; {% extends %} and {% include %}
+    # re-enter Template._render for every nested template.
+    def _render(self, context):
+        timing = _current.get()
+        if timing is None or timing.template_depth:
+            return original(self, context)
+
+        timing.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            timing.template_time += time.perf_counter() - start
+            timing.template_depth -= 1
+
+    _render.instrumented = True
+    return _render
+
+
+class RequestTimingMiddleware:
+    """Measure SQL, view and template time for every request.
+
+    Requests slower than ``SLOW_REQUEST_THRESHOLD_MS`` are logged to
+    ``app.performance`` as a JSON record, and staff users (everyone, with
+    ``DEBUG``) get the figures in a ``Server-Timing`` header. Off unless
+    ``REQUEST_TIMING_ENABLED`` is set.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+        if not getattr(Template._render, 'instrumented', False):
+            Template._render = _instrumented_render(Template._render)
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        total_ms = total * 1000
+        sql_ms = timing.sql_time * 1000
+        template_ms = timing.template_time * 1000
+        view_ms = total_ms - template_ms
+
+        # The figures reveal how the server works; only staff see them.
+        if settings.DEBUG or getattr(getattr(request, 'user', None), 'is_staff', False):
+            response['Server-Timing'] = ", ".join([
+                f'db;dur={sql_ms:.1f};desc="{timing.queries} queries"',
+                f'view;dur={view_ms:.1f}',
+                f'template;dur={template_ms:.1f}',
+                f'total;dur={total_ms:.1f}',
+            ])
+
+        if total_ms >= getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 500):
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+                'queries': timing.queries,
+                'sql_ms': round(sql_ms, 1),
+                'view_ms': round(view_ms, 1),
+                'template_ms': round(template_ms, 1),
+                'total_ms': round(total_ms, 1),
+            }))
+
+        return response
+
+    def _record_query(self, execute, sql, params, many, context):
+        timing = _current.get()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if timing is not None:
+                timing.queries += 1
+                timing.sql_time += time.perf_counter() - start
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """``AuthenticationMiddleware`` that reads the user through ``app.accounts``.
+
+    With ``AUTH_USER_CACHE_TIMEOUT = 0`` it behaves exactly like Django's.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        if not accounts.timeout():
+            return
+
+        def get_user():
+            if not hasattr(request, '_cached_user'):
+                request._cached_user = accounts.get_user(request)
+            return request._cached_user
+
+        async def auser():
+            return await sync_to_async(get_user)()
+
+        request.user = SimpleLazyObject(get_user)
+        request.auser = auser
+
+
+class ShardMiddleware:
+    """Route the request's per-user queries to the logged-in user's shard.
+
+    Only installed when ``SHARDS`` is set; see ``app.sharding``.
+    """
+
+    def __init__(self, get_response):
+        if not sharding.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.user.is_authenticated:
+            return self.get_response(request)
+        with sharding.use(sharding.for_user(request.user)):
+            return self.get_response(request)
+
+
+class RateLimitMiddleware:
+    """Turn away requests over their view's budget with a ``429``.
+
+    Not installed when ``RATE_LIMITS`` is empty; see ``app.ratelimit``.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RATE_LIMITS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        wait = ratelimit.take(ratelimit.budget_of(view_func), ratelimit.client(request))
+        if wait:
+            return ratelimit.too_many_requests(wait)
+        return None
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def populate_summaries(apps, schema_editor):
+    Expense = apps.get_model('app', 'Expense')
+    MonthlySummary = apps.get_model('app', 'MonthlySummary')
+    alias = schema_editor.connection.alias
+
+    grouped = (
+        Expense.objects.using(alias)
+        .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('user_id', 'year', 'month', 'category_id', 'type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    MonthlySummary.objects.using(alias).bulk_create(
+        [MonthlySummary(**item) for item in grouped],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_monthlybudget'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('type', models.CharField(choices=[('expense', 'Expense'), ('income', 'Income')], max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('user', 'year', 'month', 'category', 'type'), name='app_monthlysummary_one_per_key'),
+                    models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'year', 'month', 'type'), name='app_monthlysummary_one_uncategorized'),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop, hints={'model_name': 'monthlysummary'}),
+    ]
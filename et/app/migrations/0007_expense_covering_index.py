@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_monthlysummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'type', 'date', 'amount'], name='app_expense_user_id_7fa79c_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# FTS5 index over expense titles and descriptions, kept in sync by triggers
+# so that bulk_create, queryset updates and cascades are covered as well.
+# Only created on SQLite; other backends use app.search's fallback.
+
+FORWARD = [
+    """
+    CREATE VIRTUAL TABLE app_expense_fts USING fts5(
+        title, description, owner, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO app_expense_fts (rowid, title, description, owner)
+    SELECT id, title, description, 'u' || user_id FROM app_expense
+    """,
+    """
+    CREATE TRIGGER app_expense_fts_insert AFTER INSERT ON app_expense BEGIN
+        INSERT INTO app_expense_fts (rowid, title, description, owner)
+        VALUES (new.id, new.title, new.description, 'u' || new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER app_expense_fts_delete AFTER DELETE ON app_expense BEGIN
+        DELETE FROM app_expense_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER app_expense_fts_update
+    AFTER UPDATE OF title, description, user_id ON app_expense BEGIN
+        UPDATE app_expense_fts
+        SET title = new.title, description = new.description, owner = 'u' || new.user_id
+        WHERE rowid = old.id;
+    END
+    """,
+]
+
+# With sharding (app.sharding) app_expense only exists in the shards.
+HINTS = {'model_name': 'expense'}
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS app_expense_fts_update",
+    "DROP TRIGGER IF EXISTS app_expense_fts_delete",
+    "DROP TRIGGER IF EXISTS app_expense_fts_insert",
+    "DROP TABLE IF EXISTS app_expense_fts",
+]
+
+
+# Drop (if still present) and create the three triggers, for migrations
+# that make SQLite rebuild app_expense.
+TRIGGERS = BACKWARD[:3] + FORWARD[2:]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD), hints=HINTS),
+    ]
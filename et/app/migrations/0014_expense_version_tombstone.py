@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:06
+
+from importlib import import_module
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+fts = import_module('app.migrations.0010_expense_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expense_id', models.BigIntegerField()),
+                ('version', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        # Adding a NOT NULL column makes SQLite rebuild app_expense, which
+        # drops the full-text search triggers; recreate them either way.
+        migrations.RunPython(migrations.RunPython.noop, fts.run(fts.TRIGGERS), hints=fts.HINTS),
+        migrations.AddField(
+            model_name='expense',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fts.run(fts.TRIGGERS), migrations.RunPython.noop, hints=fts.HINTS),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'version'], name='app_expense_user_id_c25e3d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'version', 'expense_id'], name='app_tombsto_user_id_c2cec7_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_stats(apps, schema_editor):
+    SpendingStats = apps.get_model('app', 'SpendingStats')
+    alias = schema_editor.connection.alias
+
+    # Welford's update per (user, category), over live and archived rows.
+    groups = {}
+    for model_name in ('Expense', 'ArchivedExpense'):
+        rows = (
+            apps.get_model('app', model_name).objects.using(alias)
+            .filter(type='expense')
+            .values_list('user_id', 'category_id', 'amount')
+            .order_by()
+        )
+        for user_id, category_id, amount in rows.iterator():
+            stats = groups.setdefault((user_id, category_id), [0, 0.0, 0.0])
+            stats[0] += 1
+            delta = float(amount) - stats[1]
+            stats[1] += delta / stats[0]
+            stats[2] += delta * (float(amount) - stats[1])
+
+    SpendingStats.objects.using(alias).bulk_create(
+        [
+            SpendingStats(user_id=user_id, category_id=category_id, count=count, mean=mean, m2=m2)
+            for (user_id, category_id), (count, mean, m2) in groups.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_unconstrained_shard_references'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0)),
+                ('category', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='app.category')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user',), name='app_spendingstats_one_uncategorized')],
+                'unique_together': {('user', 'category')},
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop, hints={'model_name': 'spendingstats'}),
+    ]
@@ -1,7 +1,17 @@
+import calendar
+from datetime import date, timedelta
+
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+# Deleting a user or category is propagated to the per-user models below by
+# app.signals instead of Django's cascade. With sharding on they live in a
+# shard database apart from users and categories (see app.sharding), so
+# their references to those carry no database constraint.
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     
@@ -18,11 +28,11 @@ class Expense(models.Model):
         ('income', 'Income'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
     title = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
-    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
     description = models.TextField(blank=True)
 
     type = models.CharField(
@@ -31,14 +41,34 @@ class Expense(models.Model):
         default='expense'
     )
 
+    # Set on imported rows so that importing the same statement twice is a no-op.
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    # Set on rows generated from a schedule; with ``date`` it keys each occurrence.
+    recurring = models.ForeignKey(
+        'RecurringTransaction',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='expenses',
+    )
+
+    # The user's DataVersion at the last write; the sync API's change cursor.
+    version = models.BigIntegerField(default=0, editable=False)
+
     class Meta:
+        unique_together = [('user', 'import_hash'), ('recurring', 'date')]
         indexes = [
             models.Index(fields=['user', '-date']),
+            models.Index(fields=['user', 'version']),
+            # Covers the per-type sums over a date range without touching the table.
+            models.Index(fields=['user', 'type', 'date', 'amount']),
         ]
         ordering = ['-date']
 
 class MonthlyBudget(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
     year = models.IntegerField()
     month = models.IntegerField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -47,4 +77,291 @@ class MonthlyBudget(models.Model):
         unique_together = ('user', 'year', 'month')
 
     def __str__(self):
-        return f"{self.user.username} - {self.month}/{self.year}"
\ No newline at end of file
+        return f"{self.user.username} - {self.month}/{self.year}"
+
+
+class CategoryBudget(models.Model):
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        unique_together = ('user', 'year', 'month', 'category')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.category.name} {self.month}/{self.year}"
+
+class RecurringTransaction(models.Model):
+    """A schedule (rent, salary, subscriptions) that generates ``Expense`` rows.
+
+    ``next_date`` is the first occurrence not generated yet; the
+    ``generate_recurring`` command materializes everything due and moves it
+    forward.
+    """
+
+    FREQUENCIES = [
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+        ('yearly', 'Yearly'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    title = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    description = models.TextField(blank=True)
+    type = models.CharField(
+        max_length=10,
+        choices=Expense.TRANSACTION_TYPES,
+        default='expense'
+    )
+
+    frequency = models.CharField(max_length=10, choices=FREQUENCIES, default='monthly')
+    interval = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        help_text="Repeat every N periods.",
+    )
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    next_date = models.DateField(editable=False)
+    active = models.BooleanField(default=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'next_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.title} ({self.frequency})"
+
+    def save(self, *args, **kwargs):
+        if self.next_date is None:
+            self.next_date = self.start_date
+        super().save(*args, **kwargs)
+
+    def following(self, day):
+        """The occurrence after ``day``.
+
+        Monthly and yearly schedules stay on the day of month of
+        ``start_date``, clamped to the length of shorter months.
+        """
+        if self.frequency == 'daily':
+            return day + timedelta(days=self.interval)
+        if self.frequency == 'weekly':
+            return day + timedelta(weeks=self.interval)
+
+        months = self.interval * (12 if self.frequency == 'yearly' else 1)
+        year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+        month += 1
+        return date(year, month, min(self.start_date.day, calendar.monthrange(year, month)[1]))
+
+    def due_dates(self, until):
+        """Occurrences from ``next_date`` up to and including ``until``."""
+        day = self.next_date
+        while day <= until and (self.end_date is None or day <= self.end_date):
+            yield day
+            day = self.following(day)
+
+    def occurrence(self, day):
+        return Expense(
+            user_id=self.user_id,
+            title=self.title,
+            amount=self.amount,
+            date=day,
+            category_id=self.category_id,
+            description=self.description,
+            type=self.type,
+            recurring_id=self.pk,
+        )
+
+
+class Job(models.Model):
+    """A unit of background work, run by the ``run_jobs`` worker command.
+
+    See ``app.jobs`` for the enqueue API and the handlers of each ``kind``.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    input_file = models.FileField(upload_to='jobs/input/', blank=True)
+    output_file = models.FileField(upload_to='jobs/output/', blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class MonthlySummary(models.Model):
+    """Running per-month totals of a user's transactions.
+
+    Kept in step with ``Expense`` by ``app.summaries`` so the dashboard can
+    read a handful of rows instead of scanning the year's transactions.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    type = models.CharField(max_length=10, choices=Expense.TRANSACTION_TYPES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # One row per key. Its index also serves the per-month lookups,
+            # and as it never matches NULLs, uncategorized rows need their own.
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'category', 'type'],
+                name='app_monthlysummary_one_per_key',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'type'],
+                condition=models.Q(category__isnull=True),
+                name='app_monthlysummary_one_uncategorized',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.month}/{self.year} {self.type}"
+
+
+class SpendingStats(models.Model):
+    """Running statistics of a user's expense amounts in one category.
+
+    Kept in step with ``Expense`` by ``app.summaries`` (see ``app.anomalies``):
+    ``m2`` is the sum of squared deviations from ``mean``, so the variance
+    is ``m2 / (count - 1)``.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'category')
+        constraints = [
+            # The unique index above never matches NULLs.
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(category__isnull=True),
+                name='app_spendingstats_one_uncategorized',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.category_id}: n={self.count} mean={self.mean:.2f}"
+
+
+
+class Tombstone(models.Model):
+    """Marks a deleted ``Expense`` so that sync clients learn about the deletion."""
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    expense_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version', 'expense_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - expense {self.expense_id} (v{self.version})"
+
+
+class ArchivedExpense(models.Model):
+    """An ``Expense`` from a closed year, moved out of the hot table.
+
+    Rows keep their original id, so restoring them puts back exactly the
+    same expenses. Archived rows are read-only.
+    """
+    archived = True
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    title = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    description = models.TextField(blank=True)
+    type = models.CharField(max_length=10, choices=Expense.TRANSACTION_TYPES)
+    import_hash = models.CharField(max_length=64, null=True, blank=True)
+    # The schedule may be gone by the time the row is restored.
+    recurring_id = models.BigIntegerField(null=True, blank=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date']),
+        ]
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.title} - {self.amount} (archived)"
+
+
+class ArchivedYear(models.Model):
+    """Totals of one user's archived year, written when it is archived."""
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    year = models.IntegerField()
+    transactions = models.IntegerField(default=0)
+    income_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'year')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.year} (archived)"
+
+
+class DataVersion(models.Model):
+    """Per-user stamp that moves forward on every Expense or MonthlyBudget write.
+
+    Used as the validator for conditional GETs of the dashboard.
+    """
+    user = models.OneToOneField(User, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user.username} - v{self.version}"
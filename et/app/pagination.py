@@ -0,0 +1,135 @@
+"""Keyset ("seek") pagination over ``(date, id)``.
+
+Pages are addressed by opaque cursors that encode the boundary row instead
+of a page number, so fetching a page is a bounded index range scan no matter
+how deep the user has scrolled, and no ``COUNT(*)`` is ever needed.
+
+Several querysets (one per shard, or expenses and their archive) can be
+paged as one: rows are then ordered by ``(date, queryset, id)``, so ids may
+repeat across the querysets.
+"""
+import base64
+from datetime import date
+
+from django.db.models import Q
+
+
+def encode_token(*parts):
+    raw = "|".join(str(part) for part in parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(value):
+    """Return the string parts of a token; raises ``ValueError`` if malformed."""
+    padded = value + '=' * (-len(value) % 4)
+    try:
+        return base64.urlsafe_b64decode(padded).decode().split('|')
+    except UnicodeDecodeError as exc:
+        raise ValueError(str(exc))
+
+
+def encode_cursor(obj):
+    return encode_token(obj.date.isoformat(), getattr(obj, 'keyset_source', 0), obj.pk)
+
+
+def decode_cursor(value):
+    """Return ``(date, source, id)`` for a cursor, or ``None`` if it is malformed."""
+    if not value:
+        return None
+    try:
+        raw_date, raw_source, raw_pk = decode_token(value)
+        return date.fromisoformat(raw_date), int(raw_source), int(raw_pk)
+    except ValueError:
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next() else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous() else None
+
+
+def _fetch(querysets, ordering, limit):
+    rows = []
+    for source, queryset in enumerate(querysets):
+        for row in queryset.order_by(*ordering)[:limit]:
+            row.keyset_source = source
+            rows.append(row)
+    if len(querysets) > 1:
+        rows.sort(key=lambda row: (row.date, row.keyset_source, row.pk), reverse=ordering[0].startswith('-'))
+    return rows[:limit]
+
+
+def _older(queryset, source, cursor):
+    day, cursor_source, pk = cursor
+    if source < cursor_source:
+        return queryset.filter(date__lte=day)
+    if source > cursor_source:
+        return queryset.filter(date__lt=day)
+    return queryset.filter(Q(date__lt=day) | Q(date=day, pk__lt=pk))
+
+
+def _newer(queryset, source, cursor):
+    day, cursor_source, pk = cursor
+    if source > cursor_source:
+        return queryset.filter(date__gte=day)
+    if source < cursor_source:
+        return queryset.filter(date__gt=day)
+    return queryset.filter(Q(date__gt=day) | Q(date=day, pk__gt=pk))
+
+
+def keyset_page(queryset, per_page, after=None, before=None):
+    """Return the page of ``queryset`` (newest first) next to a cursor.
+
+    ``after`` selects the rows older than the cursor, ``before`` the rows
+    newer than it. With neither, the first page is returned. ``queryset``
+    may also be a list of querysets, whose pages are merged.
+    """
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+
+    if before:
+        rows = _fetch(
+            [_newer(qs, source, before) for source, qs in enumerate(querysets)],
+            ('date', 'pk'),
+            per_page + 1,
+        )
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_previous=has_previous)
+
+    if after:
+        querysets = [_older(qs, source, after) for source, qs in enumerate(querysets)]
+
+    rows = _fetch(querysets, ('-date', '-pk'), per_page + 1)
+    return KeysetPage(
+        rows[:per_page],
+        has_next=len(rows) > per_page,
+        has_previous=after is not None,
+    )
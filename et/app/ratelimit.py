@@ -0,0 +1,93 @@
+"""Rate limiting of views, with the limits kept in a shared cache.
+
+Every client has one allowance per budget in ``RATE_LIMITS``: it may send up
+to ``burst`` requests at once and then ``rate`` requests per second. The
+client is the logged-in user, or the IP address for anonymous requests.
+``RateLimitMiddleware`` checks the allowance before the view runs and
+answers ``429`` with ``Retry-After`` when it is spent, so a rejected request
+costs no more than the session lookup. Views are charged to ``default``
+unless decorated with ``@rate_limit('expensive')``.
+
+The allowance is a token bucket in its GCRA form: a single number, the
+client's "theoretical arrival time", moved forward by one emission interval
+per request with the cache's atomic ``incr``, so concurrent requests can
+never both spend the last token. It must be a cache every worker process
+shares (Redis, Memcached); ``app.checks`` refuses a per-process one.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+DEFAULT_BUDGET = 'default'
+
+
+def rate_limit(budget):
+    """Charge the decorated view to ``budget`` instead of the default one."""
+    def decorator(view):
+        view.rate_limit = budget
+        return view
+    return decorator
+
+
+def budget_of(view):
+    return getattr(view, 'rate_limit', DEFAULT_BUDGET)
+
+
+def client(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    # Behind a proxy, set REMOTE_ADDR from its forwarded header first.
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def take(budget, client, now=None):
+    """Spend one request of ``client``'s allowance for ``budget``.
+
+    Returns 0 if the request may go ahead, otherwise the seconds until it
+    would. Budgets missing from ``RATE_LIMITS`` are unlimited.
+    """
+    limits = settings.RATE_LIMITS.get(budget)
+    if not limits:
+        return 0
+    # Milliseconds, as caches only increment integers.
+    interval = max(round(1000 / limits['rate']), 1)
+    tolerance = interval * limits['burst']
+
+    cache = caches[settings.RATE_LIMIT_CACHE]
+    key = f'app:ratelimit:{budget}:{client}'
+    now = round((time.time() if now is None else now) * 1000)
+
+    for _ in range(2):
+        # The key only lives while the arrival time is ahead of the clock,
+        # so an idle client starts again from a full bucket.
+        if cache.add(key, now + interval, math.ceil(interval / 1000)):
+            return 0
+        try:
+            arrival = cache.incr(key, interval)
+        except ValueError:
+            continue  # It expired between the two calls.
+        if arrival - interval < now:
+            # The TTL is rounded up to whole seconds, so the key can outlive
+            # an arrival time already in the past: start again from now.
+            cache.delete(key)
+            continue
+        if arrival - now > tolerance:
+            cache.decr(key, interval)
+            return (arrival - tolerance - now) / 1000
+        cache.touch(key, math.ceil((arrival - now) / 1000))
+        return 0
+    return 0
+
+
+def too_many_requests(wait):
+    response = HttpResponse(
+        "Too many requests. Please slow down and try again shortly.\n",
+        status=429,
+        content_type='text/plain',
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
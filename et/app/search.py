@@ -0,0 +1,151 @@
+"""Full-text search over expense titles and descriptions.
+
+On SQLite the ``app_expense_fts`` FTS5 table (created in migration 0010 and
+kept in sync with ``app_expense`` by triggers, so bulk writes are covered
+too) indexes ``title`` and ``description`` plus an ``owner`` token per user.
+Matching ``owner`` inside the FTS query lets the index itself narrow the
+search to one user's rows. Results are ranked with bm25 and paged on
+``(score, id)`` cursors.
+
+Other database backends fall back to ``icontains`` filtering, newest first.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from . import sharding
+from .models import Expense
+from .pagination import KeysetPage, decode_token, encode_token, keyset_page
+
+FTS_TABLE = 'app_expense_fts'
+
+# Title matches weigh ten times description matches; owner never ranks.
+RANK = f"bm25({FTS_TABLE}, 10.0, 1.0, 0.0)"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_available():
+    return connections[sharding.db()].vendor == 'sqlite'
+
+
+def match_expression(user, query):
+    """Build a safe FTS5 query: every word must prefix-match title or description."""
+    terms = " ".join(f'"{token}"*' for token in _TOKEN.findall(query))
+    if not terms:
+        return None
+    return f'owner:u{user.pk} AND {{title description}}: ({terms})'
+
+
+class SearchPage(KeysetPage):
+    def __init__(self, object_list, ranks, has_next, has_previous):
+        super().__init__(object_list, has_next, has_previous)
+        self.ranks = ranks
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return encode_token(repr(self.ranks[-1]), self.object_list[-1].pk)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return encode_token(repr(self.ranks[0]), self.object_list[0].pk)
+
+
+def _decode(cursor):
+    if not cursor:
+        return None
+    try:
+        rank, pk = decode_token(cursor)
+        return float(rank), int(pk)
+    except ValueError:
+        return None
+
+
+def _filters(user, filters):
+    """Translate the user and optional filters into SQL on the joined ``e`` table."""
+    clauses = ["e.user_id = %s"]
+    params = [user.pk]
+    if filters.get('category'):
+        clauses.append("e.category_id = %s")
+        params.append(filters['category'].pk)
+    if filters.get('type'):
+        clauses.append("e.type = %s")
+        params.append(filters['type'])
+    if filters.get('start'):
+        clauses.append("e.date >= %s")
+        params.append(filters['start'].isoformat())
+    if filters.get('end'):
+        clauses.append("e.date <= %s")
+        params.append(filters['end'].isoformat())
+    return clauses, params
+
+
+def search(user, query, filters, per_page=20, after=None, before=None):
+    """Return a page of ``user``'s expenses matching ``query``, best first."""
+    if not fts_available():
+        return _search_fallback(user, query, filters, per_page, after, before)
+
+    match = match_expression(user, query)
+    if match is None:
+        return SearchPage([], [], has_next=False, has_previous=False)
+
+    clauses, params = _filters(user, filters)
+    after = _decode(after)
+    before = _decode(before)
+
+    if before:
+        clauses.append("(matches.score < %s OR (matches.score = %s AND e.id < %s))")
+        params += [before[0], before[0], before[1]]
+        order = "matches.score DESC, e.id DESC"
+    else:
+        if after:
+            clauses.append("(matches.score > %s OR (matches.score = %s AND e.id > %s))")
+            params += [after[0], after[0], after[1]]
+        order = "matches.score, e.id"
+
+    sql = (
+        "SELECT e.id, matches.score FROM ("
+        f"SELECT rowid AS id, {RANK} AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        ") AS matches JOIN app_expense e ON e.id = matches.id"
+        f" WHERE {' AND '.join(clauses)}"
+        f" ORDER BY {order} LIMIT %s"
+    )
+
+    with connections[sharding.db()].cursor() as cursor:
+        cursor.execute(sql, [match] + params + [per_page + 1])
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    expenses = Expense.objects.in_bulk([pk for pk, _ in rows])
+    return SearchPage(
+        [expenses[pk] for pk, _ in rows if pk in expenses],
+        [rank for _, rank in rows],
+        has_next=True if before else has_more,
+        has_previous=has_more if before else after is not None,
+    )
+
+
+def _search_fallback(user, query, filters, per_page, after, before):
+    expenses = Expense.objects.filter(user=user)
+    for token in _TOKEN.findall(query):
+        expenses = expenses.filter(Q(title__icontains=token) | Q(description__icontains=token))
+
+    if filters.get('category'):
+        expenses = expenses.filter(category=filters['category'])
+    if filters.get('type'):
+        expenses = expenses.filter(type=filters['type'])
+    if filters.get('start'):
+        expenses = expenses.filter(date__gte=filters['start'])
+    if filters.get('end'):
+        expenses = expenses.filter(date__lte=filters['end'])
+
+    return keyset_page(expenses, per_page, after=after, before=before)
@@ -0,0 +1,104 @@
+"""Per-user sharding of the expense data across several databases.
+
+With ``SHARDS`` set (see ``ET_SHARDS`` in ``et/settings.py``) every per-user
+table — expenses, budgets, schedules, the rollups, versions, tombstones and
+the archive — lives in one shard database, picked by a stable hash of the
+user id, so different users' writes go to different database files and do
+not queue behind one SQLite write lock. Users, categories, sessions and jobs
+stay in ``default``.
+
+``ShardRouter`` sends a query on a per-user model to the shard of the row it
+was given, if Django passes one, and otherwise to the shard selected with
+``use()``. ``ShardMiddleware`` selects the logged-in user's shard for each
+request; jobs and commands select the shard of the user they work for, or
+loop over ``aliases()`` for work spanning all users; the Django admin lists
+one shard at a time (``app.admin.ShardedAdmin``). Transactions around
+per-user writes are opened with ``transaction.atomic(using=sharding.db())``.
+
+Without ``SHARDS`` everything lives in ``default`` and this is a no-op.
+"""
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SHARDED_MODELS = {
+    'expense',
+    'monthlybudget',
+    'categorybudget',
+    'recurringtransaction',
+    'monthlysummary',
+    'dataversion',
+    'tombstone',
+    'archivedexpense',
+    'archivedyear',
+    'spendingstats',
+}
+
+_current = ContextVar('shard', default=None)
+
+
+def enabled():
+    return bool(getattr(settings, 'SHARDS', None))
+
+
+def aliases():
+    """The databases holding per-user data."""
+    return list(settings.SHARDS) if enabled() else [DEFAULT_DB_ALIAS]
+
+
+def for_user(user):
+    """Return the database alias of ``user`` (a ``User`` or a user id)."""
+    shards = aliases()
+    user_id = getattr(user, 'pk', user)
+    # crc32 rather than hash(): it must agree across processes and restarts.
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def db():
+    """The alias per-user queries currently go to.
+
+    ``default`` when no shard is selected, which has no per-user tables once
+    sharding is on, so a code path that forgot to pick one fails loudly.
+    """
+    return _current.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use(alias):
+    """Send per-user queries without an instance to route by to ``alias``."""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'app' and model._meta.model_name in SHARDED_MODELS
+
+
+class ShardRouter:
+    def _route(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        user_id = getattr(instance, 'user_id', None) if instance is not None else None
+        if user_id is not None and is_sharded(type(instance)):
+            return for_user(user_id)
+        return db()
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Per-user rows point at users and categories in ``default``.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not enabled():
+            return None
+        sharded = app_label == 'app' and model_name in SHARDED_MODELS
+        return (db in settings.SHARDS) == sharded
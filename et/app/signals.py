@@ -0,0 +1,89 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from django.db import transaction
+
+from . import accounts, anomalies, categories, sharding, summaries, versions
+from .models import (
+    ArchivedExpense, ArchivedYear, Category, CategoryBudget, DataVersion, Expense,
+    MonthlyBudget, MonthlySummary, RecurringTransaction, SpendingStats, Tombstone,
+)
+
+
+@receiver(post_save, sender=MonthlyBudget)
+@receiver(post_delete, sender=MonthlyBudget)
+@receiver(post_save, sender=CategoryBudget)
+@receiver(post_delete, sender=CategoryBudget)
+def bump_data_version(sender, instance, **kwargs):
+    if not versions.tracked():
+        return
+    with sharding.use(sharding.for_user(instance.user_id)):
+        versions.bump([instance.user_id])
+
+
+@receiver(pre_save, sender=Expense)
+def stamp_expense(sender, instance, **kwargs):
+    if not versions.tracked():
+        return
+    with sharding.use(sharding.for_user(instance.user_id)):
+        instance.version = versions.bump([instance.user_id])[instance.user_id]
+
+
+@receiver(post_delete, sender=Expense)
+def record_deletion(sender, instance, **kwargs):
+    if not versions.tracked():
+        return
+    with sharding.use(sharding.for_user(instance.user_id)):
+        version = versions.bump([instance.user_id])[instance.user_id]
+        Tombstone.objects.create(user_id=instance.user_id, expense_id=instance.pk, version=version)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_data(sender, instance, **kwargs):
+    # The user's rows may be in a shard, out of reach of Django's cascade.
+    # Nothing needs a version stamp or tombstone once the user is gone.
+    alias = sharding.for_user(instance)
+    with sharding.use(alias), versions.untracked(), transaction.atomic(using=alias):
+        for model in (
+            Tombstone, ArchivedExpense, ArchivedYear, MonthlySummary, SpendingStats,
+            CategoryBudget, MonthlyBudget, Expense, RecurringTransaction, DataVersion,
+        ):
+            model.objects.filter(user=instance).delete()
+
+
+@receiver(pre_delete, sender=Category)
+def detach_category(sender, instance, **kwargs):
+    for alias in sharding.aliases():
+        with sharding.use(alias), transaction.atomic(using=alias):
+            CategoryBudget.objects.filter(category=instance).delete()
+            anomalies.detach(instance)
+            summaries.detach(instance)
+            for model in (Expense, ArchivedExpense, RecurringTransaction):
+                model.objects.filter(category=instance).update(category=None)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, instance, **kwargs):
+    # Drop the cache now for this process and again after commit, so a
+    # reload racing the transaction cannot keep the old catalogue.
+    categories.invalidate()
+    transaction.on_commit(categories.invalidate)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # Covers password changes, deactivation and last_login updates. As with
+    # categories, forget it again after commit in case a request re-cached
+    # the old row meanwhile.
+    accounts.forget(instance.pk)
+    transaction.on_commit(lambda: accounts.forget(instance.pk))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        accounts.forget(user.pk)
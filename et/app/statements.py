@@ -0,0 +1,201 @@
+"""Monthly statements for every user, rendered to files in bulk.
+
+A statement carries the figures the dashboard shows — income and expense
+totals, the category breakdown and budget status — for one month, plus the
+year to date. Users are processed in chunks of ids from one shard; each
+chunk reads the ``MonthlySummary`` rollup in a single grouped query and its
+budgets in one query per budget table, whatever the chunk size.
+
+Each user gets ``<output_dir>/<YYYY-MM>/<user_id>.html`` and ``.csv``. Files
+are written to a temporary name and moved into place, so a statement is
+either complete or absent; users whose two files both exist are skipped,
+which makes an interrupted run resumable.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.db.models import Q, Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import categories, sharding
+from .budgets import ZERO, BudgetLine
+from .models import CategoryBudget, MonthlyBudget, MonthlySummary
+
+CHUNK_SIZE = 500
+
+FORMATS = ('html', 'csv')
+
+
+class Statement:
+    def __init__(self, user_id, username, year, month):
+        self.user_id = user_id
+        self.username = username
+        self.period = date(year, month, 1)
+        self.income_total = 0
+        self.expense_total = 0
+        self.year_income_total = 0
+        self.year_expense_total = 0
+        self.category_totals = {}
+        self.budget = None
+        self.category_budgets = []
+
+    @property
+    def profit(self):
+        return self.income_total - self.expense_total
+
+    @property
+    def savings_rate(self):
+        if self.income_total <= 0:
+            return 0
+        return round(self.profit / self.income_total * 100, 2)
+
+    @property
+    def categories(self):
+        """``(name, total)`` pairs, largest spend first."""
+        return sorted(self.category_totals.items(), key=lambda item: -item[1])
+
+
+def directory(output_dir, year, month):
+    return Path(output_dir) / f"{year}-{month:02d}"
+
+
+def paths(output_dir, year, month, user_id):
+    folder = directory(output_dir, year, month)
+    return {fmt: folder / f"{user_id}.{fmt}" for fmt in FORMATS}
+
+
+def is_done(output_dir, year, month, user_id):
+    return all(path.exists() for path in paths(output_dir, year, month, user_id).values())
+
+
+def chunks(year, month, output_dir, chunk_size=CHUNK_SIZE, force=False):
+    """Yield ``(alias, [(user_id, username), ...])`` for users still to render."""
+    pending = {alias: [] for alias in sharding.aliases()}
+    for user_id, username in User.objects.order_by('pk').values_list('pk', 'username'):
+        if force or not is_done(output_dir, year, month, user_id):
+            pending[sharding.for_user(user_id)].append((user_id, username))
+
+    for alias, users in pending.items():
+        for start in range(0, len(users), chunk_size):
+            yield alias, users[start:start + chunk_size]
+
+
+def build(users, year, month):
+    """Return a ``Statement`` per ``(user_id, username)`` pair, from the selected shard."""
+    statements = {
+        user_id: Statement(user_id, username, year, month) for user_id, username in users
+    }
+    user_ids = list(statements)
+
+    rows = (
+        MonthlySummary.objects
+        .filter(user_id__in=user_ids, year=year, month__lte=month)
+        .values('user_id', 'type', 'category_id')
+        .annotate(month_total=Sum('total', filter=Q(month=month), default=0), year_total=Sum('total'))
+        .order_by()
+    )
+    spent_by_category = {}
+    for row in rows:
+        # SQLite sums decimals as floats; bring them back to cents.
+        row['month_total'] = row['month_total'].quantize(ZERO)
+        row['year_total'] = row['year_total'].quantize(ZERO)
+        statement = statements[row['user_id']]
+        if row['type'] == 'income':
+            statement.income_total += row['month_total']
+            statement.year_income_total += row['year_total']
+            continue
+
+        statement.expense_total += row['month_total']
+        statement.year_expense_total += row['year_total']
+        if row['month_total']:
+            name = categories.name(row['category_id'])
+            statement.category_totals[name] = statement.category_totals.get(name, 0) + row['month_total']
+            key = (row['user_id'], row['category_id'])
+            spent_by_category[key] = spent_by_category.get(key, 0) + row['month_total']
+
+    for user_id, amount in (
+        MonthlyBudget.objects
+        .filter(user_id__in=user_ids, year=year, month=month)
+        .values_list('user_id', 'amount')
+    ):
+        statement = statements[user_id]
+        statement.budget = BudgetLine(amount, statement.expense_total)
+
+    for user_id, category_id, amount in (
+        CategoryBudget.objects
+        .filter(user_id__in=user_ids, year=year, month=month)
+        .values_list('user_id', 'category_id', 'amount')
+    ):
+        statements[user_id].category_budgets.append(BudgetLine(
+            amount,
+            spent_by_category.get((user_id, category_id), 0),
+            category=categories.get(category_id),
+        ))
+
+    for statement in statements.values():
+        statement.category_budgets.sort(key=lambda line: line.category.name if line.category else '')
+    return list(statements.values())
+
+
+def render_csv(statement):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Section', 'Item', 'Amount', 'Spent', 'Remaining', 'Used %', 'Status'])
+    writer.writerow(['Totals', 'Income', statement.income_total])
+    writer.writerow(['Totals', 'Expenses', statement.expense_total])
+    writer.writerow(['Totals', 'Profit', statement.profit])
+    writer.writerow(['Totals', 'Savings rate %', statement.savings_rate])
+    writer.writerow(['Year to date', 'Income', statement.year_income_total])
+    writer.writerow(['Year to date', 'Expenses', statement.year_expense_total])
+    for name, total in statement.categories:
+        writer.writerow(['Category', name, total])
+    lines = [('Budget', 'Overall', statement.budget)] if statement.budget else []
+    lines += [
+        ('Category budget', line.category.name if line.category else 'Uncategorized', line)
+        for line in statement.category_budgets
+    ]
+    for section, item, line in lines:
+        writer.writerow([section, item, line.amount, line.spent, line.variance, line.percentage, line.status])
+    return output.getvalue()
+
+
+def render_html(statement):
+    return render_to_string('app/statement.html', {
+        'statement': statement,
+        'generated_at': timezone.now(),
+    })
+
+
+def write_atomic(path, content):
+    """Write ``content`` to ``path`` through a temporary file in the same directory."""
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', newline='') as temp:
+            temp.write(content)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_chunk(alias, users, year, month, output_dir):
+    """Render and write the statements of one chunk; return how many were written."""
+    with sharding.use(alias):
+        statements = build(users, year, month)
+
+    folder = directory(output_dir, year, month)
+    folder.mkdir(parents=True, exist_ok=True)
+    for statement in statements:
+        targets = paths(output_dir, year, month, statement.user_id)
+        # CSV last: a statement counts as done once both files exist.
+        write_atomic(targets['html'], render_html(statement))
+        write_atomic(targets['csv'], render_csv(statement))
+    return len(statements)
@@ -0,0 +1,223 @@
+"""Maintenance of the ``MonthlySummary`` rollup table.
+
+Every write to ``Expense`` should be mirrored here inside the same
+transaction: ``record(expense)`` after a create, ``record(expense, -1)``
+before a delete, and both (old copy negated, new instance added) for an
+edit.  ``rebuild`` recomputes everything from the raw rows, archived
+ones included.
+
+The per-category ``SpendingStats`` (see ``app.anomalies``) are kept and
+rebuilt along with the rollup.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from . import anomalies, sharding
+from .models import ArchivedExpense, Expense, MonthlySummary
+
+CHUNK_SIZE = 500
+
+
+def _key(expense):
+    return (
+        expense.user_id,
+        expense.date.year,
+        expense.date.month,
+        expense.category_id,
+        expense.type,
+    )
+
+
+class Deltas(defaultdict):
+    """Pending ``[amount, count]`` changes per summary row.
+
+    ``amounts`` collects the same expenses for the spending statistics.
+    """
+
+    def __init__(self):
+        super().__init__(lambda: [Decimal('0'), 0])
+        self.amounts = anomalies.Batch()
+
+
+def collect(expenses, sign=1, deltas=None):
+    """Accumulate the rollup changes for ``expenses`` without writing them.
+
+    Bulk writers call this per batch and ``apply`` once at the end, so the
+    number of summary queries depends on the months touched, not the rows.
+    """
+    if deltas is None:
+        deltas = Deltas()
+    for expense in expenses:
+        delta = deltas[_key(expense)]
+        delta[0] += Decimal(expense.amount) * sign
+        delta[1] += sign
+        deltas.amounts.add(expense, sign)
+    return deltas
+
+
+def apply(deltas):
+    """Write accumulated ``deltas`` to the rollup.
+
+    The touched rows are locked and read a chunk of users at a time. Rows
+    receiving the same change are updated together with one ``F()``
+    update and missing rows are inserted with ``bulk_create``, so a batch of
+    similar transactions for thousands of users costs a handful of queries
+    rather than two per summary row.
+
+    The spending statistics of the same expenses are updated in the same
+    transaction, even when the rollup itself does not change (an edit can
+    keep a month's total and count but change the spread of its amounts).
+    """
+    by_user = defaultdict(dict)
+    for key, (amount, count) in deltas.items():
+        if count or amount:
+            by_user[key[0]][key] = (amount, count)
+    if not by_user and not deltas.amounts.keys():
+        return
+
+    try:
+        with transaction.atomic(using=sharding.db()):
+            _write(by_user, deltas.amounts)
+    except IntegrityError:
+        # A concurrent transaction inserted one of our new rows first. It
+        # has committed by now, so a second pass finds and updates it.
+        with transaction.atomic(using=sharding.db()):
+            _write(by_user, deltas.amounts)
+
+
+def _write(by_user, amounts):
+    anomalies.apply(amounts)
+
+    user_ids = sorted(by_user)
+    existing = {}
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[start:start + CHUNK_SIZE]
+        keys = [key for user_id in chunk for key in by_user[user_id]]
+        rows = (
+            MonthlySummary.objects
+            .select_for_update()
+            .filter(
+                user_id__in=chunk,
+                year__in={key[1] for key in keys},
+                month__in={key[2] for key in keys},
+            )
+            .order_by('pk')
+            .values_list('pk', 'user_id', 'year', 'month', 'category_id', 'type', 'count')
+        )
+        for pk, *key, count in rows:
+            existing.setdefault(tuple(key), (pk, count))
+
+    updates = defaultdict(list)
+    created = []
+    emptied = []
+    for changes in by_user.values():
+        for (user_id, year, month, category_id, type_), (amount, count) in changes.items():
+            row = existing.get((user_id, year, month, category_id, type_))
+            if row is None:
+                if count <= 0:
+                    continue
+                created.append(MonthlySummary(
+                    user_id=user_id,
+                    year=year,
+                    month=month,
+                    category_id=category_id,
+                    type=type_,
+                    total=amount,
+                    count=count,
+                ))
+            elif row[1] + count <= 0:
+                emptied.append(row[0])
+            else:
+                updates[(amount, count)].append(row[0])
+
+    for (amount, count), pks in updates.items():
+        for start in range(0, len(pks), CHUNK_SIZE):
+            MonthlySummary.objects.filter(pk__in=pks[start:start + CHUNK_SIZE]).update(
+                total=F('total') + amount,
+                count=F('count') + count,
+            )
+    MonthlySummary.objects.bulk_create(created, batch_size=CHUNK_SIZE)
+    for start in range(0, len(emptied), CHUNK_SIZE):
+        MonthlySummary.objects.filter(pk__in=emptied[start:start + CHUNK_SIZE]).delete()
+
+
+def record_many(expenses, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) expenses from the rollup."""
+    apply(collect(expenses, sign))
+
+
+def record(expense, sign=1):
+    record_many([expense], sign)
+
+
+def detach(category):
+    """Fold each user's rollup rows for ``category`` into the uncategorized ones.
+
+    For the selected shard, before the category's expenses lose it.
+    """
+    deltas = Deltas()
+    rows = MonthlySummary.objects.filter(category=category).values_list(
+        'user_id', 'year', 'month', 'type', 'total', 'count',
+    )
+    for user_id, year, month, type_, total, count in rows:
+        moved = deltas[(user_id, year, month, category.pk, type_)]
+        moved[0] -= total
+        moved[1] -= count
+        kept = deltas[(user_id, year, month, None, type_)]
+        kept[0] += total
+        kept[1] += count
+    apply(deltas)
+
+
+GROUP_BY = ('user_id', 'year', 'month', 'category_id', 'type')
+
+
+def _grouped(model, user):
+    rows = model.objects.all()
+    if user is not None:
+        rows = rows.filter(user=user)
+    return (
+        rows
+        .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values(*GROUP_BY)
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+
+
+def _merged(user):
+    # Archived years are closed, so few of their months also have hot rows;
+    # those are added together, the rest pass straight through.
+    archived = {
+        tuple(item[name] for name in GROUP_BY): item
+        for item in _grouped(ArchivedExpense, user).iterator()
+    }
+    for item in _grouped(Expense, user).iterator():
+        other = archived.pop(tuple(item[name] for name in GROUP_BY), None)
+        if other is not None:
+            item['total'] += other['total']
+            item['count'] += other['count']
+        yield item
+    yield from archived.values()
+
+
+def rebuild(user=None):
+    """Recompute the rollup from ``Expense`` and its archive, for one user or everyone."""
+    summaries = MonthlySummary.objects.all()
+    if user is not None:
+        summaries = summaries.filter(user=user)
+
+    count = 0
+    for alias in [sharding.for_user(user)] if user is not None else sharding.aliases():
+        with sharding.use(alias), transaction.atomic(using=alias):
+            summaries.delete()
+            count += len(MonthlySummary.objects.bulk_create(
+                (MonthlySummary(**item) for item in _merged(user)),
+                batch_size=1000,
+            ))
+    anomalies.rebuild(user)
+    return count
@@ -0,0 +1,208 @@
+"""Batched writes and a change feed for offline client apps.
+
+``apply`` takes a list of create/update/delete operations on a user's
+expenses, validates each with ``ExpenseForm`` and writes all valid ones in
+one transaction under a single version stamp. Every operation gets its
+own result, so one bad row does not reject the batch.
+
+``changes`` returns what changed after a cursor: expenses whose
+``version`` is newer and ``Tombstone`` rows for deleted ones, merged in
+``(version, id)`` order and paged on that pair.
+"""
+import copy
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import sharding, summaries, versions
+from .forms import ExpenseForm
+from .models import Expense, Tombstone
+from .pagination import decode_token, encode_token
+
+MAX_OPERATIONS = 1000
+PAGE_SIZE = 500
+
+FIELDS = ['title', 'amount', 'date', 'category', 'description', 'type']
+
+
+class SyncError(Exception):
+    """The request as a whole is malformed."""
+
+
+def serialize(expense):
+    return {
+        'id': expense.pk,
+        'title': expense.title,
+        'amount': str(expense.amount),
+        'date': expense.date.isoformat(),
+        'category': expense.category_id,
+        'description': expense.description,
+        'type': expense.type,
+        'recurring': expense.recurring_id,
+        'version': expense.version,
+    }
+
+
+def _form_data(expense):
+    data = serialize(expense)
+    return {field: data[field] for field in FIELDS}
+
+
+def _error(index, errors):
+    return {
+        'index': index,
+        'status': 'error',
+        'errors': {field: list(messages) for field, messages in errors.items()},
+    }
+
+
+def apply(user, operations):
+    """Apply a batch of operations for ``user``; return one result per operation."""
+    if not isinstance(operations, list):
+        raise SyncError("'operations' must be a list.")
+    if len(operations) > MAX_OPERATIONS:
+        raise SyncError(f"At most {MAX_OPERATIONS} operations are accepted per request.")
+
+    ids = [
+        op.get('id') for op in operations
+        if isinstance(op, dict) and op.get('op') in ('update', 'delete')
+    ]
+    existing = Expense.objects.filter(user=user).in_bulk(
+        [pk for pk in ids if isinstance(pk, int)]
+    )
+
+    results = [None] * len(operations)
+    created, updated, deleted = [], [], []
+    previous = []
+    seen = set()
+
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            results[index] = _error(index, {'__all__': ["Each operation must be an object."]})
+            continue
+
+        kind = op.get('op')
+        if kind == 'create':
+            form = ExpenseForm(op.get('data') or {})
+            if not form.is_valid():
+                results[index] = _error(index, form.errors)
+                continue
+            expense = form.save(commit=False)
+            expense.user = user
+            created.append((index, op.get('client_id'), expense))
+            continue
+
+        if kind not in ('update', 'delete'):
+            results[index] = _error(index, {'op': ["Expected 'create', 'update' or 'delete'."]})
+            continue
+
+        expense = existing.get(op.get('id'))
+        if expense is None:
+            results[index] = _error(index, {'id': ["No such expense."]})
+            continue
+        if expense.pk in seen:
+            results[index] = _error(index, {'id': ["This expense is already changed by an earlier operation."]})
+            continue
+        seen.add(expense.pk)
+
+        if kind == 'delete':
+            deleted.append((index, expense))
+            continue
+
+        before = copy.copy(expense)
+        form = ExpenseForm({**_form_data(expense), **(op.get('data') or {})}, instance=expense)
+        if not form.is_valid():
+            results[index] = _error(index, form.errors)
+            continue
+        updated.append((index, form.save(commit=False)))
+        previous.append(before)
+
+    if created or updated or deleted:
+        with transaction.atomic(using=sharding.db()), versions.untracked():
+            version = versions.bump([user.pk])[user.pk]
+
+            new = [expense for _, _, expense in created]
+            changed = [expense for _, expense in updated]
+            removed = [expense for _, expense in deleted]
+            for expense in new + changed:
+                expense.version = version
+
+            Expense.objects.bulk_create(new)
+            # One UPDATE per row: bulk_update's CASE expressions measured
+            # about three times slower for batches of this size.
+            for expense in changed:
+                Expense.objects.filter(pk=expense.pk).update(
+                    title=expense.title,
+                    amount=expense.amount,
+                    date=expense.date,
+                    category_id=expense.category_id,
+                    description=expense.description,
+                    type=expense.type,
+                    recurring_id=expense.recurring_id,
+                    version=version,
+                )
+            Tombstone.objects.bulk_create([
+                Tombstone(user=user, expense_id=expense.pk, version=version)
+                for expense in removed
+            ])
+            Expense.objects.filter(pk__in=[expense.pk for expense in removed]).delete()
+
+            deltas = summaries.collect(new)
+            summaries.collect(changed, deltas=deltas)
+            summaries.collect(previous, -1, deltas=deltas)
+            summaries.collect(removed, -1, deltas=deltas)
+            summaries.apply(deltas)
+
+    for index, client_id, expense in created:
+        results[index] = {
+            'index': index, 'status': 'created', 'client_id': client_id,
+            'id': expense.pk, 'version': expense.version,
+        }
+    for index, expense in updated:
+        results[index] = {'index': index, 'status': 'updated', 'id': expense.pk, 'version': expense.version}
+    for index, expense in deleted:
+        results[index] = {'index': index, 'status': 'deleted', 'id': expense.pk}
+    return results
+
+
+def _decode(cursor):
+    try:
+        version, pk = decode_token(cursor)
+        return int(version), int(pk)
+    except ValueError:
+        raise SyncError("Invalid cursor.")
+
+
+def changes(user, cursor=None, limit=PAGE_SIZE):
+    """Return a page of changes after ``cursor``; ``None`` starts a full sync.
+
+    The result holds the changed expenses, the ids deleted since, the cursor
+    to pass next time and whether more changes are waiting.
+    """
+    version, pk = _decode(cursor) if cursor else (-1, 0)
+    after = Q(version__gt=version) | Q(version=version, pk__gt=pk)
+
+    rows = list(Expense.objects.filter(user=user).filter(after).order_by('version', 'pk')[:limit + 1])
+    items = [(expense.version, expense.pk, expense) for expense in rows]
+
+    # A client starting from scratch has nothing to delete.
+    if cursor:
+        tombstones = (
+            Tombstone.objects.filter(user=user)
+            .filter(Q(version__gt=version) | Q(version=version, expense_id__gt=pk))
+            .order_by('version', 'expense_id')
+            .values_list('version', 'expense_id')[:limit + 1]
+        )
+        items += [(stamp, expense_id, None) for stamp, expense_id in tombstones]
+        items.sort(key=lambda item: item[:2])
+
+    page = items[:limit]
+    if page:
+        version, pk = page[-1][:2]
+
+    return {
+        'changes': [serialize(expense) for _, _, expense in page if expense is not None],
+        'deleted': [expense_id for _, expense_id, expense in page if expense is None],
+        'cursor': encode_token(version, pk),
+        'has_more': len(items) > limit,
+    }
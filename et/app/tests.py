@@ -1,3 +1,1772 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from unittest import mock, skipIf, skipUnless
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.utils import load_backend
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from . import analytics, anomalies, archive, budgets, categories, checks, jobs, ratelimit, recurring, search, sharding, statements, summaries, sync, views
+from .models import ArchivedExpense, ArchivedYear, Category, CategoryBudget, DataVersion, Expense, Job, MonthlyBudget, MonthlySummary, RecurringTransaction, SpendingStats, Tombstone
+from .forms import AnalyticsForm
+from .management.commands import run_jobs
+from .pagination import encode_token, keyset_page
+from .views import year_range
+
+
+class AppTestCase(TestCase):
+    # With ET_SHARDS set, per-user rows live in the shard databases.
+    databases = '__all__'
+
+    def use_shard_of(self, user):
+        """Send the test's per-user queries to ``user``'s shard, as ShardMiddleware does."""
+        self.enterContext(sharding.use(sharding.for_user(user)))
+
+    @contextmanager
+    def assertNumQueriesEverywhere(self, num):
+        """``assertNumQueries`` summed over every database, shards included."""
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            yield
+        executed = sum(len(context) for context in captured)
+        self.assertEqual(executed, num, f"{executed} queries executed, {num} expected")
+
+
+def query_plan(sql, params=(), using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class DashboardQueryPlanTests(AppTestCase):
+    """The dashboard's queries must be index range scans, never table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        other = User.objects.create_user('bob', password='pw')
+        food = Category.objects.create(name='Food')
+
+        start = date(date.today().year - 2, 1, 1)
+        rows = [
+            Expense(
+                user=cls.user if i % 2 else other,
+                title=f'Row {i}',
+                amount=i,
+                date=start + timedelta(days=i % 700),
+                category=food,
+                type='income' if i % 7 == 0 else 'expense',
+            )
+            for i in range(2000)
+        ]
+        for user in (cls.user, other):
+            with sharding.use(sharding.for_user(user)):
+                Expense.objects.bulk_create([row for row in rows if row.user_id == user.pk])
+        summaries.rebuild()
+
+        cls.alias = sharding.for_user(cls.user)
+        for alias in connections:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+    def assertNoFullScans(self, sql, params=()):
+        plan = query_plan(sql, params, using=self.alias)
+        for line in plan:
+            if line.startswith('SCAN') and ('app_expense' in line or 'app_monthlysummary' in line):
+                self.fail(f"Full scan in plan {plan} for {sql}")
+        return plan
+
+    def test_dashboard_queries_use_index_range_scans(self):
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connections[self.alias]) as captured:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+        app_queries = [
+            query['sql'] for query in captured.captured_queries
+            if 'app_' in query['sql'] and query['sql'].startswith('SELECT')
+        ]
+        self.assertTrue(app_queries)
+        for sql in app_queries:
+            self.assertNoFullScans(sql)
+
+    def test_type_sum_over_year_uses_covering_index(self):
+        year_start, year_end = year_range(date.today().year - 1)
+        queryset = (
+            Expense.objects.using(self.alias)
+            .filter(user=self.user, type='expense', date__gte=year_start, date__lt=year_end)
+            .values('type')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+
+        plan = self.assertNoFullScans(*queryset.query.sql_with_params())
+        self.assertTrue(
+            any('COVERING INDEX' in line for line in plan),
+            f"Expected a covering index in {plan}",
+        )
+
+
+class BudgetHistoryTests(AppTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        cls.rent = Category.objects.create(name='Rent')
+        cls.alias = cls.enterClassContext(sharding.use(sharding.for_user(cls.user)))
+
+        first_year = date.today().year - 4
+        for year in range(first_year, first_year + 5):
+            for month in range(1, 13):
+                MonthlyBudget.objects.create(user=cls.user, year=year, month=month, amount=100)
+                CategoryBudget.objects.create(
+                    user=cls.user, year=year, month=month, category=cls.food, amount=30,
+                )
+        Expense.objects.bulk_create([
+            Expense(user=cls.user, title='Lunch', amount=40, date=date(first_year, 3, 5),
+                    category=cls.food, type='expense'),
+            Expense(user=cls.user, title='Rent', amount=50, date=date(first_year, 3, 1),
+                    category=cls.rent, type='expense'),
+            Expense(user=cls.user, title='Salary', amount=900, date=date(first_year, 3, 1),
+                    type='income'),
+        ])
+        summaries.rebuild()
+        cls.first_year = first_year
+
+    def test_five_years_of_budgets_take_one_query(self):
+        categories.catalogue()
+        with self.assertNumQueries(1, using=self.alias):
+            months = budgets.history(self.user)
+
+        self.assertEqual(len(months), 60)
+        self.assertEqual((months[0].year, months[0].month), (self.first_year + 4, 12))
+
+        march = next(m for m in months if (m.year, m.month) == (self.first_year, 3))
+        self.assertEqual(march.overall.spent, 90)
+        self.assertEqual(march.overall.variance, 10)
+        self.assertEqual(march.overall.status, 'warning')
+        [food] = march.categories
+        self.assertEqual(food.category, self.food)
+        self.assertEqual(food.spent, 40)
+        self.assertEqual(food.status, 'over')
+
+        self.assertEqual(months[0].overall.spent, 0)
+        self.assertEqual(months[0].overall.status, 'ok')
+
+
+@skipUnless(analytics.available(), "Analytics need NumPy.")
+class AnalyticsTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+        for day, amount, type_, category in [
+            (date(2023, 2, 28), '5.00', 'expense', None),
+            (date(2023, 3, 1), '12.50', 'expense', self.food),
+            (date(2024, 2, 29), '20.00', 'expense', self.food),
+            (date(2024, 2, 29), '100.00', 'income', None),
+            (date(2024, 3, 4), '7.25', 'expense', self.food),
+        ]:
+            Expense.objects.create(
+                user=self.user, title='Row', amount=amount, date=day, type=type_, category=category,
+            )
+        ArchivedExpense.objects.create(
+            id=10_000, user=self.user, title='Old', amount='3.00', date=date(2023, 3, 2), type='expense',
+        )
+        self.data = analytics.history(self.user)
+
+    def test_series(self):
+        monthly = analytics.totals(self.data, date(2024, 2, 1), date(2024, 3, 31), 'month')
+        self.assertEqual(monthly, {
+            'labels': ['2024-02-01', '2024-03-01'], 'income': [100.0, 0.0], 'expense': [20.0, 7.25],
+        })
+        weekly = analytics.totals(self.data, date(2024, 2, 29), date(2024, 3, 4), 'week')
+        self.assertEqual(weekly['labels'], ['2024-02-26', '2024-03-04'])
+        self.assertEqual(weekly['expense'], [20.0, 7.25])
+
+        rolling = analytics.rolling_average(self.data, date(2024, 2, 29), date(2024, 3, 1), windows=(1, 2))
+        self.assertEqual(rolling['daily'], [20.0, 0.0])
+        self.assertEqual(rolling['avg_2'], [10.0, 10.0])
+
+        self.assertEqual(
+            analytics.category_totals(self.data, date(2023, 1, 1), date(2023, 12, 31)),
+            {None: 8.0, self.food.pk: 12.5},
+        )
+        yoy = analytics.year_over_year(self.data, 2024)
+        self.assertEqual((yoy['previous'][1], yoy['previous'][2]), (5.0, 15.5))
+        self.assertEqual((yoy['current'][1], yoy['current'][2]), (20.0, 7.25))
+
+    def test_history_reloads_after_a_write(self):
+        self.assertIs(analytics.history(self.user), self.data)
+        self.client.post(reverse('add-expense'), {
+            'title': 'Lunch', 'amount': 4, 'date': date(2024, 3, 5), 'category': self.food.pk, 'type': 'expense',
+        })
+        self.assertEqual(len(analytics.history(self.user)), len(self.data) + 1)
+
+    def test_default_range_ends_on_a_leap_day(self):
+        form = AnalyticsForm({'end': '2024-02-29'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['start'], date(2023, 3, 1))
+
+        response = self.client.get(reverse('analytics-data'), {'end': '2024-02-29', 'granularity': 'month'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['start'], '2023-03-01')
+        self.assertEqual(body['totals']['expense'][0], 15.5)
+        self.assertEqual(body['totals']['income'][-1], 100.0)
+        self.assertEqual(body['categories'], {'labels': ['General', 'Food'], 'data': [3.0, 32.5]})
+
+    def test_invalid_range_is_rejected(self):
+        response = self.client.get(reverse('analytics-data'), {'start': '2024-03-01', 'end': '2024-02-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class SummaryConsistencyTests(AppTestCase):
+    """Every write path leaves the rollup equal to a fresh GROUP BY over ``Expense``."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True, is_superuser=True)
+        self.food = Category.objects.create(name='Food')
+        self.rent = Category.objects.create(name='Rent')
+        self.use_shard_of(self.user)
+
+    def assertRollupMatches(self):
+        rollup = Counter(
+            (s.user_id, s.year, s.month, s.category_id, s.type, s.total, s.count)
+            for s in MonthlySummary.objects.all()
+        )
+        grouped = Counter(
+            tuple(item.values())
+            for item in Expense.objects
+            .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+            .values('user_id', 'year', 'month', 'category_id', 'type')
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by()
+        )
+        self.assertEqual(rollup, grouped)
+
+    def test_view_writes_keep_the_rollup_exact(self):
+        self.client.force_login(self.user)
+        data = {'title': 'Lunch', 'amount': '10', 'date': '2024-01-05', 'category': self.food.pk, 'type': 'expense'}
+        for title, changes in [
+            ('Lunch', {}),
+            ('Dinner', {'amount': '25', 'date': '2024-01-20'}),
+            ('Salary', {'amount': '1000', 'type': 'income'}),
+        ]:
+            self.client.post(reverse('add-expense'), {**data, 'title': title, **changes})
+        self.assertEqual(Expense.objects.count(), 3)
+        self.assertRollupMatches()
+
+        lunch = Expense.objects.get(title='Lunch')
+        edit = reverse('edit-expense', args=[lunch.pk])
+        for changes in [
+            {'amount': '12.50'},
+            {'date': '2024-02-03'},
+            {'type': 'income'},
+            {'category': self.rent.pk},
+            {'amount': '3', 'date': '2024-01-05', 'type': 'expense', 'category': self.food.pk},
+        ]:
+            data.update(changes)
+            response = self.client.post(edit, data)
+            self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+            self.assertRollupMatches()
+
+        self.client.post(reverse('delete-expense', args=[lunch.pk]))
+        self.assertRollupMatches()
+
+        # Deleting a category folds its rows into the existing uncategorized ones.
+        coffee = Expense(user=self.user, title='Coffee', amount=4, date=date(2024, 1, 9), type='expense')
+        coffee.save()
+        summaries.record(coffee)
+        self.food.delete()
+        self.assertRollupMatches()
+        self.assertEqual(MonthlySummary.objects.get(month=1, type='expense').total, 29)
+
+    def test_admin_writes_keep_the_rollup_exact(self):
+        self.client.force_login(self.staff)
+        alias = sharding.for_user(self.user)
+        filters = f'?_changelist_filters=shard%3D{alias}'
+        data = {
+            'user': self.user.pk, 'title': 'Lunch', 'amount': '10', 'date': '2024-01-05',
+            'category': self.food.pk, 'type': 'expense', 'description': '',
+        }
+        for title in ['Lunch', 'Dinner', 'Taxi']:
+            response = self.client.post(reverse('admin:app_expense_add'), {**data, 'title': title})
+            self.assertEqual(response.status_code, 302)
+        self.assertRollupMatches()
+
+        lunch, dinner, taxi = Expense.objects.order_by('pk')
+        for changes in [
+            {'amount': '40'},
+            {'date': '2024-03-01'},
+            {'type': 'income', 'category': self.rent.pk},
+        ]:
+            data.update(changes)
+            response = self.client.post(reverse('admin:app_expense_change', args=[lunch.pk]) + filters, data)
+            self.assertEqual(response.status_code, 302)
+            self.assertRollupMatches()
+
+        response = self.client.post(reverse('admin:app_expense_delete', args=[lunch.pk]) + filters, {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertRollupMatches()
+
+        changelist = reverse('admin:app_expense_changelist')
+        if sharding.enabled():
+            changelist += f'?shard={alias}'
+        response = self.client.post(changelist, {
+            'action': 'delete_selected', '_selected_action': [dinner.pk, taxi.pk], 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(MonthlySummary.objects.exists())
+
+    def test_rollup_keys_are_unique(self):
+        MonthlySummary.objects.create(user=self.user, year=2024, month=1, type='expense', total=5, count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic(using=sharding.db()):
+            MonthlySummary.objects.create(user=self.user, year=2024, month=1, type='expense', total=5, count=1)
+        MonthlySummary.objects.create(user=self.user, year=2024, month=1, category=self.food, type='expense', total=5, count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic(using=sharding.db()):
+            MonthlySummary.objects.create(user=self.user, year=2024, month=1, category=self.food, type='expense', total=5, count=1)
+
+
+class DashboardValidatorTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+        lunch = Expense(user=self.user, title='Lunch', amount=10, date=date.today(), category=self.food, type='expense')
+        lunch.save()
+        summaries.record(lunch)
+
+    def test_matching_etag_is_answered_from_the_data_version(self):
+        etag = self.client.get(reverse('index'))['ETag']
+
+        # The session and its user, then the version stamp; nothing else.
+        with self.assertNumQueriesEverywhere(3), ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            response = self.client.get(reverse('index'), headers={'if-none-match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        app_queries = [
+            query['sql'] for context in captured for query in context.captured_queries if 'app_' in query['sql']
+        ]
+        self.assertEqual(len(app_queries), 1)
+        self.assertIn('app_dataversion', app_queries[0])
+
+    def test_writes_and_flash_messages_change_the_etag(self):
+        etag = self.client.get(reverse('index'))['ETag']
+
+        self.client.post(reverse('add-expense'), {
+            'title': 'Dinner', 'amount': '20', 'date': date.today(), 'category': self.food.pk, 'type': 'expense',
+        })
+        # The pending "Expense added" message must reach the page.
+        response = self.client.get(reverse('index'), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertContains(response, 'Expense added successfully!')
+
+        response = self.client.get(reverse('index'), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.context['expense_total'], 30)
+
+
+    def test_invalid_year_falls_back_to_the_current_year(self):
+        for year in ['abc', '0', '9999', '-5', '']:
+            response = self.client.get(reverse('chart-data'), {'year': year})
+            self.assertEqual(response.status_code, 200, year)
+            self.assertEqual(response.json()['year'], date.today().year)
+            self.assertEqual(response.json()['expense_total'], 10)
+        self.assertEqual(self.client.get(reverse('index'), {'year': 'abc'}).context['selected_year'], date.today().year)
+
+@override_settings(ROOT_URLCONF='app.tests')
+class AsyncDashboardTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.use_shard_of(self.user)
+        today = date.today()
+        for title, amount, kind in [('Salary', 900, 'income'), ('Lunch', 12, 'expense'), ('Dinner', 30, 'expense')]:
+            expense = Expense(user=self.user, title=title, amount=amount, date=today, category=self.food, type=kind)
+            expense.save()
+            summaries.record(expense)
+        MonthlyBudget(user=self.user, year=today.year, month=today.month, amount=100).save()
+
+    @staticmethod
+    def shown(context):
+        keys = [
+            'income_total', 'expense_total', 'profit', 'savings_rate', 'budget_amount', 'monthly_spent',
+            'remaining_budget', 'budget_percentage', 'labels', 'data', 'monthly_labels', 'monthly_income',
+            'monthly_expense', 'unusual_months', 'unusual_expenses', 'selected_year', 'years',
+        ]
+        return {key: context[key] for key in keys} | {'page_obj': [expense.pk for expense in context['page_obj']]}
+
+    async def test_renders_the_same_context_as_the_sync_view(self):
+        expected = await sync_to_async(self.client.get)(reverse('index'))
+        response = await self.async_client.get(reverse('async-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.shown(response.context), self.shown(expected.context))
+        self.assertEqual(response.context['expense_total'], 42)
+
+    async def test_matching_etag_gets_a_304(self):
+        etag = (await self.async_client.get(reverse('async-dashboard')))['ETag']
+        response = await self.async_client.get(reverse('async-dashboard'), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    async def test_reads_inside_a_transaction_share_its_connection(self):
+        # TestCase keeps the rows above uncommitted: other connections would
+        # not see them, so gather_reads must not hand the calls to threads.
+        count = Expense.objects.filter(user=self.user).count
+        with mock.patch.object(views, '_run_read', side_effect=AssertionError):
+            self.assertEqual(await views.gather_reads((count,), (count,)), [3, 3])
+
+
+# The project's URLs plus the async dashboard, which is only routed when
+# ASYNC_DASHBOARD is set; see AsyncDashboardTests.
+urlpatterns = [
+    path('async-dashboard/', views.async_dashboard, name='async-dashboard'),
+    path('', include('et.urls')),
+]
+
+
+class KeysetPaginationTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.use_shard_of(self.user)
+        # Three rows share a day, so the id has to break the tie.
+        for day in [3, 1, 2, 2, 2, 5, 4]:
+            Expense(user=self.user, title=f'Day {day}', amount=1, date=date(2024, 1, day), type='expense').save()
+        self.expenses = Expense.objects.filter(user=self.user)
+        self.newest_first = [e.pk for e in sorted(self.expenses, key=lambda e: (e.date, e.pk), reverse=True)]
+
+    def walk(self, queryset, per_page):
+        pages, page = [], keyset_page(queryset, per_page)
+        self.assertFalse(page.has_previous())
+        while True:
+            pages.append([expense.pk for expense in page])
+            if not page.has_next():
+                break
+            page = keyset_page(queryset, per_page, after=page.next_cursor)
+
+        back = [pages[-1]]
+        while page.has_previous():
+            page = keyset_page(queryset, per_page, before=page.previous_cursor)
+            back.insert(0, [expense.pk for expense in page])
+        self.assertEqual(back, pages)
+        return pages
+
+    def test_cursors_walk_both_ways_through_tied_dates(self):
+        pages = self.walk(self.expenses, 3)
+        self.assertEqual(pages, [self.newest_first[0:3], self.newest_first[3:6], self.newest_first[6:]])
+
+    def test_malformed_or_tampered_cursors_give_the_first_page(self):
+        first = [expense.pk for expense in keyset_page(self.expenses, 3)]
+        for cursor in [
+            '!!!', 'é', encode_token('2024-01-02', 1), encode_token('2024-13-01', 0, 1),
+            encode_token('2024-01-02', 0, 'x'), encode_token('2024-01-02', 0, 1, 2),
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+        ]:
+            with self.subTest(cursor=cursor):
+                page = keyset_page(self.expenses, 3, after=cursor)
+                self.assertEqual([expense.pk for expense in page], first)
+                self.assertFalse(page.has_previous())
+                page = keyset_page(self.expenses, 3, before=cursor)
+                self.assertEqual([expense.pk for expense in page], first)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'), {'year': 2024, 'after': '!!!'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_archived_rows_are_merged_into_the_pages(self):
+        next_id = max(self.newest_first) + 1
+        for offset, day in enumerate([6, 2, 1]):
+            ArchivedExpense(
+                id=next_id + offset, user=self.user, title=f'Archived {day}', amount=1,
+                date=date(2024, 1, day), type='expense',
+            ).save()
+        archived = ArchivedExpense.objects.filter(user=self.user)
+        merged = sorted(
+            [*self.expenses, *archived], key=lambda e: (e.date, isinstance(e, ArchivedExpense), e.pk), reverse=True,
+        )
+
+        pages = self.walk([self.expenses, archived], 4)
+        self.assertEqual(sum(pages, []), [expense.pk for expense in merged])
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+
+
+class RecurringGenerationTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.rent = Category.objects.create(name='Rent')
+        self.use_shard_of(self.user)
+
+    def test_generation_is_idempotent_and_keeps_summaries_in_step(self):
+        RecurringTransaction.objects.create(
+            user=self.user, title='Rent', amount=1000, category=self.rent,
+            frequency='monthly', start_date=date(2024, 1, 31),
+        )
+        RecurringTransaction.objects.create(
+            user=self.user, title='Gym', amount=10, frequency='weekly', interval=2,
+            start_date=date(2024, 1, 1), end_date=date(2024, 2, 1),
+        )
+
+        result = recurring.generate(until=date(2024, 4, 30))
+        self.assertEqual(result.created, 4 + 3)
+
+        rent_days = list(
+            Expense.objects.filter(title='Rent').order_by('date').values_list('date', flat=True)
+        )
+        self.assertEqual(rent_days, [
+            date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30),
+        ])
+        self.assertFalse(RecurringTransaction.objects.get(title='Gym').active)
+
+        again = recurring.generate(until=date(2024, 4, 30))
+        self.assertEqual(again.created, 0)
+        self.assertEqual(Expense.objects.count(), 7)
+
+        # An interrupted run that left next_date behind must not duplicate rows.
+        RecurringTransaction.objects.filter(title='Rent').update(next_date=date(2024, 3, 31))
+        replay = recurring.generate(until=date(2024, 5, 31))
+        self.assertEqual((replay.created, replay.skipped), (1, 2))
+
+        expected = (
+            Expense.objects.values('date__year', 'date__month', 'category_id', 'type')
+            .annotate(total=Sum('amount')).order_by()
+        )
+        self.assertEqual(
+            {(e['date__year'], e['date__month'], e['category_id'], e['type']): e['total'] for e in expected},
+            {(s.year, s.month, s.category_id, s.type): s.total for s in MonthlySummary.objects.all()},
+        )
+
+    def test_deleting_a_schedule_syncs_the_unlinked_transactions(self):
+        schedule = RecurringTransaction.objects.create(
+            user=self.user, title='Rent', amount=1000, category=self.rent,
+            frequency='monthly', start_date=date(2024, 1, 1),
+        )
+        recurring.generate(until=date(2024, 2, 1))
+        cursor = sync.changes(self.user)['cursor']
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('delete-recurring', args=[schedule.pk]))
+
+        changed = sync.changes(self.user, cursor)['changes']
+        self.assertEqual(len(changed), 2)
+        self.assertEqual([item['recurring'] for item in changed], [None, None])
+
+    def test_occurrences_can_be_moved_onto_each_others_dates(self):
+        RecurringTransaction.objects.create(
+            user=self.user, title='Rent', amount=1000, category=self.rent,
+            frequency='monthly', start_date=date(2024, 1, 1),
+        )
+        recurring.generate(until=date(2024, 4, 1))
+        jan, feb, mar, apr = Expense.objects.order_by('date')
+        data = {'title': 'Rent', 'amount': '1000.00', 'category': self.rent.pk, 'type': 'expense'}
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('edit-expense', args=[jan.pk]), {**data, 'date': feb.date})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        jan.refresh_from_db()
+        self.assertEqual((jan.date, jan.recurring_id), (feb.date, None))
+
+        results = self.client.post(reverse('sync-batch'), {'operations': [
+            {'op': 'update', 'id': mar.pk, 'data': {'date': '2024-04-01'}},
+        ]}, content_type='application/json').json()['results']
+        self.assertEqual(results[0]['status'], 'updated')
+        self.assertIsNone(Expense.objects.get(pk=mar.pk).recurring_id)
+
+        # Edits that keep the date keep the link.
+        self.client.post(reverse('edit-expense', args=[apr.pk]), {**data, 'date': apr.date, 'amount': '900'})
+        self.assertIsNotNone(Expense.objects.get(pk=apr.pk).recurring_id)
+
+        staff = User.objects.create_user('staff', password='pw', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        change = reverse('admin:app_expense_change', args=[feb.pk])
+        shard = f'?_changelist_filters=shard%3D{sharding.for_user(self.user)}'
+        response = self.client.post(change + shard, {
+            **data, 'user': self.user.pk, 'date': '2024-04-01', 'description': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(Expense.objects.get(pk=feb.pk).recurring_id)
+        self.assertEqual(Expense.objects.filter(date=date(2024, 4, 1)).count(), 3)
+
+
+class JobQueueTests(AppTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, JOB_RETRY_DELAY=0))
+
+        self.user = User.objects.create_user('alice', password='pw')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+
+    def test_export_runs_in_background_and_offers_download(self):
+        Expense.objects.create(user=self.user, title='Lunch', amount=12, date=date(2024, 5, 1))
+        Expense.objects.create(user=self.user, title='Old', amount=3, date=date(2023, 5, 1))
+
+        response = self.client.post(reverse('start-export'), {'start': '2024-01-01', 'end': '2024-12-31'})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job-detail', args=[job.pk]))
+        self.assertEqual(job.status, Job.QUEUED)
+
+        claimed = jobs.claim('test')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(jobs.claim('other'))
+        jobs.run(claimed)
+
+        state = self.client.get(reverse('job-status', args=[job.pk])).json()
+        self.assertEqual(state['status'], Job.SUCCEEDED)
+        self.assertEqual(state['result'], {'rows': 1})
+
+        download = self.client.get(state['download_url'])
+        content = b''.join(download.streaming_content).decode()
+        self.assertIn('Lunch', content)
+        self.assertNotIn('Old', content)
+
+        other = User.objects.create_user('bob', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(state['download_url']).status_code, 404)
+
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        calls = []
+
+        def flaky(job):
+            calls.append(job.attempts)
+            raise RuntimeError("boom")
+
+        self.enterContext(mock.patch.dict(jobs.HANDLERS, {'flaky': flaky}))
+        job = jobs.enqueue(self.user, 'flaky')
+
+        with self.assertLogs('app.jobs', 'ERROR'):
+            while (claimed := jobs.claim('test')) is not None:
+                jobs.run(claimed)
+
+        job.refresh_from_db()
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('RuntimeError: boom', job.error)
+
+    def test_jobs_of_dead_workers_are_retried_until_their_last_attempt(self):
+        stale = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1)
+        retried = jobs.enqueue(self.user, 'rebuild_summaries')
+        exhausted = jobs.enqueue(self.user, 'rebuild_summaries')
+        Job.objects.filter(pk=retried.pk).update(status=Job.RUNNING, locked_by='dead', locked_at=stale, attempts=1)
+        Job.objects.filter(pk=exhausted.pk).update(status=Job.RUNNING, locked_by='dead', locked_at=stale, attempts=3)
+
+        claimed = jobs.claim('test')
+        self.assertEqual((claimed.pk, claimed.attempts), (retried.pk, 2))
+        self.assertIsNone(jobs.claim('test'))
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.locked_by), (Job.FAILED, ''))
+
+    def test_a_reclaimed_job_keeps_the_outcome_of_its_new_run(self):
+        job = jobs.enqueue(self.user, 'rebuild_summaries')
+        first = jobs.claim('slow')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1))
+        second = jobs.claim('fast')
+
+        with self.assertLogs('app.jobs', 'WARNING'):
+            jobs.run(first)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.RUNNING, 'fast', 2))
+
+        jobs.run(second)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.SUCCEEDED, ''))
+
+    def test_worker_crashes_fail_the_command_in_either_mode(self):
+        # Threads stand in for the process pool, whose children could not
+        # see the test database.
+        self.enterContext(mock.patch.object(jobs, 'work', side_effect=RuntimeError("boom")))
+        self.enterContext(mock.patch.object(run_jobs, 'ProcessPoolExecutor', ThreadPoolExecutor))
+        self.enterContext(mock.patch.object(run_jobs, 'connections'))
+        for mode in [[], ['--processes']]:
+            with self.subTest(mode=mode), self.assertRaisesMessage(RuntimeError, "boom"):
+                call_command('run_jobs', '--once', *mode, stdout=io.StringIO())
+
+
+class ImportTests(AppTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+
+    def run_import(self, content):
+        self.client.post(reverse('import-expenses'), {'file': io.BytesIO(content)})
+        job = jobs.run(jobs.claim('test'))
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        return job.result
+
+    def test_rows_are_validated_and_imported_once(self):
+        statement = (
+            "\ufeffTitle,Type,Category,Amount,Date,Description\n"
+            "Lunch,,food,12.50,2024-01-05,\n"
+            "Coffee,expense,,3,2024-01-05,\n"
+            "Coffee,expense,,3,2024-01-05,\n"
+            "Salary,Income,General,900,2024-01-31,January\n"
+            "Broken,expense,,lots,2024-01-06,\n"
+            "Trip,expense,Travel,40,2024-01-07,\n"
+        ).encode()
+
+        result = self.run_import(statement)
+        self.assertEqual((result['created'], result['duplicates'], result['invalid']), (4, 0, 2))
+        self.assertTrue(result['errors'][0].startswith('Line 6: amount:'))
+        self.assertEqual(result['errors'][1], "Line 7: Unknown category 'Travel'.")
+        self.assertEqual(Expense.objects.get(title='Lunch').category, self.food)
+        # Identical rows within a statement are kept: two coffees on one day.
+        self.assertEqual(Expense.objects.filter(title='Coffee').count(), 2)
+
+        totals = {(s.category_id, s.type): (s.total, s.count) for s in MonthlySummary.objects.filter(user=self.user)}
+        self.assertEqual(totals, {
+            (self.food.pk, 'expense'): (Decimal('12.50'), 1),
+            (None, 'expense'): (6, 2),
+            (None, 'income'): (900, 1),
+        })
+
+        result = self.run_import(statement)
+        self.assertEqual((result['created'], result['duplicates'], result['invalid']), (0, 4, 2))
+        self.assertEqual(Expense.objects.count(), 4)
+        self.assertEqual(MonthlySummary.objects.get(category=None, type='expense').count, 2)
+
+    def test_unreadable_files_are_reported_as_errors(self):
+        result = self.run_import("Title,Amount,Date\nCafé,3,2024-01-05\n".encode('latin-1'))
+        self.assertEqual(result['created'], 0)
+        self.assertIn('not UTF-8', result['errors'][0])
+
+        long_field = 'x' * 200_000
+        result = self.run_import(f"Title,Amount,Date\nTea,2,2024-01-05\n{long_field},3,2024-01-06\n".encode())
+        self.assertEqual((result['created'], result['invalid']), (1, 1))
+        self.assertIn('Line 3: Malformed CSV', result['errors'][0])
+
+
+class ExportTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+        for title, kind, category, amount, day, description in [
+            ('Lunch', 'expense', self.food, '12.50', date(2024, 3, 5), 'With "Bob", downtown'),
+            ('Salary', 'income', None, '900.00', date(2024, 3, 1), ''),
+            ('Groceries', 'expense', self.food, '40.00', date(2023, 12, 30), ''),
+        ]:
+            Expense(user=self.user, title=title, type=kind, category=category, amount=amount, date=day,
+                    description=description).save()
+        ArchivedExpense(id=1000, user=self.user, title='Old rent', type='expense', amount='500.00',
+                        date=date(2020, 6, 1)).save()
+        Expense(user=User.objects.create_user('bob', password='pw'), title='Taxi', amount=9,
+                date=date(2024, 3, 2), type='expense').save()
+
+    def export(self, **filters):
+        response = self.client.get(reverse('export-expenses'), filters)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_streams_every_row_newest_first(self):
+        self.assertEqual(self.export(), [
+            ['Title', 'Type', 'Category', 'Amount', 'Date', 'Description'],
+            ['Lunch', 'expense', 'Food', '12.50', '2024-03-05', 'With "Bob", downtown'],
+            ['Salary', 'income', 'General', '900.00', '2024-03-01', ''],
+            ['Groceries', 'expense', 'Food', '40.00', '2023-12-30', ''],
+            ['Old rent', 'expense', 'General', '500.00', '2020-06-01', ''],
+        ])
+
+    def test_filters_by_date_type_and_category(self):
+        def titles(**filters):
+            return [row[0] for row in self.export(**filters)[1:]]
+
+        self.assertEqual(titles(start='2024-01-01'), ['Lunch', 'Salary'])
+        self.assertEqual(titles(end='2023-12-31'), ['Groceries', 'Old rent'])
+        self.assertEqual(titles(start='2023-12-30', end='2024-03-01'), ['Salary', 'Groceries'])
+        self.assertEqual(titles(type='income'), ['Salary'])
+        self.assertEqual(titles(category=self.food.pk), ['Lunch', 'Groceries'])
+        self.assertEqual(titles(category=self.food.pk, start='2024-01-01'), ['Lunch'])
+
+    def test_invalid_filters_are_rejected(self):
+        for filters in [
+            {'start': '2024-03-01', 'end': '2024-01-01'},
+            {'start': 'yesterday'},
+            {'type': 'refund'},
+            {'category': 999},
+        ]:
+            with self.subTest(filters=filters):
+                self.assertEqual(self.client.get(reverse('export-expenses'), filters).status_code, 400)
+
+
+class AdminDashboardTests(AppTestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(self.staff)
+        self.food = Category.objects.create(name='Food')
+        self.users = {}
+        for name, amounts in [('alice', [30, 20]), ('bob', [90]), ('carol', [5, 5, 5])]:
+            self.users[name] = user = User.objects.create_user(name, password='pw')
+            for day, amount in enumerate(amounts, start=1):
+                Expense(user=user, title=f'{name} {day}', amount=amount, date=date(2024, 2, day),
+                        category=self.food, type='expense').save()
+            Expense(user=user, title=f'{name} pay', amount=1000, date=date(2024, 1, 31), type='income').save()
+
+    def test_leaderboard_and_totals_cover_every_user(self):
+        response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['username'], row['total'], row['transactions']) for row in response.context['leaderboard']],
+            [('bob', 90, 1), ('alice', 50, 2), ('carol', 15, 3)],
+        )
+        self.assertEqual(response.context['total_spent'], 155)
+        self.assertEqual(response.context['total_transactions'], 9)
+        self.assertEqual(response.context['total_users'], 4)
+        first = next(iter(response.context['page_obj']))
+        self.assertEqual((first.date, first.category), (date(2024, 2, 3), self.food))
+
+    def test_filters_narrow_every_figure(self):
+        response = self.client.get(reverse('admin-dashboard'), {'user': 'alice'})
+        self.assertEqual([row['username'] for row in response.context['leaderboard']], ['alice'])
+        self.assertEqual(response.context['total_transactions'], 3)
+
+        response = self.client.get(reverse('admin-dashboard'), {'start': '2024-02-02', 'end': '2024-02-02'})
+        self.assertEqual(response.context['total_spent'], 25)
+        self.assertEqual(
+            sorted(expense.title for expense in response.context['page_obj']), ['alice 2', 'carol 2'],
+        )
+
+        response = self.client.get(reverse('admin-dashboard'), {'user': 'nobody'})
+        self.assertEqual((response.context['total_spent'], list(response.context['page_obj'])), (0, []))
+
+    def test_invalid_filters_are_reported(self):
+        response = self.client.get(reverse('admin-dashboard'), {'start': '2024-03-01', 'end': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'The start date must be before the end date.', status_code=400)
+        self.assertNotIn('leaderboard', response.context)
+
+        response = self.client.get(reverse('admin-dashboard'), {'start': 'soon'})
+        self.assertContains(response, 'Enter a valid date.', status_code=400)
+
+    def test_query_count_does_not_grow_with_the_data(self):
+        # The session, its user, the users shown and the user count, then
+        # per shard the totals, the leaderboard and the page.
+        expected = 4 + 3 * len(sharding.aliases())
+        self.client.get(reverse('admin-dashboard'))
+        with self.assertNumQueriesEverywhere(expected):
+            self.client.get(reverse('admin-dashboard'))
+
+        for i in range(30):
+            user = User.objects.create_user(f'user{i}', password='pw')
+            Expense(user=user, title='Lunch', amount=i + 1, date=date(2024, 3, 1), type='expense').save()
+        with self.assertNumQueriesEverywhere(expected):
+            response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(len(response.context['leaderboard']), 10)
+        self.assertEqual(len(response.context['page_obj']), 25)
+
+
+class SyncApiTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('sync-changes'), params).json()
+
+    def batch(self, operations):
+        return self.client.post(
+            reverse('sync-batch'), {'operations': operations}, content_type='application/json',
+        ).json()['results']
+
+    def expense(self, title, amount='10.00', day='2024-03-01'):
+        return {'title': title, 'amount': amount, 'date': day,
+                'category': self.food.pk, 'type': 'expense'}
+
+    def test_anonymous_calls_get_a_json_401(self):
+        self.client.logout()
+        for response in [
+            self.client.get(reverse('sync-changes')),
+            self.client.post(reverse('sync-batch'), {'operations': []}, content_type='application/json'),
+        ]:
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json(), {'error': "Authentication required."})
+
+    def test_batch_writes_and_delta_sync(self):
+        kept = Expense.objects.create(user=self.user, title='Kept', amount=1, date=date(2024, 1, 1), category=self.food)
+        gone = Expense.objects.create(user=self.user, title='Gone', amount=2, date=date(2024, 1, 2), category=self.food)
+        summaries.rebuild(self.user)
+
+        first = self.sync(limit=1)
+        self.assertEqual([row['title'] for row in first['changes']], ['Kept'])
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['cursor'])
+        self.assertEqual([row['title'] for row in second['changes']], ['Gone'])
+        self.assertFalse(second['has_more'])
+
+        with self.assertNumQueriesEverywhere(20):
+            results = self.batch([
+                {'op': 'create', 'client_id': 'a', 'data': self.expense('Lunch')},
+                {'op': 'create', 'client_id': 'b', 'data': self.expense('Dinner', day='2024-03-02')},
+                {'op': 'create', 'client_id': 'c', 'data': {'title': 'No amount'}},
+                {'op': 'update', 'id': kept.pk, 'data': {'amount': '5.00'}},
+                {'op': 'delete', 'id': gone.pk},
+                {'op': 'delete', 'id': 999999},
+            ])
+
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['created', 'created', 'error', 'updated', 'deleted', 'error'],
+        )
+        self.assertIn('amount', results[2]['errors'])
+        self.assertEqual(results[0]['client_id'], 'a')
+        self.assertTrue(Expense.objects.filter(pk=results[0]['id'], title='Lunch').exists())
+
+        delta = self.sync(second['cursor'])
+        self.assertEqual(
+            sorted(row['title'] for row in delta['changes']), ['Dinner', 'Kept', 'Lunch'],
+        )
+        self.assertEqual(delta['deleted'], [gone.pk])
+        self.assertEqual(self.sync(delta['cursor'])['changes'], [])
+
+        totals = {(s.year, s.month): (s.total, s.count) for s in MonthlySummary.objects.filter(user=self.user)}
+        self.assertEqual(totals, {(2024, 1): (5, 1), (2024, 3): (20, 2)})
+
+    def test_deletes_through_the_app_leave_tombstones(self):
+        expense = Expense.objects.create(user=self.user, title='Taxi', amount=7, date=date(2024, 2, 1), category=self.food)
+        summaries.rebuild(self.user)
+        cursor = self.sync()['cursor']
+
+        self.client.post(reverse('delete-expense', args=[expense.pk]))
+
+        delta = self.sync(cursor)
+        self.assertEqual(delta['deleted'], [expense.pk])
+        self.assertEqual(delta['changes'], [])
+
+    def test_rejects_malformed_requests(self):
+        response = self.client.post(reverse('sync-batch'), 'nope', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('sync-changes'), {'cursor': '!!'}).status_code, 400)
+
+
+class BatchEntryTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+
+    def test_fifty_rows_are_saved_in_one_request(self):
+        rows = 50
+        data = {
+            'form-TOTAL_FORMS': rows + 2,
+            'form-INITIAL_FORMS': 0,
+            'form-MIN_NUM_FORMS': 1,
+            'form-MAX_NUM_FORMS': 100,
+        }
+        for i in range(rows):
+            data.update({
+                f'form-{i}-title': f'Item {i}',
+                f'form-{i}-amount': '2.00',
+                f'form-{i}-date': f'2024-0{1 + i % 2}-10',
+                f'form-{i}-category': self.food.pk,
+                f'form-{i}-type': 'expense',
+            })
+        for i in range(rows, rows + 2):
+            data[f'form-{i}-type'] = 'expense'
+
+        # The GET warms the category cache; the POST then resolves every
+        # row's category without a query and inserts them in one statement.
+        self.client.get(reverse('add-expenses'))
+        with self.assertNumQueriesEverywhere(16):
+            response = self.client.post(reverse('add-expenses'), data)
+
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), rows)
+        totals = {(s.year, s.month): (s.total, s.count) for s in MonthlySummary.objects.filter(user=self.user)}
+        self.assertEqual(totals, {(2024, 1): (50, 25), (2024, 2): (50, 25)})
+
+    def test_one_invalid_row_rejects_the_batch(self):
+        data = {
+            'form-TOTAL_FORMS': 2, 'form-INITIAL_FORMS': 0,
+            'form-0-title': 'Lunch', 'form-0-amount': '5', 'form-0-date': '2024-01-01',
+            'form-0-category': self.food.pk, 'form-0-type': 'expense',
+            'form-1-title': 'Dinner', 'form-1-type': 'expense',
+        }
+        response = self.client.post(reverse('add-expenses'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Expense.objects.exists())
+
+    def post_row(self, category_id):
+        return self.client.post(reverse('add-expenses'), {
+            'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+            'form-0-title': 'Lunch', 'form-0-amount': '5', 'form-0-date': '2024-01-01',
+            'form-0-category': category_id, 'form-0-type': 'expense',
+        })
+
+    def test_rows_resolve_categories_without_querying_them(self):
+        self.client.get(reverse('add-expenses'))
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            response = self.post_row(self.food.pk)
+
+        self.assertEqual(response.status_code, 302)
+        executed = [query['sql'] for context in captured for query in context.captured_queries]
+        self.assertFalse([sql for sql in executed if 'app_category' in sql])
+
+    def test_categories_changed_by_another_process_are_validated(self):
+        self.client.get(reverse('add-expenses'))
+        # Another worker deletes Food; this one still holds its old copy.
+        stale, food_id = categories.catalogue(), self.food.pk
+        self.food.delete()
+        categories._catalogue = stale
+
+        response = self.post_row(food_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('category', response.context['formset'][0].errors)
+        self.assertFalse(Expense.objects.exists())
+
+        # ...and adds Rent without this worker seeing the version change.
+        [rent] = Category.objects.bulk_create([Category(name='Rent')])
+        categories._catalogue.loaded_at -= categories.MISS_RELOAD_INTERVAL
+        response = self.post_row(rent.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Expense.objects.get(user=self.user).category, rent)
+
+
+@skipUnless(connection.vendor == 'sqlite', "The FTS5 index is SQLite only.")
+class SearchTests(AppTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.use_shard_of(self.alice)
+
+    def add(self, title, user=None, **fields):
+        fields = {'amount': 5, 'date': date(2024, 1, 1), 'type': 'expense', **fields}
+        expense = Expense(user=user or self.alice, title=title, **fields)
+        expense.save()
+        return expense
+
+    def titles(self, query, **filters):
+        return sorted(expense.title for expense in search.search(self.alice, query, filters))
+
+    def test_triggers_survive_all_migrations(self):
+        for alias in sharding.aliases():
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'app_expense'")
+                self.assertEqual(
+                    sorted(name for name, in cursor.fetchall()),
+                    ['app_expense_fts_delete', 'app_expense_fts_insert', 'app_expense_fts_update'],
+                )
+
+    def test_index_follows_every_kind_of_write(self):
+        coffee = self.add('Coffee beans')
+        self.assertEqual(self.titles('coff'), ['Coffee beans'])
+
+        coffee.title = 'Green tea'
+        coffee.save()
+        self.assertEqual(self.titles('coffee'), [])
+        self.assertEqual(self.titles('tea'), ['Green tea'])
+
+        Expense.objects.bulk_create([
+            Expense(user=self.alice, title=title, amount=2, date=date(2024, 1, 2), type='expense')
+            for title in ['Bus ticket', 'Train ticket']
+        ])
+        self.assertEqual(self.titles('ticket'), ['Bus ticket', 'Train ticket'])
+
+        Expense.objects.filter(title__endswith='ticket').update(description='Daily commute')
+        self.assertEqual(self.titles('commute'), ['Bus ticket', 'Train ticket'])
+
+        coffee.delete()
+        self.assertEqual(self.titles('tea'), [])
+        Expense.objects.filter(title='Bus ticket').delete()
+        self.assertEqual(self.titles('ticket'), ['Train ticket'])
+
+        with connections[sharding.for_user(self.alice)].cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {search.FTS_TABLE}")
+            self.assertEqual(sorted(pk for pk, in cursor.fetchall()), sorted(Expense.objects.values_list('pk', flat=True)))
+
+    def test_results_are_per_user_and_filtered(self):
+        self.add('Coffee', category=self.food, date=date(2024, 1, 5))
+        self.add('Coffee refund', type='income', date=date(2024, 2, 5))
+        self.add('Coffee', user=self.bob)
+
+        self.assertEqual(self.titles('coffee'), ['Coffee', 'Coffee refund'])
+        self.assertEqual(self.titles('coffee', category=self.food), ['Coffee'])
+        self.assertEqual(self.titles('coffee', type='income'), ['Coffee refund'])
+        self.assertEqual(self.titles('coffee', start=date(2024, 2, 1)), ['Coffee refund'])
+        self.assertEqual(self.titles('coffee', end=date(2024, 1, 31)), ['Coffee'])
+
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('search'), {'q': 'coffee'})
+        self.assertEqual([expense.user_id for expense in response.context['page_obj']], [self.bob.pk])
+
+    def test_cursors_page_through_tied_ranks(self):
+        added = [self.add('Lunch').pk for _ in range(5)]
+
+        pages, cursor = [], None
+        while True:
+            page = search.search(self.alice, 'lunch', {}, per_page=2, after=cursor)
+            pages.append([expense.pk for expense in page])
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(pages, [added[0:2], added[2:4], added[4:]])
+
+        back = search.search(self.alice, 'lunch', {}, per_page=2, before=page.previous_cursor)
+        self.assertEqual([expense.pk for expense in back], added[2:4])
+        self.assertTrue(back.has_previous())
+
+        tampered = search.search(self.alice, 'lunch', {}, per_page=2, after='not a cursor')
+        self.assertEqual([expense.pk for expense in tampered], added[0:2])
+
+
+class AnomalyTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+        self.day = date.today().replace(day=1)
+        for month, amount in enumerate([10, 12, 11, 9, 13, 10, 11], start=1):
+            self.client.post(reverse('add-expense'), {
+                'title': 'Lunch', 'amount': amount, 'date': date(self.day.year - 1, month, 5),
+                'category': self.food.pk, 'type': 'expense',
+            })
+
+    def stats(self):
+        stats = SpendingStats.objects.get(user=self.user, category=self.food)
+        return stats.count, stats.mean, stats.m2
+
+    def test_running_stats_follow_writes_and_flag_outliers(self):
+        self.client.post(reverse('add-expense'), {
+            'title': 'Banquet', 'amount': 250, 'date': self.day,
+            'category': self.food.pk, 'type': 'expense',
+        })
+        banquet = Expense.objects.get(title='Banquet')
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['unusual_expenses'], {banquet.pk})
+        self.assertEqual([item['category'] for item in response.context['unusual_months']], ['Food'])
+        self.assertContains(response, 'Unusual Spending')
+
+        self.client.post(reverse('edit-expense', args=[banquet.pk]), {
+            'title': 'Banquet', 'amount': 14, 'date': self.day,
+            'category': self.food.pk, 'type': 'expense',
+        })
+        self.client.post(reverse('delete-expense', args=[Expense.objects.filter(title='Lunch').first().pk]))
+        online = self.stats()
+        anomalies.rebuild(self.user)
+        for value, expected in zip(online, self.stats()):
+            self.assertAlmostEqual(value, expected)
+        self.assertEqual(online[0], 7)
+
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.context['unusual_expenses'])
+        self.assertFalse(response.context['unusual_months'])
+
+    def test_deleted_category_folds_into_uncategorized(self):
+        Expense.objects.create(user=self.user, title='Snack', amount=3, date=self.day)
+        summaries.rebuild(self.user)
+        before = Expense.objects.filter(user=self.user).count()
+
+        self.food.delete()
+        stats = SpendingStats.objects.get(user=self.user)
+        self.assertIsNone(stats.category_id)
+        self.assertEqual(stats.count, before)
+
+    def test_edits_that_keep_the_rollup_still_update_stats(self):
+        Expense.objects.filter(user=self.user).delete()
+        SpendingStats.objects.all().delete()
+        rows = [
+            Expense.objects.create(user=self.user, title='Lunch', amount=amount, date=date(2024, 1, day), category=self.food)
+            for day, amount in [(1, 10), (2, 30), (3, 5), (4, 7)]
+        ]
+        summaries.rebuild(self.user)
+
+        # Same month, category and total: the rollup delta is zero.
+        deltas = summaries.collect(rows[:2], -1)
+        rows[0].amount = rows[1].amount = 20
+        summaries.collect(rows[:2], 1, deltas)
+        for row in rows[:2]:
+            row.save()
+        summaries.apply(deltas)
+
+        online = self.stats()
+        anomalies.rebuild(self.user)
+        for value, expected in zip(online, self.stats()):
+            self.assertAlmostEqual(value, expected)
+        self.assertAlmostEqual(online[2], 198)
+
+    def test_first_write_retries_after_a_concurrent_insert(self):
+        snack = Expense.objects.create(user=self.user, title='Snack', amount=3, date=self.day)
+        create = SpendingStats.objects.bulk_create
+        calls = []
+
+        def racing(objs, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                # Another request inserted the row after we looked for it.
+                SpendingStats.objects.create(user=self.user, category=None, count=1, mean=3)
+            return create(objs, **kwargs)
+
+        with mock.patch.object(SpendingStats.objects, 'bulk_create', side_effect=racing):
+            summaries.record(snack)
+        self.assertEqual(len(calls), 2)
+        stats = SpendingStats.objects.get(user=self.user, category=None)
+        self.assertEqual((stats.count, stats.mean), (1, 3))
+
+
+class ArchiveTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.food = Category.objects.create(name='Food')
+        self.client.force_login(self.user)
+        self.use_shard_of(self.user)
+        for day, amount in [(date(2020, 3, 1), 10), (date(2020, 4, 1), 20), (date(2021, 5, 1), 5), (date(2024, 1, 1), 7)]:
+            Expense.objects.create(user=self.user, title=f'On {day}', amount=amount, date=day, category=self.food)
+        summaries.rebuild(self.user)
+        self.ids = set(Expense.objects.values_list('pk', flat=True))
+
+    def totals(self):
+        return {(s.year, s.month): s.total for s in MonthlySummary.objects.filter(user=self.user)}
+
+    def test_archived_years_stay_readable_and_can_be_restored(self):
+        before = self.totals()
+        result = archive.archive(2022, batch_size=2)
+
+        self.assertEqual(result.rows, 3)
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(
+            {(y.year, y.transactions, y.expense_total) for y in ArchivedYear.objects.filter(user=self.user)},
+            {(2020, 2, 30), (2021, 1, 5)},
+        )
+        self.assertEqual(self.totals(), before)
+        summaries.rebuild(self.user)
+        self.assertEqual(self.totals(), before)
+
+        response = self.client.get(reverse('index'), {'year': 2020})
+        self.assertEqual(response.context['years'], [date.today().year, 2024, 2021, 2020])
+        self.assertEqual([e.title for e in response.context['page_obj']], ['On 2020-04-01', 'On 2020-03-01'])
+        self.assertContains(response, 'Archived')
+
+        export = b''.join(self.client.get(reverse('export-expenses')).streaming_content).decode()
+        self.assertEqual(len(export.strip().splitlines()), 5)
+
+        archive.restore(2020)
+        self.assertFalse(ArchivedYear.objects.filter(year=2020).exists())
+        archive.restore()
+        self.assertEqual(set(Expense.objects.values_list('pk', flat=True)), self.ids)
+        self.assertFalse(ArchivedExpense.objects.exists())
+        self.assertEqual(self.totals(), before)
+
+
+class ShardingTests(AppTestCase):
+    @override_settings(SHARDS=['shard0', 'shard1', 'shard2'])
+    def test_router_keeps_each_users_rows_in_one_shard(self):
+        router = sharding.ShardRouter()
+        shards = [sharding.for_user(user_id) for user_id in range(1, 301)]
+        self.assertEqual(set(shards), {'shard0', 'shard1', 'shard2'})
+        self.assertEqual(shards, [sharding.for_user(user_id) for user_id in range(1, 301)])
+
+        expense = Expense(user_id=7)
+        self.assertEqual(router.db_for_write(Expense, instance=expense), sharding.for_user(7))
+        self.assertEqual(router.db_for_read(User, instance=expense), 'default')
+        with sharding.use('shard2'):
+            self.assertEqual(router.db_for_read(MonthlySummary), 'shard2')
+            self.assertEqual(router.db_for_read(Category), 'default')
+
+        self.assertTrue(router.allow_migrate('shard1', 'app', 'expense'))
+        self.assertFalse(router.allow_migrate('default', 'app', 'expense'))
+        self.assertFalse(router.allow_migrate('shard1', 'auth', 'user'))
+        self.assertFalse(router.allow_migrate('shard1', 'app', None))
+
+    def test_deleting_users_and_categories_reaches_their_rows(self):
+        user = User.objects.create_user('alice')
+        food = Category.objects.create(name='Food')
+        self.use_shard_of(user)
+        expense = Expense.objects.create(user=user, title='Lunch', amount=5, date=date(2024, 1, 1), category=food)
+        CategoryBudget.objects.create(user=user, year=2024, month=1, category=food, amount=50)
+        summaries.rebuild(user)
+
+        food.delete()
+        expense.refresh_from_db()
+        self.assertIsNone(expense.category_id)
+        self.assertFalse(CategoryBudget.objects.exists())
+
+        user.delete()
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(MonthlySummary.objects.exists())
+        self.assertFalse(DataVersion.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+@skipUnless(sharding.enabled(), "Runs with ET_SHARDS set; see ShardedSuiteTests.")
+class ShardedFlowTests(AppTestCase):
+    """The app end to end for users whose rows live in different shards."""
+
+    def setUp(self):
+        self.food = Category.objects.create(name='Food')
+        self.users = {}
+        for i in range(50):
+            user = User.objects.create_user(f'user{i}', password='pw')
+            self.users.setdefault(sharding.for_user(user), user)
+            if len(self.users) == 2:
+                break
+        (self.alias_a, self.alice), (self.alias_b, self.bob) = self.users.items()
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True, is_superuser=True)
+        self.day = date.today().replace(day=1)
+
+    def add(self, user, title, amount):
+        self.client.force_login(user)
+        self.client.post(reverse('add-expense'), {
+            'title': title, 'amount': amount, 'date': self.day, 'category': self.food.pk, 'type': 'expense',
+        })
+        return Expense.objects.using(sharding.for_user(user)).get(title=title)
+
+    def summary(self, user):
+        rows = MonthlySummary.objects.using(sharding.for_user(user)).filter(user=user)
+        return {(row.year, row.month, row.category_id): (row.total, row.count) for row in rows}
+
+    def test_admin_activity_pages_through_ids_repeated_across_shards(self):
+        # Each shard numbers its rows, so the same (date, id) is on both.
+        for alias, user in self.users.items():
+            Expense.objects.using(alias).bulk_create([
+                Expense(id=900000 + i, user=user, title=f'{alias} {i}', amount=1, date=self.day, type='expense')
+                for i in range(15)
+            ])
+
+        self.client.force_login(self.staff)
+        first = self.client.get(reverse('admin-dashboard')).context['page_obj']
+        second = self.client.get(reverse('admin-dashboard'), {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual((len(first), len(second)), (25, 5))
+        self.assertFalse(second.has_next())
+        titles = [expense.title for expense in [*first, *second]]
+        self.assertEqual(len(set(titles)), 30)
+
+        back = self.client.get(reverse('admin-dashboard'), {'before': second.previous_cursor}).context['page_obj']
+        self.assertEqual([expense.title for expense in back], titles[:25])
+
+    def test_views_read_and_write_each_users_shard(self):
+        lunch = self.add(self.alice, 'Lunch', 10)
+        taxi = self.add(self.bob, 'Taxi', 30)
+        fuel = self.add(self.bob, 'Fuel', 5)
+        self.assertFalse(Expense.objects.using(self.alias_a).filter(user=self.bob).exists())
+        self.assertFalse(Expense.objects.using(self.alias_b).filter(user=self.alice).exists())
+
+        self.client.post(reverse('edit-expense', args=[taxi.pk]), {
+            'title': 'Taxi', 'amount': 40, 'date': self.day, 'category': self.food.pk, 'type': 'expense',
+        })
+        self.client.post(reverse('delete-expense', args=[fuel.pk]))
+        key = (self.day.year, self.day.month, self.food.pk)
+        self.assertEqual(self.summary(self.bob), {key: (40, 1)})
+        self.assertEqual(self.summary(self.alice), {key: (10, 1)})
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual([e.title for e in response.context['page_obj']], ['Taxi'])
+        self.assertEqual(response.context['expense_total'], 40)
+        export = b''.join(self.client.get(reverse('export-expenses')).streaming_content).decode()
+        self.assertIn('Taxi', export)
+        self.assertNotIn('Lunch', export)
+
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('index'))
+        self.assertEqual([e.pk for e in response.context['page_obj']], [lunch.pk])
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin-dashboard'))
+        self.assertEqual(response.context['total_spent'], 50)
+        self.assertEqual(
+            [(row['username'], row['total']) for row in response.context['leaderboard']],
+            [(self.bob.username, 40), (self.alice.username, 10)],
+        )
+        self.assertEqual({e.title for e in response.context['page_obj']}, {'Taxi', 'Lunch'})
+
+    def test_admin_lists_and_edits_any_shard(self):
+        self.add(self.alice, 'Lunch', 10)
+        taxi = self.add(self.bob, 'Taxi', 30)
+        self.client.force_login(self.staff)
+
+        changelist = reverse('admin:app_expense_changelist')
+        response = self.client.get(changelist, {'shard': self.alias_b})
+        self.assertEqual([e.title for e in response.context['cl'].result_list], ['Taxi'])
+
+        change = reverse('admin:app_expense_change', args=[taxi.pk])
+        filters = {'_changelist_filters': f'shard={self.alias_b}'}
+        response = self.client.get(change, filters)
+        self.assertEqual(response.context['original'], taxi)
+
+        response = self.client.post(f"{change}?_changelist_filters=shard%3D{self.alias_b}", {
+            'title': 'Taxi', 'amount': '45.00', 'date': self.day, 'category': self.food.pk,
+            'description': '', 'type': 'expense',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.summary(self.bob), {(self.day.year, self.day.month, self.food.pk): (45, 1)})
+
+
+class ShardedSuiteTests(SimpleTestCase):
+    @skipIf(sharding.enabled(), "Already sharded.")
+    def test_sharded_flows_pass(self):
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'test', 'app.tests.ShardedFlowTests', '-v', '1'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'ET_SHARDS': '2'},
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn('skipped', result.stderr)
+
+
+class BenchmarkCommandTests(AppTestCase):
+    def counts(self):
+        return [
+            model.objects.using(alias).count()
+            for model in (Expense, MonthlySummary, DataVersion) for alias in sharding.aliases()
+        ] + [User.objects.count()]
+
+    def test_generated_data_can_be_benchmarked_without_changing_it(self):
+        call_command('generate_data', users=1, expenses=5, stdout=io.StringIO())
+        before = self.counts()
+        self.assertEqual(sum(before[:len(sharding.aliases())]), 5)
+
+        out = io.StringIO()
+        # DEBUG is off under test, so only the test host is allowed.
+        call_command('benchmark', iterations=1, host='testserver', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['transactions'], 5)
+        self.assertEqual(
+            sorted(report['views']), ['add_expense', 'admin_dashboard', 'dashboard', 'export_expenses'],
+        )
+        for name, view in report['views'].items():
+            self.assertIn(view['status'], (200, 302), name)
+        self.assertEqual(self.counts(), before)
+
+    def test_shard_benchmark_runs_its_writers(self):
+        out = io.StringIO()
+        call_command('benchmark_shards', shards=[1], writers=1, seconds=0.1, stdout=out, stderr=io.StringIO())
+        [run] = json.loads(out.getvalue())['runs']
+        self.assertEqual(run['shards'], 1)
+        self.assertGreater(run['writes'], 0)
+
+
+class StatementTests(AppTestCase):
+    def setUp(self):
+        self.output = self.enterContext(tempfile.TemporaryDirectory())
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        food = Category.objects.create(name='Food')
+        for user, title, amount, day, kind in [
+            (self.alice, 'Salary', 1000, date(2024, 3, 1), 'income'),
+            (self.alice, 'Lunch', 30, date(2024, 3, 5), 'expense'),
+            (self.alice, 'Dinner', 90, date(2024, 2, 5), 'expense'),
+            (self.bob, 'Groceries', 60, date(2024, 3, 9), 'expense'),
+        ]:
+            # Instances are routed to their user's shard by the router.
+            Expense(user=user, title=title, amount=amount, date=day, type=kind, category=food).save()
+        summaries.rebuild()
+        MonthlyBudget(user=self.alice, year=2024, month=3, amount=100).save()
+        CategoryBudget(user=self.bob, year=2024, month=3, category=food, amount=50).save()
+
+    def test_statements_are_built_per_chunk_and_skipped_once_written(self):
+        categories.ordered()
+        built = {}
+        for alias, users in statements.chunks(2024, 3, self.output):
+            # One query per table, however many users the chunk holds.
+            with sharding.use(alias), self.assertNumQueries(3, using=alias):
+                built.update((statement.user_id, statement) for statement in statements.build(users, 2024, 3))
+        alice, bob = built[self.alice.pk], built[self.bob.pk]
+        self.assertEqual((alice.income_total, alice.expense_total, alice.year_expense_total), (1000, 30, 120))
+        self.assertEqual((alice.budget.variance, alice.budget.status), (70, 'ok'))
+        self.assertEqual(bob.categories, [('Food', 60)])
+        self.assertEqual([(line.category.name, line.status) for line in bob.category_budgets], [('Food', 'over')])
+
+        out = io.StringIO()
+        call_command('generate_statements', month='2024-03', output_dir=self.output, processes=0, chunk_size=1, stdout=out)
+        self.assertIn('Wrote 2 statements', out.getvalue())
+        files = statements.paths(self.output, 2024, 3, self.alice.pk)
+        self.assertIn('Budget,Overall,100.00,30.00,70.00,30.00,ok', files['csv'].read_text())
+        self.assertIn('Statement for March 2024', files['html'].read_text())
+
+        files['csv'].unlink()
+        call_command('generate_statements', month='2024-03', output_dir=self.output, processes=0, stdout=out)
+        self.assertIn('Wrote 1 statements', out.getvalue())
+        self.assertEqual(sorted(os.listdir(statements.directory(self.output, 2024, 3))),
+                         sorted(f'{pk}.{fmt}' for pk in (self.alice.pk, self.bob.pk) for fmt in ('csv', 'html')))
+
+
+@override_settings(AUTH_USER_CACHE_TIMEOUT=60)
+class SessionAuthQueryTests(AppTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pw')
+        self.client.login(username='alice', password='pw')
+
+    def queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('recurring-transactions'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in captured]
+
+    def auth_queries(self):
+        return [sql for sql in self.queries() if 'django_session' in sql or 'auth_user' in sql]
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=0)
+    def test_database_sessions_query_session_and_user(self):
+        self.assertEqual(len(self.auth_queries()), 2)
+
+    def test_cached_user_skips_the_user_query(self):
+        self.queries()
+        self.assertEqual(len(self.auth_queries()), 1)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cache_sessions_need_no_auth_queries(self):
+        self.client.login(username='alice', password='pw')
+        self.queries()
+        self.assertEqual(self.auth_queries(), [])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_password_change_and_logout_end_signed_cookie_sessions(self):
+        self.client.login(username='alice', password='pw')
+        self.queries()
+        self.assertEqual(self.auth_queries(), [])
+
+        self.user.set_password('new-password')
+        self.user.save()
+        response = self.client.get(reverse('recurring-transactions'))
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username='alice', password='new-password')
+        self.queries()
+        self.client.post(reverse('logout'))
+        self.assertIsNone(cache.get(f'app:user:{self.user.pk}'))
+        self.assertEqual(self.client.get(reverse('recurring-transactions')).status_code, 302)
+
+    def test_user_cache_needs_a_shared_cache(self):
+        self.assertEqual([error.id for error in checks.check_user_cache(None)], ['app.E001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_user_cache(None), [])
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=0):
+            self.assertEqual(checks.check_user_cache(None), [])
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, SLOW_REQUEST_THRESHOLD_MS=0, DEBUG=False)
+class RequestTimingTests(AppTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+
+    def test_only_staff_get_the_server_timing_header(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('app.performance', 'WARNING'):
+            response = self.client.get(reverse('admin-dashboard'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", view;dur=[\d.]+, template;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+        self.client.force_login(self.user)
+        with self.assertLogs('app.performance', 'WARNING'):
+            response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        with override_settings(DEBUG=True), self.assertLogs('app.performance', 'WARNING'):
+            self.assertTrue(self.client.get(reverse('index')).has_header('Server-Timing'))
+
+    def test_slow_requests_are_logged(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('app.performance', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        [record] = [json.loads(message.split(':', 2)[2]) for message in logs.output]
+        self.assertEqual(
+            {key: record[key] for key in ('event', 'method', 'path', 'status', 'user_id')},
+            {'event': 'slow_request', 'method': 'GET', 'path': reverse('index'), 'status': 200, 'user_id': self.user.pk},
+        )
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=60_000), self.assertNoLogs('app.performance'):
+            self.client.get(reverse('index'))
+
+    @override_settings(REQUEST_TIMING_ENABLED=False, DEBUG=True)
+    def test_off_by_default(self):
+        self.assertFalse(import_module(os.environ['DJANGO_SETTINGS_MODULE']).REQUEST_TIMING_ENABLED)
+        self.client.force_login(self.staff)
+        self.assertFalse(self.client.get(reverse('admin-dashboard')).has_header('Server-Timing'))
+
+
+@override_settings(RATE_LIMITS={
+    'default': {'rate': 1, 'burst': 3},
+    'expensive': {'rate': 0.1, 'burst': 1},
+})
+class RateLimitTests(AppTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def test_expensive_views_get_their_own_smaller_budget(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('index')).status_code, 200)
+
+        # Only the session and user are read before the request is turned away.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        self.assertEqual(self.client.get(reverse('add-expense')).status_code, 200)
+
+    def test_anonymous_clients_are_limited_per_ip(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('login')).status_code, 429)
+        self.assertEqual(self.client.get(reverse('login'), REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_buckets_refill_at_their_rate(self):
+        self.assertEqual(ratelimit.take('expensive', 'ip:x', now=100), 0)
+        self.assertAlmostEqual(ratelimit.take('expensive', 'ip:x', now=104), 6)
+        self.assertEqual(ratelimit.take('expensive', 'ip:x', now=110), 0)
+        self.assertEqual(ratelimit.take('unknown', 'ip:x', now=110), 0)
+
+    @override_settings(RATE_LIMITS={'default': {'rate': 2.5, 'burst': 1}})
+    def test_arrival_time_left_behind_the_clock_is_reset(self):
+        self.assertEqual(ratelimit.take('default', 'ip:z', now=100), 0)
+        # Idle for longer than one interval but within the key's TTL.
+        self.assertEqual(ratelimit.take('default', 'ip:z', now=100.5), 0)
+        self.assertAlmostEqual(ratelimit.take('default', 'ip:z', now=100.5), 0.4)
+
+    @override_settings(RATE_LIMITS={'default': {'rate': 0.01, 'burst': 5}})
+    def test_concurrent_requests_cannot_overspend(self):
+        waits = []
+        barrier = threading.Barrier(20)
+
+        def request():
+            barrier.wait()
+            waits.append(ratelimit.take('default', 'ip:y', now=100))
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(waits.count(0), 5)
+        self.assertEqual(min(wait for wait in waits if wait), 100)
+
+    def test_limits_need_a_shared_cache(self):
+        self.assertEqual([error.id for error in checks.check_rate_limit_cache(None)], ['app.E002'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_rate_limit_cache(None), [])
+
+
+class SQLiteProductionProfileTests(SimpleTestCase):
+    """Parallel writers must queue on the lock instead of failing."""
+
+    alias = 'sqlite_profile_test'
+    writers = 8
+    writes_per_writer = 25
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        profile = dict(settings.DATABASE_PROFILES['sqlite'], NAME=self.path)
+        self.settings_dict = connections.configure_settings(
+            {'default': {}, self.alias: profile}
+        )[self.alias]
+
+        with self.connect() as cursor:
+            cursor.execute("CREATE TABLE ledger (id INTEGER PRIMARY KEY, balance INTEGER)")
+            cursor.execute("INSERT INTO ledger (id, balance) VALUES (1, 0)")
+        self.disconnect()
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def connect(self):
+        # A thread-local connection under an alias that is not in
+        # settings.DATABASES, configured exactly like the 'sqlite' profile.
+        backend = load_backend(self.settings_dict['ENGINE'])
+        connections[self.alias] = backend.DatabaseWrapper(self.settings_dict, self.alias)
+        return connections[self.alias].cursor()
+
+    def disconnect(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+
+    def test_pragmas_are_applied(self):
+        with self.connect() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.disconnect()
+
+    def test_parallel_read_then_write_transactions_succeed(self):
+        errors = []
+
+        def writer():
+            self.connect().close()
+            try:
+                for _ in range(self.writes_per_writer):
+                    # Read then write in one transaction, like edit_expense.
+                    with transaction.atomic(using=self.alias):
+                        with connections[self.alias].cursor() as cursor:
+                            cursor.execute("SELECT balance FROM ledger WHERE id = 1")
+                            balance = cursor.fetchone()[0]
+                            cursor.execute(
+                                "UPDATE ledger SET balance = %s WHERE id = 1",
+                                [balance + 1],
+                            )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                self.disconnect()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with self.connect() as cursor:
+            cursor.execute("SELECT balance FROM ledger WHERE id = 1")
+            self.assertEqual(cursor.fetchone()[0], self.writers * self.writes_per_writer)
+        self.disconnect()
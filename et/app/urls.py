@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
@@ -6,7 +7,13 @@ urlpatterns = [
     # 1. THE DASHBOARDS
     path('', views.home, name='home'),
 
-    path('dashboard/', views.dashboard, name='index'),
+    path(
+        'dashboard/',
+        views.async_dashboard if settings.ASYNC_DASHBOARD else views.dashboard,
+        name='index',
+    ),
+    path('dashboard/chart-data/', views.chart_data, name='chart-data'),
+    path('dashboard/analytics/', views.analytics_data, name='analytics-data'),
     path('admin-dashboard/', views.admin_dashboard, name='admin-dashboard'),
 
     # 2. THE LOGIN SYSTEM
@@ -24,11 +31,29 @@ urlpatterns = [
 
     # 3. EXPENSE ACTIONS
     path('add/', views.add_expense, name='add-expense'),
+    path('add/batch/', views.add_expenses, name='add-expenses'),
     path('edit/<int:pk>/', views.edit_expense, name='edit-expense'),
     path('delete/<int:pk>/', views.delete_expense, name='delete-expense'),
+    path('export/', views.export_expenses, name='export-expenses'),
+    path('export/background/', views.start_export, name='start-export'),
+    path('import/', views.import_expenses, name='import-expenses'),
+    path('search/', views.search_expenses, name='search'),
+    path('budgets/', views.budget_history, name='budget-history'),
+    path('recurring/', views.recurring_transactions, name='recurring-transactions'),
+    path('recurring/<int:pk>/delete/', views.delete_recurring, name='delete-recurring'),
     
-    # 4. CATEGORY ACTIONS (Admin only)
+    # 4. SYNC API (JSON, for offline clients)
+    path('api/sync/changes/', views.sync_changes, name='sync-changes'),
+    path('api/sync/batch/', views.sync_batch, name='sync-batch'),
+
+    # 5. BACKGROUND JOBS
+    path('jobs/<int:pk>/', views.job_detail, name='job-detail'),
+    path('jobs/<int:pk>/status/', views.job_status, name='job-status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job-download'),
+
+    # 6. ADMIN ACTIONS (Admin only)
     path('category/add/', views.add_category, name='add-category'),
+    path('summaries/rebuild/', views.rebuild_summaries, name='rebuild-summaries'),
     
     path('register/', views.register, name='register'),
 
@@ -0,0 +1,86 @@
+"""Per-user data version stamps (``DataVersion``).
+
+``bump`` is called for every write to a user's ``Expense``,
+``MonthlyBudget`` or ``CategoryBudget`` rows: single saves and deletes
+through the signals in ``app.signals``, bulk writers (which bypass signals)
+explicitly.
+
+Written expenses carry the version of the write in ``Expense.version`` and
+deletions leave a ``Tombstone``, which is what the sync API's change feed
+reads. ``bump`` runs inside the writing transaction and the row lock it
+takes orders concurrent writers, so a user's versions follow commit order.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import sharding
+from .models import DataVersion
+
+CHUNK_SIZE = 500
+
+_tracked = ContextVar('expense_tracking', default=True)
+
+
+def bump(user_ids):
+    """Move the users' versions forward; return ``{user_id: new version}``."""
+    now = timezone.now()
+    stamped = {}
+    user_ids = sorted(set(user_ids))
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[start:start + CHUNK_SIZE]
+        updated = DataVersion.objects.filter(user_id__in=chunk).update(
+            version=F('version') + 1,
+            updated_at=now,
+        )
+        rows = DataVersion.objects.filter(user_id__in=chunk).values_list('user_id', 'version', 'updated_at')
+        for user_id, version, updated_at in rows:
+            # Without updated_at a row created concurrently after the
+            # UPDATE above would pass for one we had moved forward.
+            if updated == len(chunk) or updated_at == now:
+                stamped[user_id] = version
+        if updated == len(chunk):
+            continue
+
+        # Some users have never been stamped; they were not touched above.
+        for user_id in chunk:
+            if user_id in stamped:
+                continue
+            try:
+                with transaction.atomic(using=sharding.db()):
+                    DataVersion.objects.create(user_id=user_id, version=1, updated_at=now)
+                stamped[user_id] = 1
+            except IntegrityError:
+                DataVersion.objects.filter(user_id=user_id).update(
+                    version=F('version') + 1,
+                    updated_at=now,
+                )
+                stamped[user_id] = DataVersion.objects.get(user_id=user_id).version
+    return stamped
+
+
+def current(user):
+    """Return ``(version, updated_at)`` for ``user``; ``(0, None)`` if never written."""
+    row = DataVersion.objects.filter(user=user).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+def tracked():
+    return _tracked.get()
+
+
+@contextmanager
+def untracked():
+    """Switch off the per-row expense stamping of ``app.signals`` in the block.
+
+    For bulk writers that set ``Expense.version`` and write ``Tombstone``
+    rows themselves.
+    """
+    token = _tracked.set(False)
+    try:
+        yield
+    finally:
+        _tracked.reset(token)
@@ -1,20 +1,33 @@
-import csv
+import asyncio
+import copy
+import hashlib
 import json
-from django.core.paginator import Paginator
+import os
 from datetime import date
+from functools import wraps
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
-from django.db.models import Sum, Q
-from django.db.models.functions import TruncMonth
-from django.http import HttpResponse
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Count, Q, Sum
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition, require_POST
 from django.contrib import messages
 from django.contrib.auth import login
 
-from .models import Expense, Category, MonthlyBudget
-from .forms import ExpenseForm, CategoryForm, RegisterForm
-from django.core.paginator import Paginator
+from . import analytics, anomalies, archive, budgets, categories, jobs, sharding, summaries, sync, versions
+from .models import ArchivedExpense, CategoryBudget, Expense, Job, MonthlyBudget, MonthlySummary, RecurringTransaction
+from .forms import AdminFilterForm, AnalyticsForm, BudgetForm, ExpenseForm, ExpenseFormSet, CategoryForm, ExportForm, ImportForm, RecurringTransactionForm, RegisterForm, SearchForm
+from .exports import iter_csv_rows
+from .pagination import keyset_page
+from .ratelimit import rate_limit
+from .search import search
 
 
 
@@ -26,105 +39,212 @@ def is_admin(user):
     return user.is_staff
 
 
-# --------------------------------
-# DASHBOARD
-# --------------------------------
+def api_login_required(view):
+    """Like ``login_required``, but answer anonymous API calls with a JSON 401."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': "Authentication required."}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
 
-@login_required
-def dashboard(request):
-    selected_year = request.GET.get('year')
-    selected_year = int(selected_year) if selected_year else date.today().year
 
-    expenses = Expense.objects.filter(
-        user=request.user,
-        date__year=selected_year
+def year_range(year):
+    """Half-open ``[start, end)`` bounds of a calendar year.
+
+    Filtering on ``date__gte``/``date__lt`` keeps the ``date`` column bare so
+    the ``(user, ...)`` indexes can serve the filter as a range scan.
+    """
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def selected_year_from(request):
+    """The ``?year=`` being viewed, or the current year if it is missing or invalid."""
+    try:
+        selected_year = int(request.GET['year'])
+    except (KeyError, ValueError):
+        return date.today().year
+    # year_range() needs the following year to be a valid date too.
+    return selected_year if date.min.year <= selected_year < date.max.year else date.today().year
+
+
+def yearly_totals(user, year):
+    """Totals and chart series for one year, read from the summary rollup."""
+    # One pass over the year's rollup rows feeds every total and chart below.
+    summary_rows = (
+        MonthlySummary.objects
+        .filter(user=user, year=year)
+        .values('month', 'type', 'category_id', 'total', 'count')
+        .order_by('month')
     )
 
-    # -------------------------------
-    # MONTHLY BUDGET
-    # -------------------------------
     today = date.today()
+    monthly_spent = 0
+    income_total = 0
+    expense_total = 0
+    category_totals = {}
+    category_months = {}
+    monthly_totals = {}
+
+    for row in summary_rows:
+        month_totals = monthly_totals.setdefault(
+            row['month'], {'income': 0, 'expense': 0}
+        )
+        month_totals[row['type']] += row['total']
 
-    current_month_expenses = expenses.filter(
-        date__month=today.month,
-        type='expense'
-    )
+        if row['type'] == 'income':
+            income_total += row['total']
+            continue
+
+        expense_total += row['total']
+        name = categories.name(row['category_id'])
+        category_totals[name] = category_totals.get(name, 0) + row['total']
+        total, count = category_months.get((row['month'], row['category_id']), (0, 0))
+        category_months[(row['month'], row['category_id'])] = (total + row['total'], count + row['count'])
+        if row['month'] == today.month:
+            monthly_spent += row['total']
+
+    return {
+        'income_total': income_total,
+        'expense_total': expense_total,
+        'monthly_spent': monthly_spent,
+        'category_months': category_months,
+
+        'labels': list(category_totals),
+        'data': [float(total) for total in category_totals.values()],
+
+        'monthly_labels': [
+            date(year, month, 1).strftime('%b') for month in monthly_totals
+        ],
+        'monthly_income': [
+            float(totals['income']) for totals in monthly_totals.values()
+        ],
+        'monthly_expense': [
+            float(totals['expense']) for totals in monthly_totals.values()
+        ],
+    }
 
-    monthly_spent = current_month_expenses.aggregate(
-        Sum('amount')
-    )['amount__sum'] or 0
 
+def _data_version(request):
+    if not hasattr(request, '_data_version'):
+        request._data_version = versions.current(request.user)
+    return request._data_version
+
+
+def _dashboard_etag(request, *args, **kwargs):
+    # Pending flash messages are rendered into the page, so never 304 them away.
+    if len(messages.get_messages(request)):
+        return None
+
+    version, _ = _data_version(request)
+    # The page embeds a CSRF token; create its secret now on a first visit,
+    # so the ETag sent matches the cookie the client sends back with it.
+    get_token(request)
+    key = ":".join([
+        str(request.user.pk),
+        str(version),
+        date.today().isoformat(),
+        categories.stamp(),
+        request.get_full_path(),
+        request.META['CSRF_COOKIE'],
+    ])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _dashboard_last_modified(request, *args, **kwargs):
+    if len(messages.get_messages(request)):
+        return None
+    return _data_version(request)[1]
+
+
+def _dashboard_validators(request):
+    etag = _dashboard_etag(request)
+    return quote_etag(etag) if etag else None, _dashboard_last_modified(request)
+
+
+# --------------------------------
+# DASHBOARD
+# --------------------------------
+
+def current_budget(user):
+    today = date.today()
     budget_obj = MonthlyBudget.objects.filter(
-        user=request.user,
+        user=user,
         year=today.year,
         month=today.month
     ).first()
+    return budget_obj.amount if budget_obj else 0
 
-    budget_amount = budget_obj.amount if budget_obj else 0
-    remaining_budget = budget_amount - monthly_spent
-    budget_percentage = (
-        (monthly_spent / budget_amount * 100)
-        if budget_amount > 0 else 0
+
+def available_years(user):
+    """Years with transactions, archived or not, newest first."""
+    years = set(
+        MonthlySummary.objects.filter(user=user)
+        .values_list('year', flat=True)
+        .distinct()
+        .order_by()
     )
+    years.add(date.today().year)
+    return sorted(years, reverse=True)
 
-    # -------------------------------
-    # Income / Expense Totals
-    # -------------------------------
-    income_total = expenses.filter(type='income').aggregate(
-        Sum('amount')
-    )['amount__sum'] or 0
 
-    expense_total = expenses.filter(type='expense').aggregate(
-        Sum('amount')
-    )['amount__sum'] or 0
+def transactions_page(request, user, selected_year):
+    year_start, year_end = year_range(selected_year)
+    expenses = Expense.objects.filter(
+        user=user,
+        date__gte=year_start,
+        date__lt=year_end
+    )
+    if archive.is_archived(user, selected_year):
+        # Rows added to the year after it was archived stay in Expense.
+        expenses = [expenses, ArchivedExpense.objects.filter(
+            user=user,
+            date__gte=year_start,
+            date__lt=year_end
+        )]
+    return keyset_page(
+        expenses,
+        10,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
 
-    profit = income_total - expense_total
-    savings_rate = (profit / income_total * 100) if income_total > 0 else 0
+def dashboard_context(selected_year, years, totals, budget_amount, page_obj, stats):
+    income_total = totals['income_total']
+    expense_total = totals['expense_total']
+    monthly_spent = totals['monthly_spent']
 
     # -------------------------------
-    # Category Chart
+    # MONTHLY BUDGET
     # -------------------------------
-    category_data = (
-        expenses.filter(type='expense')
-        .values('category__name')
-        .annotate(total=Sum('amount'))
+    remaining_budget = budget_amount - monthly_spent
+    budget_percentage = (
+        (monthly_spent / budget_amount * 100)
+        if budget_amount > 0 else 0
     )
 
-    labels = [item['category__name'] or "General" for item in category_data]
-    data = [float(item['total']) for item in category_data]
-
     # -------------------------------
-    # Monthly Income vs Expense Chart
+    # Income / Expense Totals
     # -------------------------------
-    monthly_data = (
-        expenses
-        .annotate(month=TruncMonth('date'))
-        .values('month')
-        .annotate(
-            income=Sum('amount', filter=Q(type='income')),
-            expense=Sum('amount', filter=Q(type='expense')),
-        )
-        .order_by('month')
-    )
-
-    monthly_labels = []
-    monthly_income = []
-    monthly_expense = []
-
-    for item in monthly_data:
-        monthly_labels.append(item['month'].strftime('%b'))
-        monthly_income.append(float(item['income'] or 0))
-        monthly_expense.append(float(item['expense'] or 0))
+    profit = income_total - expense_total
+    savings_rate = (profit / income_total * 100) if income_total > 0 else 0
 
     # -------------------------------
-    # Pagination
+    # Unusual Spending
     # -------------------------------
-    expenses = expenses.order_by('-date')
-    paginator = Paginator(expenses, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    return render(request, 'app/dashboard.html', {
+    unusual_months = [
+        {
+            'month': date(selected_year, month, 1).strftime('%B'),
+            'category': categories.name(category_id),
+            'total': total,
+            'expected': expected,
+        }
+        for month, category_id, total, expected
+        in anomalies.unusual_months(stats, totals['category_months'])
+    ]
+
+    return {
         'income_total': income_total,
         'expense_total': expense_total,
         'profit': profit,
@@ -135,18 +255,234 @@ def dashboard(request):
         'remaining_budget': remaining_budget,
         'budget_percentage': round(budget_percentage, 2),
 
-        'labels': json.dumps(labels),
-        'data': json.dumps(data),
+        'labels': json.dumps(totals['labels']),
+        'data': json.dumps(totals['data']),
+
+        'monthly_labels': json.dumps(totals['monthly_labels']),
+        'monthly_income': json.dumps(totals['monthly_income']),
+        'monthly_expense': json.dumps(totals['monthly_expense']),
 
-        'monthly_labels': json.dumps(monthly_labels),
-        'monthly_income': json.dumps(monthly_income),
-        'monthly_expense': json.dumps(monthly_expense),
+        'unusual_months': unusual_months,
+        'unusual_expenses': anomalies.unusual_expenses(stats, page_obj),
 
         'selected_year': selected_year,
+        'years': years,
         'page_obj': page_obj,
+    }
+
+
+@rate_limit('expensive')
+@login_required
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_last_modified)
+def dashboard(request):
+    selected_year = selected_year_from(request)
+
+    return render(request, 'app/dashboard.html', dashboard_context(
+        selected_year,
+        available_years(request.user),
+        yearly_totals(request.user, selected_year),
+        current_budget(request.user),
+        transactions_page(request, request.user, selected_year),
+        anomalies.for_user(request.user),
+    ))
+
+
+def _run_read(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def gather_reads(*calls):
+    """Run independent read-only ORM calls concurrently.
+
+    Django's async ORM methods still funnel every query through one shared
+    thread, so each call here gets a worker thread (and therefore its own
+    database connection) instead. Inside an open transaction other
+    connections could not see uncommitted rows, so the calls then run one
+    after another on the request's own connection.
+    """
+    in_transaction = await sync_to_async(lambda: connections[sharding.db()].in_atomic_block)()
+    if in_transaction:
+        return [await sync_to_async(func)(*args) for func, *args in calls]
+
+    return await asyncio.gather(*(
+        sync_to_async(_run_read, thread_sensitive=False)(func, *args)
+        for func, *args in calls
+    ))
+
+
+@rate_limit('expensive')
+@login_required
+async def async_dashboard(request):
+    """ASGI variant of ``dashboard`` that issues its reads concurrently."""
+    etag, last_modified = await sync_to_async(_dashboard_validators)(request)
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is None:
+        response = await _render_dashboard(request)
+    # Like @condition, send the validators with a 304 as well.
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    if last_modified:
+        response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    return response
+
+
+async def _render_dashboard(request):
+    user = await request.auser()
+    selected_year = selected_year_from(request)
+
+    years, totals, budget_amount, page_obj, stats = await gather_reads(
+        (available_years, user),
+        (yearly_totals, user, selected_year),
+        (current_budget, user),
+        (transactions_page, request, user, selected_year),
+        (anomalies.for_user, user),
+    )
+
+    return await sync_to_async(render)(request, 'app/dashboard.html', dashboard_context(
+        selected_year, years, totals, budget_amount, page_obj, stats,
+    ))
+
+
+@login_required
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_last_modified)
+def chart_data(request):
+    selected_year = selected_year_from(request)
+    totals = yearly_totals(request.user, selected_year)
+
+    return JsonResponse({
+        'year': selected_year,
+        'income_total': float(totals['income_total']),
+        'expense_total': float(totals['expense_total']),
+        'category': {
+            'labels': totals['labels'],
+            'data': totals['data'],
+        },
+        'monthly': {
+            'labels': totals['monthly_labels'],
+            'income': totals['monthly_income'],
+            'expense': totals['monthly_expense'],
+        },
+    })
+
+
+@rate_limit('expensive')
+@login_required
+@condition(etag_func=_dashboard_etag)
+def analytics_data(request):
+    if not analytics.available():
+        return JsonResponse({'error': "Analytics need NumPy installed."}, status=501)
+
+    form = AnalyticsForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors.get_json_data()}, status=400)
+
+    start = form.cleaned_data['start']
+    end = form.cleaned_data['end']
+    data = analytics.history(request.user, _data_version(request)[0])
+    by_category = analytics.category_totals(data, start, end)
+
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'granularity': form.cleaned_data['granularity'],
+        'totals': analytics.totals(data, start, end, form.cleaned_data['granularity']),
+        'rolling': analytics.rolling_average(data, start, end),
+        'year_over_year': analytics.year_over_year(data, end.year),
+        'categories': {
+            'labels': [categories.name(pk) for pk in by_category],
+            'data': list(by_category.values()),
+        },
+    })
+
+
+# --------------------------------
+# BUDGETS
+# --------------------------------
+
+BUDGET_HISTORY_YEARS = 5
+
+
+@login_required
+def budget_history(request):
+    if request.method == 'POST':
+        form = BudgetForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            if data['category']:
+                CategoryBudget.objects.update_or_create(
+                    user=request.user, year=data['year'], month=data['month'],
+                    category=data['category'],
+                    defaults={'amount': data['amount']},
+                )
+            else:
+                MonthlyBudget.objects.update_or_create(
+                    user=request.user, year=data['year'], month=data['month'],
+                    defaults={'amount': data['amount']},
+                )
+            messages.success(request, "Budget saved.")
+            return redirect('budget-history')
+    else:
+        today = date.today()
+        form = BudgetForm(initial={'year': today.year, 'month': today.month})
+
+    since_year = date.today().year - BUDGET_HISTORY_YEARS + 1
+    return render(request, 'app/budget_history.html', {
+        'form': form,
+        'months': budgets.history(request.user, since_year=since_year),
+        'since_year': since_year,
+    })
+
+
+# --------------------------------
+# RECURRING TRANSACTIONS
+# --------------------------------
+
+@login_required
+def recurring_transactions(request):
+    if request.method == 'POST':
+        form = RecurringTransactionForm(request.POST)
+        if form.is_valid():
+            schedule = form.save(commit=False)
+            schedule.user = request.user
+            schedule.save()
+            messages.success(request, "Recurring transaction added. Due occurrences are created by the next generation run.")
+            return redirect('recurring-transactions')
+    else:
+        form = RecurringTransactionForm(initial={'start_date': date.today()})
+
+    schedules = RecurringTransaction.objects.filter(user=request.user).order_by('-active', 'next_date')
+    for schedule in schedules:
+        schedule.category = categories.get(schedule.category_id)
+
+    return render(request, 'app/recurring_transactions.html', {
+        'form': form,
+        'schedules': schedules,
     })
 
 
+@login_required
+def delete_recurring(request, pk):
+    schedule = get_object_or_404(RecurringTransaction, pk=pk, user=request.user)
+    if request.method == 'POST':
+        # Transactions already generated are kept. Unlink them here rather
+        # than through SET_NULL, which skips the version stamp sync reads.
+        with transaction.atomic(using=sharding.db()):
+            generated = Expense.objects.filter(recurring=schedule)
+            if generated.exists():
+                version = versions.bump([request.user.pk])[request.user.pk]
+                generated.update(recurring=None, version=version)
+            schedule.delete()
+        messages.success(request, "Recurring transaction removed.")
+    return redirect('recurring-transactions')
+
 
 # --------------------------------
 # EXPENSE CRUD
@@ -159,7 +495,9 @@ def add_expense(request):
         if form.is_valid():
             expense = form.save(commit=False)
             expense.user = request.user
-            expense.save()
+            with transaction.atomic(using=sharding.db()):
+                expense.save()
+                summaries.record(expense)
             messages.success(request, "Expense added successfully!")
             return redirect('index')
     else:
@@ -168,14 +506,42 @@ def add_expense(request):
     return render(request, 'app/add_expense.html', {'form': form})
 
 
+@login_required
+def add_expenses(request):
+    if request.method == 'POST':
+        formset = ExpenseFormSet(request.POST)
+        if formset.is_valid():
+            expenses = [
+                form.save(commit=False) for form in formset
+                if form.has_changed()
+            ]
+            with transaction.atomic(using=sharding.db()):
+                version = versions.bump([request.user.pk])[request.user.pk]
+                for expense in expenses:
+                    expense.user = request.user
+                    expense.version = version
+                Expense.objects.bulk_create(expenses)
+                summaries.record_many(expenses)
+            messages.success(request, f"Added {len(expenses)} transactions!")
+            return redirect('index')
+    else:
+        formset = ExpenseFormSet()
+
+    return render(request, 'app/add_expenses.html', {'formset': formset})
+
+
 @login_required
 def edit_expense(request, pk):
     expense = get_object_or_404(Expense, pk=pk, user=request.user)
 
     if request.method == "POST":
+        previous = copy.copy(expense)
         form = ExpenseForm(request.POST, instance=expense)
         if form.is_valid():
-            form.save()
+            with transaction.atomic(using=sharding.db()):
+                form.save()
+                summaries.record(previous, -1)
+                summaries.record(expense)
             messages.success(request, "Expense updated!")
             return redirect('index')
     else:
@@ -192,7 +558,9 @@ def delete_expense(request, pk):
     expense = get_object_or_404(Expense, pk=pk, user=request.user)
 
     if request.method == "POST":
-        expense.delete()
+        with transaction.atomic(using=sharding.db()):
+            summaries.record(expense, -1)
+            expense.delete()
         messages.success(request, "Expense deleted successfully!")
         return redirect('index')
 
@@ -200,48 +568,244 @@ def delete_expense(request, pk):
 
 
 
+@login_required
+def search_expenses(request):
+    form = SearchForm(request.GET)
+    page_obj = None
+
+    if form.is_valid() and form.cleaned_data['q']:
+        page_obj = search(
+            request.user,
+            form.cleaned_data['q'],
+            form.cleaned_data,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    filters.pop('before', None)
+
+    return render(request, 'app/search.html', {
+        'form': form,
+        'page_obj': page_obj,
+        'filters': filters.urlencode(),
+    })
+
+
+@login_required
+def import_expenses(request):
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            job = jobs.enqueue(request.user, 'import', input_file=form.cleaned_data['file'])
+            return redirect('job-detail', pk=job.pk)
+    else:
+        form = ImportForm()
+
+    return render(request, 'app/import_expenses.html', {'form': form})
+
+
+@rate_limit('expensive')
 @login_required
 def export_expenses(request):
-    response = HttpResponse(content_type='text/csv')
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    # The rows are streamed after ShardMiddleware has returned, so the shard
+    # is bound to the querysets here.
+    alias = sharding.for_user(request.user)
+    expenses = form.filter(Expense.objects.using(alias).filter(user=request.user))
+    archived = form.filter(ArchivedExpense.objects.using(alias).filter(user=request.user))
+
+    response = StreamingHttpResponse(iter_csv_rows(expenses, archived), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="expenses.csv"'
+    return response
 
-    writer = csv.writer(response)
-    writer.writerow(['Category', 'Amount', 'Date', 'Description'])
 
-    expenses = Expense.objects.filter(user=request.user)
+@login_required
+def start_export(request):
+    if request.method != 'POST':
+        return redirect('index')
 
-    for e in expenses:
-        writer.writerow([
-            e.category.name if e.category else "General",
-            e.amount,
-            e.date,
-            e.description
-        ])
+    form = ExportForm(request.POST)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    params = {name: request.POST.get(name, '') for name in form.fields}
+    job = jobs.enqueue(request.user, 'export', params=params)
+    return redirect('job-detail', pk=job.pk)
+
+
+# --------------------------------
+# BACKGROUND JOBS
+# --------------------------------
+
+def job_state(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'download_url': (
+            reverse('job-download', args=[job.pk])
+            if job.status == Job.SUCCEEDED and job.output_file else None
+        ),
+    }
 
-    return response
+
+@login_required
+def job_detail(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    return render(request, 'app/job_detail.html', {
+        'job': job,
+        'state': job_state(job),
+    })
+
+
+@login_required
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    return JsonResponse(job_state(job))
+
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user, status=Job.SUCCEEDED)
+    if not job.output_file:
+        raise Http404("This job has no file to download.")
+    return FileResponse(
+        job.output_file.open('rb'),
+        as_attachment=True,
+        filename=os.path.basename(job.output_file.name),
+    )
+
+
+# --------------------------------
+# SYNC API
+# --------------------------------
+
+@api_login_required
+def sync_changes(request):
+    try:
+        limit = min(max(int(request.GET.get('limit', sync.PAGE_SIZE)), 1), sync.PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': "Invalid limit."}, status=400)
+
+    try:
+        return JsonResponse(sync.changes(request.user, request.GET.get('cursor'), limit))
+    except sync.SyncError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+
+@api_login_required
+@require_POST
+def sync_batch(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': "Expected a JSON object with an 'operations' list."}, status=400)
+
+    try:
+        results = sync.apply(request.user, payload.get('operations'))
+    except sync.SyncError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({'results': results})
 
 
 # --------------------------------
 # ADMIN
 # --------------------------------
 
+@rate_limit('expensive')
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    users = User.objects.all()
-    expenses = Expense.objects.all().order_by('-date')
-
-    total_spent = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+    form = AdminFilterForm(request.GET)
+    if not form.is_valid():
+        # Unfiltered figures under the filters typed in would mislead.
+        return render(request, 'app/admin_dashboard.html', {
+            'form': form,
+            'total_users': User.objects.count(),
+        }, status=400)
+
+    # Every query below runs once per shard and the results are combined.
+    shards = [form.filter(Expense.objects.using(alias)) for alias in sharding.aliases()]
+
+    total_spent = 0
+    total_transactions = 0
+    for expenses in shards:
+        totals = expenses.aggregate(
+            total_spent=Sum('amount', filter=Q(type='expense')),
+            total_transactions=Count('id'),
+        )
+        total_spent += totals['total_spent'] or 0
+        total_transactions += totals['total_transactions']
     total_spent = round(total_spent, 2)
 
+    # -------------------------------
+    # Top spenders, one grouped query per shard
+    # -------------------------------
+    # A user's rows are all in one shard, so the overall top ten is among
+    # the shards' top tens.
+    leaders = []
+    for expenses in shards:
+        leaders += (
+            expenses.filter(type='expense')
+            .values('user_id')
+            .annotate(total=Sum('amount'), transactions=Count('id'))
+            .order_by('-total')[:10]
+        )
+    leaders = sorted(leaders, key=lambda row: row['total'], reverse=True)[:10]
+
+    # -------------------------------
+    # Recent activity
+    # -------------------------------
+    page_obj = keyset_page(
+        shards,
+        25,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
+    users = User.objects.in_bulk(
+        {row['user_id'] for row in leaders} | {expense.user_id for expense in page_obj}
+    )
+    leaderboard = [
+        {**row, 'username': users[row['user_id']].username if row['user_id'] in users else ''}
+        for row in leaders
+    ]
+    for expense in page_obj:
+        if expense.user_id in users:
+            expense.user = users[expense.user_id]
+        expense.category = categories.get(expense.category_id)
+
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    filters.pop('before', None)
 
     return render(request, 'app/admin_dashboard.html', {
-        'users': users,
-        'expenses': expenses,
+        'form': form,
+        'filters': filters.urlencode(),
+        'leaderboard': leaderboard,
+        'page_obj': page_obj,
         'total_spent': total_spent,
-        'total_users': users.count(),
+        'total_transactions': total_transactions,
+        'total_users': User.objects.count(),
     })
 
 
+@user_passes_test(is_admin)
+def rebuild_summaries(request):
+    if request.method != 'POST':
+        return redirect('admin-dashboard')
+    job = jobs.enqueue(request.user, 'rebuild_summaries')
+    return redirect('job-detail', pk=job.pk)
+
+
 @user_passes_test(is_admin)
 def add_category(request):
     if request.method == 'POST':
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,11 +43,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.middleware.CachedAuthenticationMiddleware',
+    'app.middleware.RateLimitMiddleware',
+    'app.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +80,157 @@ WSGI_APPLICATION = 'et.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Pick a profile with the ET_DB_PROFILE environment variable:
+#   development - plain SQLite, a new connection per request (the default)
+#   sqlite      - SQLite tuned for concurrent writers: WAL, busy timeout,
+#                 IMMEDIATE transactions and persistent connections
+#   postgres    - PostgreSQL through a psycopg connection pool, configured
+#                 with the ET_DB_* variables
+
+DATABASE_PROFILES = {
+    'development': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('ET_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a writer waits for the lock instead of failing with
+            # "database is locked".
+            'timeout': 20,
+            # Take the write lock at BEGIN so a read-then-write transaction
+            # never has to upgrade its lock (which fails without waiting).
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-64000;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('ET_DB_NAME', 'expense_tracker'),
+        'USER': os.environ.get('ET_DB_USER', ''),
+        'PASSWORD': os.environ.get('ET_DB_PASSWORD', ''),
+        'HOST': os.environ.get('ET_DB_HOST', ''),
+        'PORT': os.environ.get('ET_DB_PORT', ''),
+        # Connections are reused through the pool, so CONN_MAX_AGE stays 0.
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('ET_DB_POOL_MIN', 2)),
+                'max_size': int(os.environ.get('ET_DB_POOL_MAX', 10)),
+                'timeout': 10,
+            },
+        },
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[os.environ.get('ET_DB_PROFILE', 'development')],
+}
+
+# Per-user sharding (see app.sharding): with ET_SHARDS=N each user's
+# expenses, budgets and rollups live in one of N extra databases of the same
+# profile (db-shard0.sqlite3, ... or expense_tracker_shard0, ...), so writes
+# of different users do not wait for each other. Users, categories, sessions
+# and jobs stay in 'default'. Create them with
+#   manage.py migrate && manage.py migrate --database shard0 ...
+# Changing N moves users between shards; there is no rebalancing.
+
+SHARDS = [f'shard{i}' for i in range(int(os.environ.get('ET_SHARDS', 0)))]
+
+
+def shard_database(default, index):
+    shard = {**default, 'OPTIONS': {**default.get('OPTIONS', {})}}
+    if default['ENGINE'].endswith('sqlite3'):
+        name = Path(default['NAME'])
+        shard['NAME'] = name.with_name(f'{name.stem}-shard{index}{name.suffix}')
+    else:
+        shard['NAME'] = f"{default['NAME']}_shard{index}"
+    return shard
+
+
+for index, alias in enumerate(SHARDS):
+    DATABASES[alias] = shard_database(DATABASES['default'], index)
+
+DATABASE_ROUTERS = ['app.sharding.ShardRouter'] if SHARDS else []
+
+
+# Sessions
+# Pick where sessions live with the ET_SESSION_PROFILE environment variable:
+#   database       - a django_session lookup on every request (the default)
+#   cache          - read from the cache, written through to the database
+#   signed_cookies - kept in the client's cookie; no server-side state, so a
+#                    copied cookie stays valid until it expires even after
+#                    logout. Password changes still end it (see below).
+
+SESSION_PROFILES = {
+    'database': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSION_ENGINE = SESSION_PROFILES[os.environ.get('ET_SESSION_PROFILE', 'database')]
+
+
+# Cache
+# Pick a backend with the ET_CACHE_PROFILE environment variable:
+#   local     - memory of each worker process (the default); nothing written
+#               by one worker is seen by the others
+#   redis     - Redis at ET_CACHE_LOCATION (redis://127.0.0.1:6379/0)
+#   memcached - Memcached at ET_CACHE_LOCATION (127.0.0.1:11211), through
+#               pymemcache
+# Features that must agree across workers (the user cache below, rate
+# limiting) need redis or memcached; app.checks refuses to start them on a
+# per-process cache.
+
+CACHE_PROFILES = {
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('ET_CACHE_LOCATION', 'redis://127.0.0.1:6379/0'),
+    },
+    'memcached': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ.get('ET_CACHE_LOCATION', '127.0.0.1:11211'),
+    },
+}
+
+CACHE_PROFILE = os.environ.get('ET_CACHE_PROFILE', 'local')
+
+CACHES = {
+    'default': CACHE_PROFILES[CACHE_PROFILE],
 }
 
+# Seconds the logged-in User is kept in the cache instead of being fetched
+# on every request (0, the default, fetches it every time). The copy is
+# dropped when the user is saved or logs out, which only reaches every
+# worker process through a shared cache, so this needs ET_CACHE_PROFILE
+# redis or memcached.
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('ET_AUTH_USER_CACHE_TIMEOUT', 0))
+
+
+# Rate limiting (see app.ratelimit): each user, or IP address when logged
+# out, may burst up to `burst` requests per budget and then `rate` requests
+# per second. Views marked @rate_limit('expensive') (dashboard, analytics,
+# admin dashboard, CSV export) use the tighter budget. The allowances must
+# be shared by every worker, so limiting is on only with a shared cache
+# (ET_CACHE_PROFILE redis or memcached); RATE_LIMITS = {} turns it off.
+RATE_LIMIT_CACHE = 'default'
+RATE_LIMITS = {
+    'default': {'rate': 10, 'burst': 100},
+    'expensive': {'rate': 0.5, 'burst': 20},
+} if CACHE_PROFILE != 'local' else {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -119,5 +267,51 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+# Job inputs and outputs (imports, exports). Served through the app's
+# permission-checked download view, never directly.
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Where `manage.py generate_statements` writes monthly statements.
+STATEMENTS_ROOT = BASE_DIR / 'statements'
+
 LOGOUT_REDIRECT_URL = 'login'
-LOGIN_REDIRECT_URL = 'index'
\ No newline at end of file
+LOGIN_REDIRECT_URL = 'index'
+
+
+# Serve the dashboard from the async view, which runs its independent
+# queries concurrently. Only worthwhile when deployed under ASGI (et.asgi).
+ASYNC_DASHBOARD = False
+
+# Per-request SQL / view / template timing, for profiling: it wraps every
+# query and template render. Requests slower than the threshold are logged
+# to 'app.performance'; the figures are also sent in a Server-Timing header,
+# to staff users only unless DEBUG is on.
+REQUEST_TIMING_ENABLED = False
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+# Background jobs run by `manage.py run_jobs`: a failed job is retried up
+# to JOB_MAX_ATTEMPTS times, waiting JOB_RETRY_DELAY seconds (doubling each
+# time); a job still running after JOB_TIMEOUT seconds is assumed orphaned.
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_TIMEOUT = 3600
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'app.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'app.jobs': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}